@@ -0,0 +1,170 @@
+import os
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from calibration import CameraCalibrator
+from detection import QuadrantDetector
+from processing import ImageProcessor, RENDER_MEMORY_LIMIT, detect_reduced, full_resolution_corners
+from quality import read_reduced, reduction_factor
+
+# What correct() and process_many() give back:
+#   image    the corrected square (None unless status is "ok")
+#   corners  the corners used, in undistorted coordinates (None unless "ok")
+#   score    detection confidence, 1.0 when corners were given
+#   status   "ok", "review" (not found, unsure or poor quality) or "failed"
+#   message  why, when not "ok"
+#   quality  quality screen problems (empty without a screen)
+#   source   the path, or None for an array
+Correction = namedtuple('Correction', ['image', 'corners', 'score', 'status', 'message', 'quality', 'source'])
+
+
+class QuadrantCorrector:
+    """The processing chain as a library: arrays (or paths) in, arrays out.
+
+    No prompts, windows or temporary files. The calibration is loaded once;
+    undistortion maps (per resolution) and colour tables are built on first
+    use and shared by every later call and thread, so per image there is only
+    the detection and the render itself.
+
+        corrector = QuadrantCorrector(red_level=3)
+        result = corrector.correct(frame)            # BGR uint8 array or path
+        for result in corrector.process_many(frames, jobs=4):
+            ...
+
+    Corners, when given, are in undistorted image coordinates like
+    everywhere else (corners manifest, run manifest). With rgb=True arrays
+    go in and come out in RGB order (PIL, scikit-image, matplotlib).
+    """
+
+    def __init__(self, calibration_store='calibrations', profile=None, calibration_file='gopro_calibration.pkl',
+                 red_level=3, output_size=2000, min_confidence=0.8, frame_colour='white', quality=None,
+                 color_profile=None, max_memory=RENDER_MEMORY_LIMIT, rgb=False, calibrator=None):
+        if calibrator is None:
+            calibrator = CameraCalibrator(calibration_file, calibration_store, profile)
+            if not calibrator.load_calibration():
+                print(f"⚠ No calibration found in {calibration_store}, proceeding without distortion correction")
+        self.calibrator = calibrator
+        self.red_level = red_level
+        self.output_size = output_size
+        self.min_confidence = min_confidence
+        # Optional quality.QualityScreen, run on the reduced image before detection
+        self.quality = quality
+        self.rgb = rgb
+        self.processor = ImageProcessor(color_profile=color_profile, max_memory=max_memory)
+        # Keeps no per-image state, one is shared by every thread
+        self.detector = QuadrantDetector(frame_colour=frame_colour)
+
+    def correct(self, source, corners=None, red_level=None, output_size=None, camera_model=None):
+        """Correct one image: a BGR (or RGB, see rgb) uint8 array or a file path.
+
+        Without corners the quadrat is auto-detected; below min_confidence
+        the result has status "review" and no image. camera_model picks the
+        calibration profile for arrays when the store has several (paths
+        use their EXIF). Raises ValueError for arrays that aren't images.
+        """
+        red_level = self.red_level if red_level is None else red_level
+        output_size = output_size or self.output_size
+        detector = self.detector
+        path = os.fspath(source) if isinstance(source, (str, os.PathLike)) else None
+        problems = []
+        score = 1.0
+
+        if path is not None:
+            calibrator = self.calibrator.for_file(path)
+            if corners is None:
+                # Detect on a reduced JPEG decode, as the batch does
+                reduced, factor = read_reduced(path, detector.coarse_size)
+                if reduced is None:
+                    return Correction(None, None, 0.0, "failed", "failed to load image", problems, path)
+            image = None
+        else:
+            image = self._as_bgr(source)
+            h, w = image.shape[:2]
+            calibrator = self.calibrator.for_size((w, h), camera_model)
+            if corners is None:
+                # Area averaging by a whole factor keeps the same pixel centres as a reduced decode
+                factor = reduction_factor((w, h), detector.coarse_size)
+                reduced = image if factor == 1 else cv2.resize(image, None, fx=1 / factor, fy=1 / factor,
+                                                               interpolation=cv2.INTER_AREA)
+
+        if corners is None:
+            if self.quality is not None and self.quality.enabled:
+                metrics, problems = self.quality.check(reduced)
+                if problems and self.quality.action == 'skip':
+                    return Correction(None, None, 0.0, "review", "poor quality: " + ", ".join(problems),
+                                      problems, path)
+            raw_corners, score = detect_reduced(reduced, factor, calibrator, detector)
+            reduced = None
+            if raw_corners is None:
+                return Correction(None, None, 0.0, "review", "no quadrant found", problems, path)
+            if score < self.min_confidence:
+                return Correction(None, None, score, "review", f"low confidence ({score:.2f})", problems, path)
+
+        if image is None:
+            image = cv2.imread(path)
+            if image is None:
+                return Correction(None, None, 0.0, "failed", "failed to load image", problems, path)
+        if corners is None:
+            corners = full_resolution_corners(image, raw_corners, factor, calibrator, detector)
+        else:
+            corners = np.asarray(corners, dtype=np.float32).reshape(4, 2)
+
+        enhanced = self.processor.render_quadrant(image, corners, red_level, calibrator, output_size)
+        if self.rgb:
+            enhanced = cv2.cvtColor(enhanced, cv2.COLOR_BGR2RGB)
+        return Correction(enhanced, corners, score, "ok", "", problems, path)
+
+    def process_many(self, items, jobs=1, max_pending=None, **options):
+        """Correct a stream of images, yielding a Correction per item in input order.
+
+        items are sources or (source, corners) pairs, from any iterable
+        (a generator reading frames works). With jobs > 1 images are corrected
+        on that many threads (OpenCV releases the GIL, and threads share the
+        maps and colour tables instead of copying them). At most max_pending
+        (default 2 * jobs) images are taken from items ahead of the one being
+        yielded, so memory stays bounded however long the stream is. A failing
+        image gives a "failed" result instead of stopping the stream. options
+        go to correct() (red_level, output_size, camera_model).
+        """
+        if jobs <= 1:
+            for item in items:
+                yield self._correct_item(item, options)
+            return
+
+        max_pending = max_pending or 2 * jobs
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            try:
+                for item in items:
+                    pending.append(pool.submit(self._correct_item, item, options))
+                    if len(pending) >= max_pending:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                # Caller stopped early: don't render what nobody will read
+                for future in pending:
+                    future.cancel()
+
+    def _correct_item(self, item, options):
+        source, corners = item if isinstance(item, tuple) else (item, None)
+        try:
+            return self.correct(source, corners, **options)
+        except Exception as e:
+            path = os.fspath(source) if isinstance(source, (str, os.PathLike)) else None
+            return Correction(None, None, 0.0, "failed", str(e), [], path)
+
+    def _as_bgr(self, image):
+        image = np.asarray(image)
+        if image.dtype != np.uint8:
+            raise ValueError(f"expected a uint8 image, got {image.dtype}")
+        if image.ndim == 2:
+            return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        if image.ndim != 3 or image.shape[2] not in (3, 4):
+            raise ValueError(f"expected an HxW, HxWx3 or HxWx4 image, got shape {image.shape}")
+        if image.shape[2] == 4:
+            return cv2.cvtColor(image, cv2.COLOR_RGBA2BGR if self.rgb else cv2.COLOR_BGRA2BGR)
+        return cv2.cvtColor(image, cv2.COLOR_RGB2BGR) if self.rgb else image
@@ -0,0 +1,281 @@
+import contextlib
+import io
+import json
+import os
+import platform
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from calibration import CameraCalibrator, CHESSBOARD_CACHE_NAME
+from detection import QuadrantDetector
+from processing import ImageProcessor
+from synthetic import GOPRO_SIZE, SYNTHETIC_DISTORTION, chessboard_set, quadrat_frame, random_corners, synthetic_calibrator
+
+try:
+    import resource  # not on Windows
+except ImportError:
+    resource = None
+
+BENCHMARK_VERSION = 1
+DATASET_NAME = "dataset.json"
+STAGES = ('decode', 'undistort', 'detect', 'warp', 'enhance', 'encode')
+
+# How much worse than the baseline a run may be before it counts as a regression
+DEFAULT_THRESHOLDS = {
+    'time_ratio': 1.25,          # stage median time, relative
+    'memory_ratio': 1.25,        # stage peak allocation, relative
+    'corner_error_px': 0.25,     # mean corner error, absolute increase
+    'detection_rate': 0.0,       # fraction of frames detected, absolute drop
+    'reprojection_px': 0.05,     # mean calibration reprojection error, absolute increase
+    'focal_error_pct': 0.5,      # focal length error, absolute increase
+}
+
+
+def generate_dataset(folder, frames=5, image_size=GOPRO_SIZE, chessboards=12, chessboard_size=(8, 6), seed=0):
+    """Write synthetic quadrat frames and chessboard views with their ground truth.
+
+    An existing dataset with the same settings is reused, generating a full
+    size set takes a few seconds per image.
+    """
+    settings = {'frames': frames, 'image_size': list(image_size), 'chessboards': chessboards,
+                'chessboard_size': list(chessboard_size), 'seed': seed,
+                'distortion': list(SYNTHETIC_DISTORTION)}
+    index_path = os.path.join(folder, DATASET_NAME)
+    if os.path.exists(index_path):
+        with open(index_path, 'r', encoding='utf-8') as f:
+            dataset = json.load(f)
+        if dataset.get('settings') == settings:
+            return dataset
+
+    print(f"🧪 Generating synthetic dataset in {folder} ({frames} frames, {chessboards} chessboards)...")
+    rng = np.random.default_rng(seed)
+    calibrator = synthetic_calibrator(image_size)
+    frames_folder = os.path.join(folder, 'frames')
+    boards_folder = os.path.join(folder, 'chessboards')
+    os.makedirs(frames_folder, exist_ok=True)
+    os.makedirs(boards_folder, exist_ok=True)
+
+    truth = {}
+    for i in range(frames):
+        corners = random_corners(image_size, rng)
+        name = f"quadrat_{i:02d}.jpg"
+        cv2.imwrite(os.path.join(frames_folder, name), quadrat_frame(image_size, calibrator, corners, rng),
+                    [cv2.IMWRITE_JPEG_QUALITY, 95])
+        truth[name] = corners.tolist()
+    for i, image in enumerate(chessboard_set(image_size, calibrator, chessboard_size, chessboards, rng)):
+        cv2.imwrite(os.path.join(boards_folder, f"board_{i:02d}.jpg"), image, [cv2.IMWRITE_JPEG_QUALITY, 95])
+
+    dataset = {'settings': settings, 'camera_matrix': calibrator.camera_matrix.tolist(), 'corners': truth}
+    with open(index_path, 'w', encoding='utf-8') as f:
+        json.dump(dataset, f, indent=2)
+    return dataset
+
+
+def run_benchmark(folder, frames=5, image_size=GOPRO_SIZE, chessboards=12, seed=0,
+                  output_size=2000, red_level=3, jobs=None):
+    """Time every pipeline stage on the synthetic set and measure accuracy. Returns a results dict."""
+    dataset = generate_dataset(folder, frames, image_size, chessboards, seed=seed)
+    calibrator = synthetic_calibrator(image_size)
+    detector = QuadrantDetector()
+    processor = ImageProcessor()
+    processor.enhance_colors(np.zeros((1, 1, 3), np.uint8), red_level, correct_aberration=False)  # build the LUT up front
+
+    times = {stage: [] for stage in STAGES}
+    errors = []
+    detected = 0
+    frame_paths = [os.path.join(folder, 'frames', name) for name in sorted(dataset['corners'])]
+    print(f"⏱ Timing {len(frame_paths)} frames...")
+    for image_path in frame_paths:
+        truth = np.array(dataset['corners'][os.path.basename(image_path)], dtype=np.float32)
+        stage_times, corners = _run_stages(image_path, truth, calibrator, detector, processor, output_size, red_level)
+        for stage, seconds in stage_times.items():
+            times[stage].append(seconds)
+        if corners is not None:
+            detected += 1
+            errors.append(np.linalg.norm(corners - truth, axis=1))
+
+    # Allocation peaks in a separate pass, tracing slows the timed one down
+    peaks = {}
+    if frame_paths:
+        truth = np.array(dataset['corners'][os.path.basename(frame_paths[0])], dtype=np.float32)
+        _run_stages(frame_paths[0], truth, calibrator, detector, processor, output_size, red_level, peaks)
+
+    megapixels = image_size[0] * image_size[1] / 1e6
+    stages = {}
+    for stage in STAGES:
+        samples = np.array(times[stage])
+        if not len(samples):
+            continue
+        stages[stage] = {
+            'median_s': float(np.median(samples)),
+            'p95_s': float(np.percentile(samples, 95)),
+            'megapixels_per_s': float(megapixels / np.median(samples)),
+            'peak_mb': peaks.get(stage, 0) / 2**20,
+        }
+    per_image = sum(stage['median_s'] for stage in stages.values())
+
+    errors = np.concatenate(errors) if errors else np.zeros(0)
+    results = {
+        'version': BENCHMARK_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': {'python': platform.python_version(), 'numpy': np.__version__, 'opencv': cv2.__version__,
+                        'platform': platform.platform(), 'cpu_count': os.cpu_count()},
+        'settings': dict(dataset['settings'], output_size=output_size, red_level=red_level),
+        'stages': stages,
+        'images_per_minute': 60.0 / per_image if per_image else 0.0,
+        'accuracy': {
+            'detection_rate': detected / len(frame_paths) if frame_paths else 0.0,
+            'corner_error_mean_px': float(errors.mean()) if len(errors) else None,
+            'corner_error_max_px': float(errors.max()) if len(errors) else None,
+        },
+        'calibration': _benchmark_calibration(folder, dataset, jobs),
+    }
+    if resource is not None:
+        # KB on Linux, bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        results['peak_rss_mb'] = rss / (2**20 if platform.system() == 'Darwin' else 2**10)
+    return results
+
+
+def _run_stages(image_path, truth, calibrator, detector, processor, output_size, red_level, peaks=None):
+    # One frame through the pipeline, stage by stage. The warp uses the true
+    # corners so its timing doesn't depend on the detector
+    times = {}
+
+    def stage(name, fn, *args):
+        if peaks is not None:
+            tracemalloc.start()
+        start = time.perf_counter()
+        result = fn(*args)
+        times[name] = time.perf_counter() - start
+        if peaks is not None:
+            peaks[name] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return result
+
+    image = stage('decode', cv2.imread, image_path)
+    undistorted = stage('undistort', calibrator.undistort_image, image)
+    corners, score = stage('detect', detector.detect_with_score, undistorted)
+    undistorted = None
+    warped = stage('warp', processor.geometry.render, image, truth, calibrator, output_size)
+    enhanced = stage('enhance', processor.enhance_colors, warped, red_level, False)
+    stage('encode', cv2.imencode, '.jpg', enhanced, [cv2.IMWRITE_JPEG_QUALITY, 98])
+    return times, corners
+
+
+def _benchmark_calibration(folder, dataset, jobs=None):
+    boards_folder = os.path.join(folder, 'chessboards')
+    cache_path = os.path.join(boards_folder, CHESSBOARD_CACHE_NAME)
+    if os.path.exists(cache_path):
+        os.remove(cache_path)  # time a cold search
+
+    print("⏱ Timing calibration...")
+    calibrator = CameraCalibrator(calibration_file=os.path.join(folder, 'benchmark_calibration.pkl'), store=None)
+    settings = dataset['settings']
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        ok = calibrator.calibrate_camera(boards_folder, tuple(settings['chessboard_size']), 1.0, jobs=jobs)
+    seconds = time.perf_counter() - start
+    if not ok:
+        return {'ok': False, 'time_s': seconds}
+
+    true_matrix = np.array(dataset['camera_matrix'])
+    errors = list(calibrator.reprojection_errors.values())
+    return {
+        'ok': True,
+        'time_s': seconds,
+        'images_used': len(errors),
+        'reprojection_mean_px': float(np.mean(errors)),
+        'focal_error_pct': float(abs(calibrator.camera_matrix[0, 0] - true_matrix[0, 0]) / true_matrix[0, 0] * 100),
+        'principal_point_error_px': float(np.linalg.norm(calibrator.camera_matrix[:2, 2] - true_matrix[:2, 2])),
+    }
+
+
+def compare(results, baseline, thresholds=None):
+    """Regressions of `results` against `baseline`, as a list of messages (empty when fine)."""
+    limits = dict(DEFAULT_THRESHOLDS, **(thresholds or {}))
+    regressions = []
+    for stage, base in baseline.get('stages', {}).items():
+        current = results.get('stages', {}).get(stage)
+        if current is None:
+            continue
+        if current['median_s'] > base['median_s'] * limits['time_ratio']:
+            regressions.append(f"{stage}: {current['median_s']:.3f}s vs {base['median_s']:.3f}s baseline")
+        if base['peak_mb'] and current['peak_mb'] > base['peak_mb'] * limits['memory_ratio']:
+            regressions.append(f"{stage}: peak {current['peak_mb']:.0f} MB vs {base['peak_mb']:.0f} MB baseline")
+
+    accuracy, base_accuracy = results['accuracy'], baseline.get('accuracy', {})
+    if accuracy['detection_rate'] < base_accuracy.get('detection_rate', 0) - limits['detection_rate']:
+        regressions.append(f"detection rate {accuracy['detection_rate']:.0%} vs "
+                           f"{base_accuracy['detection_rate']:.0%} baseline")
+    if (base_accuracy.get('corner_error_mean_px') is not None and accuracy['corner_error_mean_px'] is not None
+            and accuracy['corner_error_mean_px'] > base_accuracy['corner_error_mean_px'] + limits['corner_error_px']):
+        regressions.append(f"corner error {accuracy['corner_error_mean_px']:.2f}px vs "
+                           f"{base_accuracy['corner_error_mean_px']:.2f}px baseline")
+
+    calibration, base_calibration = results['calibration'], baseline.get('calibration', {})
+    if base_calibration.get('ok'):
+        if not calibration.get('ok'):
+            regressions.append("calibration failed")
+        else:
+            if calibration['time_s'] > base_calibration['time_s'] * limits['time_ratio']:
+                regressions.append(f"calibration: {calibration['time_s']:.1f}s vs "
+                                   f"{base_calibration['time_s']:.1f}s baseline")
+            if (calibration['reprojection_mean_px'] >
+                    base_calibration['reprojection_mean_px'] + limits['reprojection_px']):
+                regressions.append(f"reprojection error {calibration['reprojection_mean_px']:.3f}px vs "
+                                   f"{base_calibration['reprojection_mean_px']:.3f}px baseline")
+            if calibration['focal_error_pct'] > base_calibration['focal_error_pct'] + limits['focal_error_pct']:
+                regressions.append(f"focal length error {calibration['focal_error_pct']:.2f}% vs "
+                                   f"{base_calibration['focal_error_pct']:.2f}% baseline")
+    return regressions
+
+
+def save_results(path, results):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_results(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        results = json.load(f)
+    if results.get('version') != BENCHMARK_VERSION:
+        raise ValueError(f"Unsupported benchmark results version: {results.get('version')}")
+    return results
+
+
+def print_report(results, regressions=None):
+    print(f"\n" + "="*60)
+    print("BENCHMARK")
+    print("="*60)
+    for stage, values in results['stages'].items():
+        print(f" {stage:<10} {values['median_s']*1000:8.1f} ms  p95 {values['p95_s']*1000:8.1f} ms  "
+              f"{values['megapixels_per_s']:7.1f} MP/s  peak {values['peak_mb']:7.1f} MB")
+    print(f" Throughput: {results['images_per_minute']:.1f} images/minute (single process)")
+    accuracy = results['accuracy']
+    print(f" Detected: {accuracy['detection_rate']:.0%}", end="")
+    if accuracy['corner_error_mean_px'] is not None:
+        print(f", corner error mean {accuracy['corner_error_mean_px']:.2f}px, "
+              f"max {accuracy['corner_error_max_px']:.2f}px", end="")
+    print()
+    calibration = results['calibration']
+    if calibration.get('ok'):
+        print(f" Calibration: {calibration['time_s']:.1f}s, {calibration['images_used']} images, "
+              f"reprojection {calibration['reprojection_mean_px']:.3f}px, "
+              f"focal error {calibration['focal_error_pct']:.2f}%")
+    else:
+        print(" Calibration: failed")
+    if 'peak_rss_mb' in results:
+        print(f" Peak RSS: {results['peak_rss_mb']:.0f} MB")
+    if regressions is not None:
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s) against the baseline:")
+            for message in regressions:
+                print(f"  {message}")
+        else:
+            print("\n✅ No regressions against the baseline")
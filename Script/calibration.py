@@ -1,30 +1,148 @@
 import cv2
 import numpy as np
 import pickle
+import hashlib
 import glob
+import json
 import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from manifest import file_sha1
+from calibration_store import CalibrationStore, read_image_info
+
+CHESSBOARD_CACHE_NAME = "chessboard_cache.json"
+# Long side of the downscaled copy the chessboard search runs on
+CHESSBOARD_SEARCH_SIZE = 1280
+CHESSBOARD_SEARCH_FLAGS = cv2.CALIB_CB_ADAPTIVE_THRESH | cv2.CALIB_CB_NORMALIZE_IMAGE | cv2.CALIB_CB_FAST_CHECK
+# Full resolution retry when the downscaled search fails (small or distant boards). Fast check
+# too, most frames without a board are rejected quickly there as well
+CHESSBOARD_FULL_FLAGS = cv2.CALIB_CB_ADAPTIVE_THRESH | cv2.CALIB_CB_NORMALIZE_IMAGE | cv2.CALIB_CB_FAST_CHECK
+
+
+def _detect_chessboard(fname, chessboard_size):
+    # Worker: search a downscaled copy (fast-check rejects frames without a
+    # board early), then refine the corners at full resolution. Boards too
+    # small to survive the downscale are searched for at full resolution
+    gray = cv2.imread(fname, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        return False, None, None
+    image_size = (gray.shape[1], gray.shape[0])
+    scale = min(1.0, CHESSBOARD_SEARCH_SIZE / max(image_size))
+    small = gray if scale == 1.0 else cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    found, corners = cv2.findChessboardCorners(small, chessboard_size, flags=CHESSBOARD_SEARCH_FLAGS)
+    if found:
+        corners = ((corners.reshape(-1, 1, 2) + 0.5) / scale - 0.5).astype(np.float32)
+    elif scale < 1.0:
+        found, corners = cv2.findChessboardCorners(gray, chessboard_size, flags=CHESSBOARD_FULL_FLAGS)
+    if not found:
+        return False, None, image_size
+    corners = cv2.cornerSubPix(gray, corners, (11,11), (-1,-1),
+        (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001))
+    return True, corners, image_size
+
+
+def find_chessboards(image_files, chessboard_size, cache_folder=None, jobs=None):
+    """Chessboard corners for each image: {fname: (found, corners, image_size)}.
+
+    Results are cached in cache_folder keyed by file hash and board geometry,
+    so adding images to a set or changing calibration flags only scans what
+    is new. Uncached images are searched on a process pool.
+    """
+    cache_path = os.path.join(cache_folder, CHESSBOARD_CACHE_NAME) if cache_folder else None
+    cache = {}
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+    
+    with ThreadPoolExecutor() as pool:
+        hashes = dict(zip(image_files, pool.map(file_sha1, image_files)))
+    geometry = (f"{chessboard_size[0]}x{chessboard_size[1]}@{CHESSBOARD_SEARCH_SIZE}/{CHESSBOARD_SEARCH_FLAGS}"
+                f"+full/{CHESSBOARD_FULL_FLAGS}")
+    keys = {fname: f"{hashes[fname]}:{geometry}" for fname in image_files}
+    
+    results = {}
+    todo = []
+    for fname in image_files:
+        entry = cache.get(keys[fname])
+        if entry is None:
+            todo.append(fname)
+            continue
+        corners = np.array(entry['corners'], dtype=np.float32).reshape(-1, 1, 2) if entry['found'] else None
+        results[fname] = (entry['found'], corners, tuple(entry['image_size']) if entry['image_size'] else None)
+    
+    if todo:
+        print(f"Searching {len(todo)} image(s) for the chessboard ({len(image_files) - len(todo)} cached)...")
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for fname, result in zip(todo, pool.map(_detect_chessboard, todo, [chessboard_size] * len(todo))):
+                results[fname] = result
+                found, corners, image_size = result
+                cache[keys[fname]] = {
+                    'found': bool(found),
+                    'corners': corners.reshape(-1, 2).tolist() if found else None,
+                    'image_size': list(image_size) if image_size else None,
+                }
+        if cache_path:
+            try:
+                with open(cache_path, 'w', encoding='utf-8') as f:
+                    json.dump(cache, f)
+            except OSError as e:
+                print(f"⚠ Could not write chessboard cache: {e}")
+    return results
+
+
+def _reprojection_errors(objpoints, imgpoints, rvecs, tvecs, camera_matrix, dist_coeffs):
+    errors = []
+    for objp, corners, rvec, tvec in zip(objpoints, imgpoints, rvecs, tvecs):
+        projected, _ = cv2.projectPoints(objp, rvec, tvec, camera_matrix, dist_coeffs)
+        residuals = projected.reshape(-1, 2) - corners.reshape(-1, 2)
+        errors.append(float(np.sqrt(np.mean(np.sum(residuals ** 2, axis=1)))))
+    return errors
+
 
 class CameraCalibrator:
-    def __init__(self):
+    def __init__(self, calibration_file='gopro_calibration.pkl', store='calibrations', profile=None):
+        # calibration_file is the old single-pickle format, imported into the store on first load.
+        # profile pins one profile; by default each image gets the best match (see for_file)
+        self.calibration_file = calibration_file
+        self.store = CalibrationStore(store) if isinstance(store, str) else store
+        self.profile = profile
+        self.profile_name = None
         self.camera_matrix = None
         self.dist_coeffs = None
+        self.reprojection_errors = {}
+        self._new_matrix_cache = {}
+        self._maps = {}
+        self._reduced = {}
+        self._profile_calibrators = {}
+        self._lock = threading.Lock()
     
-    def calibrate_camera(self, calibration_folder):
+    def calibrate_camera(self, calibration_folder, chessboard_size=None, square_size=None,
+                         calibration_flags=cv2.CALIB_FIX_ASPECT_RATIO, max_error=None, jobs=None, name=None):
         # simple calibration
+        # Chessboard corners are found in parallel and cached per image (see find_chessboards),
+        # images whose reprojection error is above max_error are dropped
         if not os.path.exists(calibration_folder):
             return False
         
-        # Get user parameters, the default ones are the ones that the WUR uses with the quadrants
-        width = int(input("Internal corners width (default 8): ") or "8")
-        height = int(input("Internal corners height (default 6): ") or "6")
-        square_size = float(input("Square size in cm (default 3.025): ") or "3.025")
+        # Get user parameters (only asked when not passed in), the default ones are the ones that the WUR uses with the quadrants
+        if chessboard_size is None:
+            width = int(input("Internal corners width (default 8): ") or "8")
+            height = int(input("Internal corners height (default 6): ") or "6")
+            chessboard_size = (width, height)
+        if square_size is None:
+            square_size = float(input("Square size in cm (default 3.025): ") or "3.025")
         
+        width, height = chessboard_size
         chessboard_size = (width, height)
         
         # Find images
         image_files = []
         for ext in ['*.jpg', '*.jpeg', '*.JPG', '*.JPEG', '*.png', '*.PNG']:
             image_files.extend(glob.glob(os.path.join(calibration_folder, ext)))
+        image_files = sorted(set(image_files))
         
         if not image_files:
             print("No images found")
@@ -34,58 +152,253 @@ class CameraCalibrator:
         objp = np.zeros((width * height, 3), np.float32)
         objp[:,:2] = np.mgrid[0:width, 0:height].T.reshape(-1,2) * square_size
         
+        detections = find_chessboards(image_files, chessboard_size, calibration_folder, jobs)
+        
+        names = []
         objpoints = []
         imgpoints = []
         image_size = None
         
         for fname in image_files:
-            img = cv2.imread(fname)
-            if img is None:
+            found, corners, size = detections[fname]
+            if size is None:
                 continue
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
             if image_size is None:
-                image_size = gray.shape[::-1]
-            ret, corners = cv2.findChessboardCorners(gray, chessboard_size)
-            
-            if ret:
+                image_size = size
+            elif size != image_size:
+                print(f"✗ {os.path.basename(fname)} is {size[0]}x{size[1]}, expected {image_size[0]}x{image_size[1]}")
+                continue
+            if found:
+                names.append(os.path.basename(fname))
                 objpoints.append(objp)
-                corners2 = cv2.cornerSubPix(gray, corners, (11,11), (-1,-1), 
-                    (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001))
-                imgpoints.append(corners2)
+                imgpoints.append(corners)
                 print(f"✓ {os.path.basename(fname)}")
         if len(objpoints) < 3:
             print("Need at least 3 good images")
             return False
         
         ret, mtx, dist, rvecs, tvecs = cv2.calibrateCamera(
-            objpoints, imgpoints, image_size, None, None, None, None, cv2.CALIB_FIX_ASPECT_RATIO) # type: ignore
+            objpoints, imgpoints, image_size, None, None, None, None, calibration_flags) # type: ignore
+        
+        # Per-image reprojection error, so bad frames can be spotted and dropped
+        errors = _reprojection_errors(objpoints, imgpoints, rvecs, tvecs, mtx, dist)
+        print("\nReprojection error per image (px):")
+        for image_name, error in zip(names, errors):
+            flag = "  ← outlier" if max_error is not None and error > max_error else ""
+            print(f"  {image_name}: {error:.3f}{flag}")
+        
+        if max_error is not None:
+            keep = [i for i, error in enumerate(errors) if error <= max_error]
+            if len(keep) < len(errors):
+                if len(keep) < 3:
+                    print("Need at least 3 good images below the reprojection error limit")
+                    return False
+                print(f"\nDropping {len(errors) - len(keep)} outlier image(s) and recalibrating...")
+                names = [names[i] for i in keep]
+                objpoints = [objpoints[i] for i in keep]
+                imgpoints = [imgpoints[i] for i in keep]
+                ret, mtx, dist, rvecs, tvecs = cv2.calibrateCamera(
+                    objpoints, imgpoints, image_size, None, None, None, None, calibration_flags) # type: ignore
+                errors = _reprojection_errors(objpoints, imgpoints, rvecs, tvecs, mtx, dist)
         
-        self.camera_matrix = mtx
-        self.dist_coeffs = dist
+        self.reprojection_errors = dict(zip(names, errors))
+        self._set_calibration(mtx, dist)
         
-        # Save the calibration
-        with open('gopro_calibration.pkl', 'wb') as f:
-            pickle.dump({'camera_matrix': mtx, 'distortion_coefficients': dist}, f)
+        # Save the calibration as a profile for this camera and resolution
+        camera_model = read_image_info(image_files[0])[0]
+        name = name or f"{camera_model or 'camera'}_{image_size[0]}x{image_size[1]}"
+        if self.store is not None:
+            self.profile_name = self.store.save_profile(name, mtx, dist, image_size, camera_model)
+            print(f"💾 Saved calibration profile '{self.profile_name}' in {self.store.root}")
+        else:
+            with open(self.calibration_file, 'wb') as f:
+                pickle.dump({'camera_matrix': mtx, 'distortion_coefficients': dist}, f)
         
         print(f"✅ Calibration complete! RMS Error: {ret:.3f}")
         return True
     
     def load_calibration(self):
+        # Pinned or newest profile from the store; an old .pkl is imported the first time
         try:
-            with open('gopro_calibration.pkl', 'rb') as f:
-                data = pickle.load(f)
-            self.camera_matrix = data['camera_matrix']
-            self.dist_coeffs = data['distortion_coefficients']
-            print("✓ Calibration loaded")
+            if self.store is None:
+                if not os.path.exists(self.calibration_file):
+                    return False
+                self._set_calibration(*self._read_legacy())
+                print("✓ Calibration loaded")
+                return True
+            
+            if not self.store.profiles and os.path.exists(self.calibration_file):
+                camera_matrix, dist_coeffs = self._read_legacy()
+                name = self.store.save_profile('legacy', camera_matrix, dist_coeffs, None)
+                print(f"✓ Imported {self.calibration_file} into the calibration store as '{name}'")
+            
+            name = self.profile or self.store.newest()
+            if name is None:
+                return False
+            self._load_profile(name)
+            print(f"✓ Calibration loaded (profile '{name}')")
             return True
-        except:
+        except (OSError, KeyError, ValueError, pickle.UnpicklingError) as e:
+            print(f"⚠ Could not load calibration: {e}")
             return False
     
+    def for_file(self, image_path):
+        """The calibrator to use for one image.
+
+        Unless a profile is pinned, picks the store profile matching the
+        image's resolution and EXIF camera model (read from the header only).
+        Returns self when nothing better matches. Safe to call from threads.
+        """
+        if self.store is None or self.profile is not None or len(self.store.profiles) < 2:
+            return self
+        camera_model, image_size = read_image_info(image_path)
+        return self.for_size(image_size, camera_model)
+    
+    def for_size(self, image_size, camera_model=None):
+        # Same as for_file for images that aren't files on disk, e.g. video frames
+        if self.store is None or self.profile is not None or len(self.store.profiles) < 2:
+            return self
+        name = self.store.select(image_size, camera_model)
+        if name is None or name == self.profile_name:
+            return self
+        with self._lock:
+            if name not in self._profile_calibrators:
+                calibrator = CameraCalibrator(self.calibration_file, self.store, profile=name)
+                calibrator._load_profile(name)
+                self._profile_calibrators[name] = calibrator
+            return self._profile_calibrators[name]
+    
+    def reduced(self, factor):
+        """Calibrator for the same camera decoded at 1/factor scale (quality.read_reduced).
+
+        Focal length and principal point are scaled with pixel centres kept
+        aligned; the distortion coefficients don't depend on the scale.
+        """
+        if factor == 1 or self.camera_matrix is None or self.dist_coeffs is None:
+            return self
+        with self._lock:
+            if factor not in self._reduced:
+                camera_matrix = np.array(self.camera_matrix, dtype=np.float64)
+                camera_matrix[:2, :2] /= factor
+                camera_matrix[:2, 2] = (camera_matrix[:2, 2] + 0.5) / factor - 0.5
+                calibrator = CameraCalibrator(calibration_file=None, store=None)
+                calibrator._set_calibration(camera_matrix, self.dist_coeffs)
+                self._reduced[factor] = calibrator
+            return self._reduced[factor]
+    
+    def spec(self):
+        # Everything a worker process needs to rebuild this calibrator (see from_spec)
+        return {'calibration_file': self.calibration_file,
+                'store': self.store.root if self.store is not None else None,
+                'profile': self.profile, 'profile_name': self.profile_name,
+                'camera_matrix': self.camera_matrix, 'dist_coeffs': self.dist_coeffs}
+    
+    @classmethod
+    def from_spec(cls, spec):
+        calibrator = cls(spec['calibration_file'], spec['store'], spec['profile'])
+        if spec['camera_matrix'] is not None:
+            calibrator._set_calibration(spec['camera_matrix'], spec['dist_coeffs'])
+        calibrator.profile_name = spec['profile_name']
+        return calibrator
+    
     def undistort_image(self, image):
         if self.camera_matrix is None or self.dist_coeffs is None:
             return image
         
         h, w = image.shape[:2]
-        new_camera_matrix, roi = cv2.getOptimalNewCameraMatrix(
-            self.camera_matrix, self.dist_coeffs, (w, h), alpha=1)
-        return cv2.undistort(image, self.camera_matrix, self.dist_coeffs, None, new_camera_matrix)
\ No newline at end of file
+        map1, map2 = self.undistort_maps((w, h))
+        return cv2.remap(image, map1, map2, cv2.INTER_LINEAR)
+    
+    def undistort_maps(self, image_size):
+        # Undistortion maps per resolution: memory-mapped from the store when
+        # this is a store profile, otherwise built in memory once
+        image_size = tuple(int(v) for v in image_size)
+        with self._lock:
+            if image_size not in self._maps:
+                if self.store is not None and self.profile_name is not None:
+                    self._maps[image_size] = self.store.maps(
+                        self.profile_name, image_size, self.get_new_camera_matrix(image_size))
+                else:
+                    self._maps[image_size] = cv2.initUndistortRectifyMap(
+                        self.camera_matrix, self.dist_coeffs, None, self.get_new_camera_matrix(image_size),
+                        image_size, cv2.CV_16SC2)
+            return self._maps[image_size]
+    
+    def _set_calibration(self, camera_matrix, dist_coeffs):
+        self.profile_name = None
+        self.camera_matrix = camera_matrix
+        self.dist_coeffs = dist_coeffs
+        self._new_matrix_cache = {}
+        self._maps = {}
+        self._reduced = {}
+    
+    def _load_profile(self, name):
+        camera_matrix, dist_coeffs, _ = self.store.load_profile(name)
+        self._set_calibration(camera_matrix, dist_coeffs)
+        self.profile_name = name
+    
+    def _read_legacy(self):
+        with open(self.calibration_file, 'rb') as f:
+            data = pickle.load(f)
+        return data['camera_matrix'], data['distortion_coefficients']
+    
+    def get_new_camera_matrix(self, image_size):
+        # Camera matrix of the undistorted view (alpha=1 keeps every source pixel),
+        # cached per (w, h) so it is only solved once per resolution
+        if self.camera_matrix is None or self.dist_coeffs is None:
+            return None
+        image_size = tuple(int(v) for v in image_size)
+        if image_size not in self._new_matrix_cache:
+            new_camera_matrix, roi = cv2.getOptimalNewCameraMatrix(
+                self.camera_matrix, self.dist_coeffs, image_size, alpha=1)
+            self._new_matrix_cache[image_size] = new_camera_matrix
+        return self._new_matrix_cache[image_size]
+    
+    def fingerprint(self):
+        # Short hash identifying this calibration, "none" when uncalibrated
+        if self.camera_matrix is None or self.dist_coeffs is None:
+            return "none"
+        digest = hashlib.sha1()
+        digest.update(np.round(np.asarray(self.camera_matrix, dtype=np.float64), 6).tobytes())
+        digest.update(np.round(np.asarray(self.dist_coeffs, dtype=np.float64).ravel(), 9).tobytes())
+        return digest.hexdigest()[:16]
+    
+    def selection_fingerprint(self):
+        # Like fingerprint(), but over every profile for_file() may pick, so two hosts
+        # with the same value correct every image the same way
+        if self.store is None or self.profile is not None or len(self.store.profiles) < 2:
+            return self.fingerprint()
+        digest = hashlib.sha1()
+        for name in sorted(self.store.profiles):
+            profile = self.store.profiles[name]
+            calibrator = CameraCalibrator(calibration_file=None, store=None)
+            calibrator._set_calibration(*self.store.load_profile(name)[:2])
+            digest.update(json.dumps([name, profile['camera'], profile['image_size'], profile['created'],
+                                      calibrator.fingerprint()]).encode('utf-8'))
+        return digest.hexdigest()[:16]
+    
+    def distort_points(self, points, image_size):
+        # Undistorted view coordinates (what the user clicks on) -> raw sensor coordinates
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if self.camera_matrix is None or self.dist_coeffs is None:
+            return points.copy()
+        new_camera_matrix = self.get_new_camera_matrix(image_size)
+        rays = np.c_[points, np.ones(len(points))] @ np.linalg.inv(new_camera_matrix).T
+        raw, _ = cv2.projectPoints(rays.reshape(-1, 1, 3), np.zeros(3), np.zeros(3),
+                                   self.camera_matrix, self.dist_coeffs)
+        return raw.reshape(-1, 2)
+    
+    def undistort_points(self, points, image_size):
+        # Raw sensor coordinates -> undistorted view coordinates
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+        if self.camera_matrix is None or self.dist_coeffs is None:
+            return points.reshape(-1, 2).copy()
+        new_camera_matrix = self.get_new_camera_matrix(image_size)
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 50, 1e-6)
+        if hasattr(cv2, 'undistortPointsIter'):  # OpenCV 4.x name of the overload with criteria
+            undistorted = cv2.undistortPointsIter(points, self.camera_matrix, self.dist_coeffs,
+                                                  None, new_camera_matrix, criteria)
+        else:
+            undistorted = cv2.undistortPoints(points, self.camera_matrix, self.dist_coeffs,
+                                              R=None, P=new_camera_matrix, criteria=criteria)
+        return undistorted.reshape(-1, 2)
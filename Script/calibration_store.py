@@ -0,0 +1,219 @@
+import json
+import os
+import re
+import struct
+import time
+
+import cv2
+import numpy as np
+
+STORE_VERSION = 1
+
+
+class CalibrationStore:
+    """A directory of named calibration profiles.
+
+    Layout:
+        store.json                    index: version, profiles (camera, size, created)
+        <name>/profile.npz            camera matrix, distortion, calibrated image size
+        <name>/map1_<w>x<h>.npy       undistortion maps (initUndistortRectifyMap,
+        <name>/map2_<w>x<h>.npy       CV_16SC2), loaded memory-mapped
+
+    The maps are plain .npy files opened with mmap_mode='r', so every worker
+    process shares the same pages from the OS cache instead of computing or
+    copying its own.
+    """
+
+    def __init__(self, root='calibrations'):
+        self.root = root
+        self.index_path = os.path.join(root, 'store.json')
+        self.profiles = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != STORE_VERSION:
+                raise ValueError(f"Unsupported calibration store version: {data.get('version')}")
+            self.profiles = data.get('profiles', {})
+
+    def save_profile(self, name, camera_matrix, dist_coeffs, image_size, camera_model=None):
+        name = profile_name(name)
+        folder = os.path.join(self.root, name)
+        os.makedirs(folder, exist_ok=True)
+        camera_matrix = np.asarray(camera_matrix, dtype=np.float64)
+        dist_coeffs = np.asarray(dist_coeffs, dtype=np.float64)
+        np.savez(os.path.join(folder, 'profile.npz'), version=STORE_VERSION,
+                 camera_matrix=camera_matrix, dist_coeffs=dist_coeffs,
+                 image_size=np.array(image_size if image_size else (0, 0)))
+        # Old maps belong to the previous calibration of this profile
+        for fname in os.listdir(folder):
+            if fname.startswith('map') and fname.endswith('.npy'):
+                os.remove(os.path.join(folder, fname))
+        self.profiles[name] = {
+            'camera': camera_model,
+            'image_size': list(image_size) if image_size else None,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        self._save_index()
+        if image_size:
+            self.maps(name, image_size)
+        return name
+
+    def load_profile(self, name):
+        # (camera_matrix, dist_coeffs, image_size or None)
+        with np.load(os.path.join(self.root, name, 'profile.npz')) as data:
+            if int(data['version']) != STORE_VERSION:
+                raise ValueError(f"Unsupported calibration profile version in {name}")
+            image_size = tuple(int(v) for v in data['image_size'])
+            return data['camera_matrix'], data['dist_coeffs'], image_size if any(image_size) else None
+
+    def maps(self, name, image_size, new_camera_matrix=None):
+        """Memory-mapped (map1, map2) for a profile at one image size, built on first use."""
+        w, h = (int(v) for v in image_size)
+        folder = os.path.join(self.root, name)
+        map1_path = os.path.join(folder, f'map1_{w}x{h}.npy')
+        map2_path = os.path.join(folder, f'map2_{w}x{h}.npy')
+        if not (os.path.exists(map1_path) and os.path.exists(map2_path)):
+            camera_matrix, dist_coeffs, _ = self.load_profile(name)
+            if new_camera_matrix is None:
+                new_camera_matrix, _ = cv2.getOptimalNewCameraMatrix(camera_matrix, dist_coeffs, (w, h), alpha=1)
+            map1, map2 = cv2.initUndistortRectifyMap(
+                camera_matrix, dist_coeffs, None, new_camera_matrix, (w, h), cv2.CV_16SC2)
+            # Write under a temporary name first so other processes never mmap half a file
+            for path, data in ((map1_path, map1), (map2_path, map2)):
+                tmp_path = f"{path[:-4]}.{os.getpid()}.tmp.npy"
+                np.save(tmp_path, data)
+                os.replace(tmp_path, path)
+        return np.load(map1_path, mmap_mode='r'), np.load(map2_path, mmap_mode='r')
+
+    def select(self, image_size=None, camera_model=None):
+        """Best profile for an image: same camera and size, then same size, then same camera."""
+        image_size = list(image_size) if image_size else None
+        by_size = [name for name, p in self.profiles.items() if image_size and p['image_size'] == image_size]
+        if camera_model:
+            exact = [name for name in by_size if self.profiles[name]['camera'] == camera_model]
+            if exact:
+                return self._newest(exact)
+        if by_size:
+            return self._newest(by_size)
+        if camera_model:
+            same_camera = [name for name, p in self.profiles.items() if p['camera'] == camera_model]
+            if same_camera:
+                return self._newest(same_camera)
+        # Profiles without a known size (imported from the old .pkl) match anything
+        unsized = [name for name, p in self.profiles.items() if p['image_size'] is None]
+        return self._newest(unsized) if unsized else None
+
+    def newest(self):
+        return self._newest(list(self.profiles)) if self.profiles else None
+
+    def _newest(self, names):
+        # Later in the index wins a tie (created has one second resolution)
+        return max(reversed(names), key=lambda name: self.profiles[name]['created'])
+
+    def _save_index(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': STORE_VERSION, 'profiles': self.profiles}, f, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+
+def profile_name(text):
+    # Safe directory name, e.g. "GoPro HERO11 Black 5568x4872" -> "GoPro_HERO11_Black_5568x4872"
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', text).strip('_') or 'camera'
+
+
+def read_image_info(path):
+    """(camera model, (w, h)) from the file header without decoding, either may be None."""
+    model = None
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(24)
+            if head.startswith(b'\x89PNG\r\n\x1a\n') and len(head) == 24:
+                return None, struct.unpack('>II', head[16:24])
+            if not head.startswith(b'\xff\xd8'):
+                return None, None
+            # Walk the JPEG segments up to the frame header, skipping over the big
+            # ones (thumbnails, GoPro metadata) with seeks
+            f.seek(2)
+            while True:
+                header = f.read(4)
+                if len(header) < 4 or header[0] != 0xFF:
+                    return model, None
+                marker = header[1]
+                length = struct.unpack('>H', header[2:4])[0]
+                if marker == 0xE1 and model is None:
+                    segment = f.read(length - 2)
+                    if segment.startswith(b'Exif\x00\x00'):
+                        model = _exif_model(segment[6:])
+                elif marker in (0xC0, 0xC1, 0xC2):
+                    h, w = struct.unpack('>HH', f.read(5)[1:5])
+                    return model, (w, h)
+                else:
+                    f.seek(length - 2, 1)
+    except (OSError, struct.error):
+        return model, None
+
+
+def read_capture_time(path):
+    """When a JPEG was shot (EXIF DateTimeOriginal, else DateTime) as seconds
+    since the epoch in camera time, or None."""
+    try:
+        with open(path, 'rb') as f:
+            if f.read(2) != b'\xff\xd8':
+                return None
+            while True:
+                header = f.read(4)
+                # The EXIF block comes before the frame header and the image data
+                if len(header) < 4 or header[0] != 0xFF or header[1] in (0xC0, 0xC1, 0xC2, 0xDA):
+                    return None
+                length = struct.unpack('>H', header[2:4])[0]
+                if header[1] == 0xE1:
+                    segment = f.read(length - 2)
+                    if segment.startswith(b'Exif\x00\x00'):
+                        text = _exif_ascii(segment[6:], 0x9003, sub_ifd=True) or _exif_ascii(segment[6:], 0x0132)
+                        return time.mktime(time.strptime(text, '%Y:%m:%d %H:%M:%S')) if text else None
+                else:
+                    f.seek(length - 2, 1)
+    except (OSError, struct.error, ValueError, OverflowError):
+        return None
+
+
+def _exif_model(tiff):
+    # Model (0x0110) from IFD0 of the EXIF TIFF block
+    return _exif_ascii(tiff, 0x0110)
+
+
+def _exif_ascii(tiff, tag, sub_ifd=False):
+    # An ASCII tag from IFD0, or from the Exif sub-IFD (pointer 0x8769) with sub_ifd
+    try:
+        endian = '<' if tiff[:2] == b'II' else '>'
+        offset = struct.unpack(endian + 'I', tiff[4:8])[0]
+        if sub_ifd:
+            pointer = _ifd_entry(tiff, endian, offset, 0x8769)
+            if pointer is None:
+                return None
+            offset = struct.unpack(endian + 'I', pointer[8:12])[0]
+        entry = _ifd_entry(tiff, endian, offset, tag)
+        if entry is None:
+            return None
+        kind, n = struct.unpack(endian + 'HI', entry[2:8])
+        if kind != 2:
+            return None
+        if n <= 4:
+            data = entry[8:8 + n]
+        else:
+            start = struct.unpack(endian + 'I', entry[8:12])[0]
+            data = tiff[start:start + n]
+        return data.split(b'\x00')[0].decode('ascii', 'replace').strip() or None
+    except struct.error:
+        return None
+
+
+def _ifd_entry(tiff, endian, offset, tag):
+    count = struct.unpack(endian + 'H', tiff[offset:offset + 2])[0]
+    for i in range(count):
+        entry = tiff[offset + 2 + 12 * i:offset + 14 + 12 * i]
+        if struct.unpack(endian + 'H', entry[:2])[0] == tag:
+            return entry
+    return None
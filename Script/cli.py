@@ -0,0 +1,368 @@
+import argparse
+import csv
+import os
+
+from quadrant_processor import GoProQuadrantProcessor
+from processing import find_images
+from instrumentation import NULL_LOG, RunLog
+from detection import FRAME_COLOURS
+from quality import QualityScreen
+from derivatives import DERIVATIVE_KINDS, Derivatives, parse_kinds
+from manifest import CornersManifest
+from work_queue import LEASE_TIMEOUT, QueueWorker, WorkQueue, queue_images
+
+# Exit codes, so schedulers and scripts can tell what happened
+EXIT_OK = 0          # everything processed
+EXIT_FAILED = 1      # at least one image (or the calibration) failed
+EXIT_USAGE = 2       # bad arguments (argparse uses this too)
+EXIT_REVIEW = 3      # finished, but some images need manual corners
+EXIT_NO_INPUT = 4    # nothing to process
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="main.py",
+        description="Benthic quadrant processor, non-interactive mode. Run without arguments for the interactive menu.")
+    parser.add_argument("--calibration", default="gopro_calibration.pkl",
+                        help="old single-file calibration, imported into the store if it is empty "
+                             "(default: gopro_calibration.pkl)")
+    parser.add_argument("--calibration-store", default="calibrations",
+                        help="folder with calibration profiles (default: calibrations)")
+    parser.add_argument("--profile", default=None,
+                        help="use this calibration profile for every image (default: pick per image "
+                             "by camera model and resolution)")
+    parser.add_argument("--run-log", default=None,
+                        help="append per-image stage timings to this JSONL file and print a summary")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="with --run-log, also record the peak allocation of each stage (slower)")
+    parser.add_argument("--frame-colour", default="white", choices=sorted(FRAME_COLOURS),
+                        help="colour of the quadrat frame, for the colour based detector (default: white)")
+    parser.add_argument("--quality", default=None, metavar="FILE",
+                        help="quality pre-screen thresholds (JSON); default: quality.json in the survey "
+                             "folder if there is one, else built-in thresholds")
+    parser.add_argument("--quality-action", default=None, choices=("flag", "skip", "off"),
+                        help="what to do with blurry, badly exposed or murky frames: flag them, "
+                             "skip them (to the review list) or don't check (default: flag)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    calibrate = sub.add_parser("calibrate", help="calibrate the camera from chessboard images")
+    calibrate.add_argument("folder", help="folder with chessboard images")
+    calibrate.add_argument("--width", type=int, default=8, help="internal corners width (default 8)")
+    calibrate.add_argument("--height", type=int, default=6, help="internal corners height (default 6)")
+    calibrate.add_argument("--square-size", type=float, default=3.025, help="square size in cm (default 3.025)")
+    calibrate.add_argument("--max-error", type=float, default=None,
+                           help="drop images with a reprojection error above this (px) and recalibrate")
+    calibrate.add_argument("--jobs", type=int, default=None, help="worker processes for the chessboard search")
+    calibrate.add_argument("--profile-name", default=None,
+                           help="name of the new profile (default: <camera model>_<width>x<height>)")
+
+    sub.add_parser("profiles", help="list the calibration profiles in the store")
+
+    process = sub.add_parser("process", help="process a single image with auto-detection")
+    process.add_argument("image", help="image to process")
+    process.add_argument("--output", help="output path (default: <name>_Corrected.jpg)")
+    _add_processing_options(process)
+
+    batch = sub.add_parser("batch", help="process a folder with auto-detection on several processes")
+    batch.add_argument("input_folder", help="folder with images")
+    batch.add_argument("output_folder", help="output folder (created if needed)")
+    batch.add_argument("--jobs", type=int, default=None, help="worker processes (default: all cores)")
+    batch.add_argument("--review-list", default=None,
+                       help="CSV of images that need manual corners (default: <output_folder>/review.csv)")
+    batch.add_argument("--duplicates", default="best", choices=("all", "best"),
+                       help="repeated shots of a quadrat (similar image, taken shortly after each other): "
+                            "only the sharpest of each (default), or all of them")
+    _add_processing_options(batch)
+
+    video = sub.add_parser("video", help="render the best frame of each quadrat in transect videos")
+    video.add_argument("input", help="video file or folder of videos (MP4/MOV)")
+    video.add_argument("output_folder", help="output folder (created if needed)")
+    video.add_argument("--stride", type=int, default=3,
+                       help="look at every Nth frame, the others are skipped without decoding (default 3)")
+    video.add_argument("--per-quadrat", type=int, default=1,
+                       help="frames to keep per quadrat, at least a second apart (default 1)")
+    _add_processing_options(video)
+
+    watch = sub.add_parser("watch", help="process images as they are copied into ingest folders, until Ctrl+C")
+    watch.add_argument("folders", nargs="+", help="ingest folder(s), subfolders included")
+    watch.add_argument("output_folder", help="output folder, one subfolder per ingest folder")
+    watch.add_argument("--jobs", type=int, default=None, help="worker processes (default: all cores)")
+    watch.add_argument("--settle", type=float, default=5.0,
+                       help="seconds a file must stay unchanged before it counts as copied (default 5)")
+    watch.add_argument("--once", action="store_true",
+                       help="process what is in the folders now and exit instead of watching")
+    _add_processing_options(watch)
+
+    enqueue = sub.add_parser("enqueue", help="turn a survey folder into a work queue on a shared folder")
+    enqueue.add_argument("queue", help="queue folder, on a file system every worker host can reach")
+    enqueue.add_argument("input_folder", help="folder with images")
+    enqueue.add_argument("output_folder", help="output folder (created if needed)")
+    enqueue.add_argument("--corners", default=None, metavar="MANIFEST",
+                         help="corners manifest from a two-phase annotation pass; only its annotated images "
+                              "are queued and rendered with their corners (default: auto-detect everything)")
+    _add_processing_options(enqueue)
+
+    worker = sub.add_parser("worker", help="render jobs from a work queue until it is empty")
+    worker.add_argument("queue", help="queue folder made by enqueue")
+    worker.add_argument("--jobs", type=int, default=None, help="render processes on this host (default: all cores)")
+    worker.add_argument("--lease-timeout", type=float, default=LEASE_TIMEOUT,
+                        help=f"seconds without a heartbeat before a worker's jobs are requeued (default {LEASE_TIMEOUT})")
+    worker.add_argument("--wait", action="store_true", help="keep polling for new jobs instead of exiting")
+    worker.add_argument("--memory-limit", type=int, default=None, metavar="MB",
+                        help="render working set per image (default 256)")
+
+    queue_status = sub.add_parser("queue-status", help="show the progress of a work queue")
+    queue_status.add_argument("queue", help="queue folder made by enqueue")
+    queue_status.add_argument("--review-list", default=None,
+                              help="write the images that need manual corners to this CSV "
+                                   "(default: <output_folder>/review.csv)")
+
+    bench = sub.add_parser("benchmark", help="time and check accuracy on synthetic quadrats and chessboards")
+    bench.add_argument("--data", default="benchmark_data",
+                       help="folder for the synthetic dataset, reused between runs (default: benchmark_data)")
+    bench.add_argument("--frames", type=int, default=5, help="synthetic quadrat frames (default 5)")
+    bench.add_argument("--chessboards", type=int, default=12, help="synthetic chessboard views (default 12)")
+    bench.add_argument("--size", default="5568x4872", help="frame size WxH (default: GoPro 5568x4872)")
+    bench.add_argument("--seed", type=int, default=0, help="random seed of the dataset")
+    bench.add_argument("--output", default=None, help="write the results to this JSON file")
+    bench.add_argument("--baseline", default=None, help="compare against this results file")
+    bench.add_argument("--save-baseline", action="store_true", help="write the results to --baseline")
+    bench.add_argument("--jobs", type=int, default=None, help="worker processes for the chessboard search")
+    return parser
+
+
+def _add_processing_options(parser):
+    parser.add_argument("--red-level", type=int, default=3, choices=range(1, 6), metavar="{1-5}",
+                        help="red enhancement level (default 3)")
+    parser.add_argument("--min-confidence", type=float, default=0.8,
+                        help="minimum detection score, lower goes to review (default 0.8)")
+    parser.add_argument("--output-size", type=int, default=2000,
+                        help="side of the corrected square in pixels (default 2000)")
+    parser.add_argument("--memory-limit", type=int, default=None, metavar="MB",
+                        help="render working set per image; larger outputs are rendered in strips "
+                             "to stay under it (default 256)")
+    parser.add_argument("--derivatives", default="", metavar="LIST",
+                        help="extra outputs written with each corrected image, comma separated: "
+                             f"{', '.join(DERIVATIVE_KINDS)} (default: none)")
+    parser.add_argument("--thumbnail-size", type=int, default=256, help="long side of thumbnails (default 256)")
+    parser.add_argument("--preview-size", type=int, default=1024, help="long side of previews (default 1024)")
+    parser.add_argument("--tile-size", type=int, default=254, help="DeepZoom tile size (default 254)")
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "benchmark":
+        return run_benchmark_command(args)
+    run_log = RunLog(args.run_log, trace_memory=args.trace_memory) if args.run_log else None
+    processor = GoProQuadrantProcessor(calibration_file=args.calibration,
+                                       calibration_store=args.calibration_store, profile=args.profile,
+                                       run_log=run_log, frame_colour=args.frame_colour)
+    try:
+        return _run_command(args, processor)
+    finally:
+        if run_log is not None:
+            run_log.close()
+
+
+def _run_command(args, processor):
+
+    if args.command == "calibrate":
+        ok = processor.calibrate_camera(args.folder, (args.width, args.height), args.square_size,
+                                        max_error=args.max_error, jobs=args.jobs, name=args.profile_name)
+        return EXIT_OK if ok else EXIT_FAILED
+
+    if args.command == "profiles":
+        store = processor.calibrator.store
+        if not store.profiles:
+            print(f"No calibration profiles in {store.root}")
+            return EXIT_NO_INPUT
+        for name, info in sorted(store.profiles.items()):
+            size = "x".join(str(v) for v in info['image_size']) if info['image_size'] else "any size"
+            print(f"{name}: {info['camera'] or 'unknown camera'}, {size}, created {info['created']}")
+        return EXIT_OK
+
+    if args.command == "queue-status":
+        return run_queue_status(args)
+
+    if args.memory_limit is not None:
+        processor.processor.max_memory = args.memory_limit * 1024 * 1024
+
+    if args.command == "worker":
+        if not processor.load_calibration():
+            print(f"⚠ No calibration found in {args.calibration_store}, proceeding without distortion correction")
+        return run_worker_command(args, processor)
+
+    try:
+        kinds = parse_kinds(args.derivatives)
+    except ValueError as e:
+        print(f"❌ Invalid --derivatives: {e}")
+        return EXIT_USAGE
+    processor.processor.derivatives = Derivatives(kinds, thumbnail_size=args.thumbnail_size,
+                                                  preview_size=args.preview_size, tile_size=args.tile_size)
+
+    if not processor.load_calibration():
+        print(f"⚠ No calibration found in {args.calibration_store}, proceeding without distortion correction")
+
+    if args.command in ("process", "batch", "enqueue", "watch"):
+        if args.command == "process":
+            survey_folder = os.path.dirname(args.image)
+        elif args.command == "watch":
+            survey_folder = args.folders[0]
+        else:
+            survey_folder = args.input_folder
+        try:
+            processor.quality = QualityScreen.for_survey(survey_folder, args.quality, args.quality_action)
+        except (OSError, ValueError) as e:
+            print(f"❌ Invalid quality settings: {e}")
+            return EXIT_USAGE
+
+    if args.command == "process":
+        if not os.path.exists(args.image):
+            print(f"❌ Image not found: {args.image}")
+            return EXIT_NO_INPUT
+        status = processor.process_image_auto(args.image, args.red_level, args.output, args.min_confidence,
+                                              args.output_size)
+        if processor.run_log is not None:
+            processor.run_log.print_summary()
+        return {"ok": EXIT_OK, "review": EXIT_REVIEW}.get(status, EXIT_FAILED)
+
+    if args.command == "batch":
+        if not find_images(args.input_folder):
+            print(f"❌ No images found in {args.input_folder}")
+            return EXIT_NO_INPUT
+        successful, review, failed = processor.processor.batch_process_auto(
+            args.input_folder, args.output_folder, args.red_level, processor.calibrator,
+            min_confidence=args.min_confidence, jobs=args.jobs, output_size=args.output_size,
+            log=processor.run_log or NULL_LOG, detector=processor.detector, quality=processor.quality,
+            duplicates=args.duplicates)
+
+        review_path = args.review_list or os.path.join(args.output_folder, "review.csv")
+        if review:
+            write_review_list(review_path, review)
+            print(f" Review list: {review_path}")
+        if failed:
+            return EXIT_FAILED
+        return EXIT_REVIEW if review else EXIT_OK
+
+    if args.command == "video":
+        outputs = processor.process_videos(args.input, args.output_folder, args.red_level,
+                                           output_size=args.output_size, per_quadrat=args.per_quadrat,
+                                           stride=args.stride, min_confidence=args.min_confidence,
+                                           log=processor.run_log or NULL_LOG)
+        if processor.run_log is not None:
+            processor.run_log.print_summary()
+        return EXIT_OK if outputs else EXIT_NO_INPUT
+
+    if args.command == "watch":
+        missing = [folder for folder in args.folders if not os.path.isdir(folder)]
+        if missing:
+            print(f"❌ Ingest folder not found: {', '.join(missing)}")
+            return EXIT_NO_INPUT
+        counts = processor.watch_folders(args.folders, args.output_folder, args.red_level, jobs=args.jobs,
+                                         min_confidence=args.min_confidence, output_size=args.output_size,
+                                         settle_seconds=args.settle, once=args.once,
+                                         log=processor.run_log or NULL_LOG)
+        if counts['failed']:
+            return EXIT_FAILED
+        return EXIT_REVIEW if counts['review'] else EXIT_OK
+
+    if args.command == "enqueue":
+        return run_enqueue_command(args, processor)
+
+    return EXIT_USAGE
+
+
+def run_enqueue_command(args, processor):
+    # Render settings go into the queue, so every worker host renders the same way
+    settings = {'red_level': args.red_level, 'output_size': args.output_size,
+                'min_confidence': args.min_confidence, 'detector': processor.detector.settings(),
+                'quality': processor.quality.thresholds, 'derivatives': processor.processor.derivatives.settings(),
+                'calibration': processor.calibrator.selection_fingerprint()}
+    try:
+        manifest = CornersManifest.load(args.corners) if args.corners else None
+        queue = WorkQueue.create(args.queue, args.input_folder, args.output_folder, settings)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        return EXIT_USAGE
+    images = queue_images(args.input_folder, manifest)
+    if not images:
+        print(f"❌ No images found in {args.input_folder}")
+        return EXIT_NO_INPUT
+    added = queue.enqueue(images)
+    print(f"📋 Queued {added} image(s) in {args.queue} ({len(images) - added} already queued)")
+    print(f" Start workers with: python main.py worker {args.queue}")
+    return EXIT_OK
+
+
+def run_worker_command(args, processor):
+    try:
+        queue = WorkQueue.open(args.queue)
+        queue.check_calibration(processor.calibrator)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        return EXIT_USAGE
+    worker = QueueWorker(queue, processor.calibrator, processor.processor.max_memory, jobs=args.jobs,
+                         lease_timeout=args.lease_timeout, log=processor.run_log or NULL_LOG)
+    counts = worker.run(wait_for_jobs=args.wait)
+    return EXIT_FAILED if counts['failed'] else EXIT_OK
+
+
+def run_queue_status(args):
+    try:
+        queue = WorkQueue.open(args.queue)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        return EXIT_USAGE
+    counts = queue.counts()
+    print(f"📋 {args.queue}: {counts['pending']} pending, {counts['leases']} rendering, {counts['done']} done, "
+          f"{counts['review']} need review, {counts['failed']} failed")
+    now = queue.heartbeat("status", {})
+    queue.leave("status")
+    for worker_id, info in sorted(queue.live_workers(now).items()):
+        done = info.get('counts', {})
+        print(f" 👷 {worker_id}: {info.get('jobs')} processes, {done.get('done', 0)} saved")
+    for job in queue.results('failed'):
+        print(f" ❌ {job['image']}: {job.get('last_error') or job.get('message')}")
+
+    review = [(os.path.join(queue.input_folder, job['image']), job.get('message', ''), job.get('score', 0.0))
+              for job in queue.results('review')]
+    if review:
+        review_path = args.review_list or os.path.join(queue.output_folder, "review.csv")
+        write_review_list(review_path, review)
+        print(f" Review list: {review_path}")
+    if counts['failed']:
+        return EXIT_FAILED
+    if counts['pending'] or counts['leases']:
+        return EXIT_OK
+    return EXIT_REVIEW if review else EXIT_OK
+
+
+def run_benchmark_command(args):
+    # Imported here, the synthetic generator is only needed for benchmarking
+    import benchmark
+    try:
+        width, height = (int(v) for v in args.size.lower().split("x"))
+    except ValueError:
+        print(f"❌ Invalid --size {args.size}, expected WxH")
+        return EXIT_USAGE
+    results = benchmark.run_benchmark(args.data, args.frames, (width, height), args.chessboards,
+                                      seed=args.seed, jobs=args.jobs)
+    if args.output:
+        benchmark.save_results(args.output, results)
+
+    regressions = None
+    if args.baseline and args.save_baseline:
+        benchmark.save_results(args.baseline, results)
+        print(f" Baseline saved: {args.baseline}")
+    elif args.baseline:
+        regressions = benchmark.compare(results, benchmark.load_results(args.baseline))
+    benchmark.print_report(results, regressions)
+    return EXIT_FAILED if regressions else EXIT_OK
+
+
+def write_review_list(path, entries):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["image", "reason", "score"])
+        for image_path, reason, score in sorted(entries):
+            writer.writerow([image_path, reason, f"{score:.3f}"])
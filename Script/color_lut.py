@@ -0,0 +1,120 @@
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+
+class ColorLUT:
+    """A colour transform baked into a 3D lookup table.
+
+    The transform is evaluated once on a size^3 lattice of BGR colours and
+    expanded (trilinear) into a dense 256^3 uint8 table, so applying it is a
+    single integer gather per pixel with no float intermediates. size=256
+    evaluates every colour and matches the float path exactly.
+
+    Transforms take and return float32 BGR images in [0, 1], the same
+    convention enhance_colors always used.
+    """
+
+    def __init__(self, lattice=None, table=None):
+        # lattice: float32 (n, n, n, 3) in [0, 1], indexed [b, g, r]
+        # table: dense packed table, one uint32 (B, G, R, 0) per colour
+        self.lattice = None if lattice is None else np.asarray(lattice, dtype=np.float32)
+        self.size = 256 if lattice is None else self.lattice.shape[0]
+        self._table = table
+
+    @classmethod
+    def compile(cls, transform, size=65):
+        # Same float32 values as image.astype(np.float32) / 255.0 on the lattice nodes
+        axis = np.arange(size, dtype=np.float32) * np.float32(255.0 / (size - 1)) / 255.0
+        g, r = np.meshgrid(axis, axis, indexing='ij')
+        if size == 256:
+            # Every colour is evaluated, so there is nothing to interpolate
+            packed = np.zeros((256, 256, 256, 4), dtype=np.uint8)
+            for i, b in enumerate(axis):
+                packed[i, :, :, :3] = _to_uint8(transform(np.dstack([np.full_like(g, b), g, r])))
+            return cls(table=packed.view(np.uint32).ravel())
+
+        lattice = np.empty((size, size, size, 3), dtype=np.float32)
+        # One blue slab at a time keeps the float temporaries small
+        for i, b in enumerate(axis):
+            lattice[i] = transform(np.dstack([np.full_like(g, b), g, r]))
+        return cls(lattice)
+
+    @property
+    def table(self):
+        # Expanded from the lattice on first use
+        if self._table is None:
+            self._table = self._expand()
+        return self._table
+
+    def apply(self, image):
+        idx = image[:, :, 0].astype(np.uint32) << 16
+        idx |= image[:, :, 1].astype(np.uint32) << 8
+        idx |= image[:, :, 2]
+        packed = np.take(self.table, idx)
+        return cv2.cvtColor(packed.view(np.uint8).reshape(image.shape[0], image.shape[1], 4), cv2.COLOR_BGRA2BGR)
+
+    def accuracy(self, transform, image=None, samples=200000, seed=0):
+        """Compare the LUT against the float transform it was compiled from.
+
+        Uses `image` if given, otherwise random colours. Returns the max and
+        mean absolute difference in grey levels.
+        """
+        if image is None:
+            rng = np.random.default_rng(seed)
+            image = rng.integers(0, 256, (samples, 1, 3), dtype=np.uint8)
+        reference = _to_uint8(transform(image.astype(np.float32) / 255.0))
+        diff = np.abs(self.apply(image).astype(np.int16) - reference.astype(np.int16))
+        return {'max_error': int(diff.max()), 'mean_error': float(diff.mean())}
+
+    def _expand(self):
+        # Separable trilinear: each output level is a blend of two lattice nodes.
+        # Done one blue level at a time straight into the packed uint8 table
+        n = self.size
+        pos = np.arange(256, dtype=np.float32) * (n - 1) / 255.0
+        i0 = np.minimum(pos.astype(np.int64), n - 2)
+        w = (pos - i0).astype(np.float32)
+        w_g = w[:, None, None]
+        w_r = w[None, :, None]
+        packed = np.zeros((256, 256, 256, 4), dtype=np.uint8)
+        for b in range(256):
+            slab = self.lattice[i0[b]] * (1 - w[b]) + self.lattice[i0[b] + 1] * w[b]
+            slab = slab[i0] * (1 - w_g) + slab[i0 + 1] * w_g
+            slab = slab[:, i0] * (1 - w_r) + slab[:, i0 + 1] * w_r
+            packed[b, :, :, :3] = _to_uint8(slab)
+        return packed.view(np.uint32).ravel()
+
+
+def _to_uint8(image):
+    # Truncate like the original float path did
+    return (np.clip(image, 0.0, 1.0) * 255).astype(np.uint8)
+
+
+def underwater_transform(red_level):
+    """The red boost + saturation transform used by enhance_colors, as a float function."""
+    red_boost = 1.0 + (red_level - 1) * 0.125
+    saturation_boost = 1.0 + (red_level - 1) * 0.05
+
+    def transform(img_float):
+        img_float = img_float.copy()
+        img_float[:, :, 2] = np.clip(img_float[:, :, 2] * red_boost, 0, 1)
+
+        hsv = cv2.cvtColor(img_float, cv2.COLOR_BGR2HSV)
+        hsv[:, :, 1] = np.clip(hsv[:, :, 1] * saturation_boost, 0, 1)
+
+        return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+    return transform
+
+
+# Dense tables kept per process. Each is 64 MB (256^3 packed colours) whatever the
+# lattice size, and every render process builds its own (--jobs 16 ~ 1 GB for one
+# red level), so only the last few levels used stay around
+LUT_CACHE_SIZE = 2
+
+
+@lru_cache(maxsize=LUT_CACHE_SIZE)
+def underwater_lut(red_level, size=256):
+    # One table per red level, shared by every ImageProcessor in the process.
+    # Evaluating all 256^3 colours takes under a second and matches the float path
+    return ColorLUT.compile(underwater_transform(red_level), size)
@@ -0,0 +1,154 @@
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+# Extra outputs written next to each _Corrected.jpg, straight from the rendered image in memory:
+#   thumbnail  <name>_thumb.jpg, long side thumbnail_size
+#   preview    <name>_preview.jpg, long side preview_size
+#   tiles      DeepZoom pyramid: <name>.dzi + <name>_files/<level>/<col>_<row>.jpg
+#   png, webp, tiff  lossless copies of the full image
+DERIVATIVE_KINDS = ('thumbnail', 'preview', 'tiles', 'png', 'webp', 'tiff')
+
+LOSSLESS_PARAMS = {
+    'png': [],
+    'webp': [cv2.IMWRITE_WEBP_QUALITY, 101],  # above 100 is lossless
+    'tiff': [cv2.IMWRITE_TIFF_COMPRESSION, cv2.IMWRITE_TIFF_COMPRESSION_LZW],
+}
+
+DZI_TEMPLATE = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="{format}" '
+                'Overlap="{overlap}" TileSize="{tile_size}">\n'
+                '  <Size Width="{width}" Height="{height}"/>\n'
+                '</Image>\n')
+
+
+def parse_kinds(text):
+    # "thumbnail,tiles,png" -> ('thumbnail', 'tiles', 'png')
+    kinds = tuple(kind.strip().lower() for kind in (text or "").split(",") if kind.strip())
+    unknown = [kind for kind in kinds if kind not in DERIVATIVE_KINDS]
+    if unknown:
+        raise ValueError(f"unknown derivative(s) {', '.join(unknown)}, choose from {', '.join(DERIVATIVE_KINDS)}")
+    return kinds
+
+
+class Derivatives:
+    """Writes the corrected image and its derivatives in one go.
+
+    Every derivative is resampled from the in-memory render: the image is
+    halved level by level (INTER_AREA) once, the tiles come from those
+    levels and the thumbnail and preview from the nearest larger one. All
+    encodes (main JPEG included) run on `workers` threads; OpenCV releases
+    the GIL while encoding, so the slow lossless ones overlap.
+    """
+
+    def __init__(self, kinds=(), thumbnail_size=256, preview_size=1024, tile_size=254, tile_overlap=1,
+                 tile_quality=90, workers=4):
+        self.kinds = tuple(kinds)
+        self.thumbnail_size = thumbnail_size
+        self.preview_size = preview_size
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.tile_quality = tile_quality
+        self.workers = max(1, workers)
+
+    def settings(self):
+        # Constructor arguments, for the worker processes
+        return {'kinds': self.kinds, 'thumbnail_size': self.thumbnail_size, 'preview_size': self.preview_size,
+                'tile_size': self.tile_size, 'tile_overlap': self.tile_overlap,
+                'tile_quality': self.tile_quality, 'workers': self.workers}
+
+    def key(self):
+        # What the run manifest compares to tell whether outputs are up to date
+        if not self.kinds:
+            return ""
+        sizes = f"t{self.thumbnail_size}p{self.preview_size}z{self.tile_size}o{self.tile_overlap}"
+        return ",".join(self.kinds) + ":" + sizes
+
+    def outputs(self, output_path):
+        # Paths of the derivatives of one output (the tile folder for tiles)
+        base = os.path.splitext(output_path)[0]
+        paths = {'thumbnail': base + "_thumb.jpg", 'preview': base + "_preview.jpg", 'tiles': base + ".dzi"}
+        paths.update({kind: base + "." + kind for kind in LOSSLESS_PARAMS})
+        return {kind: paths[kind] for kind in self.kinds}
+
+    def write(self, image, output_path, quality=98):
+        """Write output_path (JPEG at `quality`) and the configured derivatives.
+
+        Returns True when everything was written.
+        """
+        jobs = [(output_path, image, [cv2.IMWRITE_JPEG_QUALITY, quality])]
+        if not self.kinds:
+            return cv2.imwrite(output_path, image, jobs[0][2])
+
+        paths = self.outputs(output_path)
+        levels = [image]
+        for kind in self.kinds:
+            if kind in LOSSLESS_PARAMS:
+                jobs.append((paths[kind], image, LOSSLESS_PARAMS[kind]))
+            elif kind in ('thumbnail', 'preview'):
+                side = self.thumbnail_size if kind == 'thumbnail' else self.preview_size
+                jobs.append((paths[kind], _fit(_level_above(levels, side), side),
+                             [cv2.IMWRITE_JPEG_QUALITY, self.tile_quality]))
+            elif kind == 'tiles':
+                jobs.extend(self._tile_jobs(levels, paths['tiles']))
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(jobs))) as pool:
+            return all(pool.map(_encode, jobs))
+
+    def _tile_jobs(self, levels, dzi_path):
+        h, w = levels[0].shape[:2]
+        top = math.ceil(math.log2(max(w, h)))
+        tiles_folder = os.path.splitext(dzi_path)[0] + "_files"
+        with open(dzi_path, 'w', encoding='utf-8') as f:
+            f.write(DZI_TEMPLATE.format(format='jpg', overlap=self.tile_overlap, tile_size=self.tile_size,
+                                        width=w, height=h))
+
+        # Level `top` is full size, each level below is half the one above (rounded up), down to 1x1
+        size, overlap = self.tile_size, self.tile_overlap
+        params = [cv2.IMWRITE_JPEG_QUALITY, self.tile_quality]
+        jobs = []
+        for level in range(top, -1, -1):
+            index = top - level
+            while len(levels) <= index:
+                _halve(levels)
+            tile_source = levels[index]
+            lh, lw = tile_source.shape[:2]
+            folder = os.path.join(tiles_folder, str(level))
+            os.makedirs(folder, exist_ok=True)
+            for row in range(math.ceil(lh / size)):
+                for col in range(math.ceil(lw / size)):
+                    x0, y0 = max(col * size - overlap, 0), max(row * size - overlap, 0)
+                    x1, y1 = min((col + 1) * size + overlap, lw), min((row + 1) * size + overlap, lh)
+                    jobs.append((os.path.join(folder, f"{col}_{row}.jpg"), tile_source[y0:y1, x0:x1], params))
+        return jobs
+
+
+def _level_above(levels, side):
+    # Smallest halving of the image that is still at least `side` on its long side
+    while max(levels[-1].shape[:2]) // 2 >= side:
+        _halve(levels)
+    for level in reversed(levels):
+        if max(level.shape[:2]) >= side:
+            return level
+    return levels[0]
+
+
+def _halve(levels):
+    # Next pyramid level, half the last one rounded up (the DeepZoom level sizes)
+    h, w = levels[-1].shape[:2]
+    levels.append(cv2.resize(levels[-1], ((w + 1) // 2, (h + 1) // 2), interpolation=cv2.INTER_AREA))
+
+
+def _fit(image, side):
+    h, w = image.shape[:2]
+    scale = side / max(h, w)
+    if scale >= 1:
+        return image
+    return cv2.resize(image, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+
+
+def _encode(job):
+    path, image, params = job
+    return cv2.imwrite(path, image, params)
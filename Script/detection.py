@@ -1,8 +1,130 @@
 import cv2
 import numpy as np
 
+# Detector engines by name: (cost, function(detector, image, pyramid) -> (corners, score)).
+# detect_with_score tries them cheapest first and stops at the first confident one,
+# pyramid is the list of image levels they share (see _pyramid_level).
+# Costs are relative run times on a GoPro frame, add engines with register_engine.
+DETECTOR_ENGINES = {}
+
+# HSV ranges of the quadrat frame colours (OpenCV hue is 0-180). Underwater,
+# white PVC comes out as a pale blue-green, so white allows some saturation
+FRAME_COLOURS = {
+    'white': ((0, 0, 150), (180, 80, 255)),
+    'yellow': ((15, 90, 90), (40, 255, 255)),
+    'orange': ((5, 110, 90), (20, 255, 255)),
+}
+
+
+def register_engine(name, cost):
+    def register(function):
+        DETECTOR_ENGINES[name] = (cost, function)
+        return function
+    return register
+
+
 class QuadrantDetector:
+    def __init__(self, coarse_size=1024, refine_window=10, engines=None, accept_score=0.8,
+                 frame_colour='white', colour_size=512):
+        # Long side of the pyramid level the search runs on, and the half-size
+        # of the full resolution windows the corners are refined in
+        self.coarse_size = coarse_size
+        self.refine_window = refine_window
+        # Engine names to try (default: all registered, by cost) and the score
+        # at which a result is trusted without trying the next engine
+        self.engines = engines
+        self.accept_score = accept_score
+        # Frame colour: a FRAME_COLOURS name or an HSV (lower, upper) pair
+        self.frame_colour = FRAME_COLOURS[frame_colour] if isinstance(frame_colour, str) else frame_colour
+        self.colour_size = colour_size
+    
+    def settings(self):
+        # Constructor arguments, to build the same detector in a worker process
+        return {'coarse_size': self.coarse_size, 'refine_window': self.refine_window, 'engines': self.engines,
+                'accept_score': self.accept_score, 'frame_colour': self.frame_colour,
+                'colour_size': self.colour_size}
+    
     def detect_automatically(self, image):
+        corners, score = self.detect_with_score(image)
+        return corners
+    
+    def detect_with_score(self, image):
+        corners, score, engine = self.detect_with_engine(image)
+        return corners, score
+    
+    def detect_with_engine(self, image):
+        """Run the engines cheapest first, returns (corners, score, engine name).
+
+        Stops at the first result scoring at least accept_score; if none does,
+        the best scoring result is returned (or (None, 0, None))."""
+        best = (None, 0.0, None)
+        # Levels built by one engine are reused by the next; per call, so one
+        # detector can be used from several threads
+        pyramid = [image]
+        for name in self.engine_order():
+            corners, score = DETECTOR_ENGINES[name][1](self, image, pyramid)
+            if corners is not None and score > best[1]:
+                best = (corners, score, name)
+            if best[1] >= self.accept_score:
+                break
+        return best
+    
+    def engine_order(self):
+        names = self.engines if self.engines is not None else list(DETECTOR_ENGINES)
+        return sorted(names, key=lambda name: DETECTOR_ENGINES[name][0])
+    
+    @register_engine('edges', cost=1)
+    def detect_edges(self, image, pyramid=None):
+        """Coarse-to-fine contour detection, returns (corners, score) or (None, 0).
+
+        Candidates are found on a downscaled pyramid level and scored all at
+        once; only the four winning corners are refined at full resolution.
+        """
+        small, scale = self._pyramid_level(image, pyramid=pyramid)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+        edges = cv2.Canny(blurred, 50, 150)
+        # Downscaling breaks thin frame edges into pieces, close the gaps again
+        edges = cv2.dilate(edges, np.ones((3, 3), np.uint8))
+        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        
+        # Same thresholds as the full resolution detector, in full resolution pixels
+        min_area = 10000 * scale * scale
+        h, w = small.shape[:2]
+        quads = []
+        areas = []
+        for contour in contours:
+            area = cv2.contourArea(contour)
+            if area < min_area:
+                continue
+            epsilon = 0.02 * cv2.arcLength(contour, True)
+            approx = cv2.approxPolyDP(contour, epsilon, True)
+            if len(approx) == 4:
+                quad = approx.reshape(4, 2)
+                # Edge clutter merges into one blob whose outline is the image border, not a frame
+                if (quad.min() <= 1 or np.any(quad[:, 0] >= w - 2) or np.any(quad[:, 1] >= h - 2)):
+                    continue
+                quads.append(quad)
+                areas.append(area)
+        
+        if not quads:
+            return None, 0.0
+        
+        # Scale the scores by how much of each side is on an edge, sides that
+        # don't follow the frame (clutter, a bent outline) send it to review
+        near_edges = cv2.dilate(edges, np.ones((3, 3), np.uint8))
+        support = np.array([_edge_support(near_edges, quad) for quad in quads])
+        quads = np.array(quads, dtype=np.float32) / scale
+        scores = self._score_quads(quads, np.array(areas) / (scale * scale)) * support
+        best = int(np.argmax(scores))
+        if scores[best] <= 0:
+            return None, 0.0
+        
+        corners = self._sort_corners(quads[best])
+        return self._refined_result(image, corners.astype(np.float32), scale, float(scores[best]))
+    
+    def detect_full_resolution(self, image):
+        # Original single-scale detector, kept for comparison
         # Simplified detection because complex drops too many images
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         blurred = cv2.GaussianBlur(gray, (5, 5), 0)
@@ -30,14 +152,226 @@ class QuadrantDetector:
         return self._sort_corners(best_corners) if best_corners is not None else None
     
     def detect_with_fallback(self, image, ui):
-        corners = self.detect_automatically(image)
-        if corners is not None:
-            print("✓ Auto-detected quadrant")
+        # A person is only asked when every engine is unsure
+        corners, score, engine = self.detect_with_engine(image)
+        if corners is not None and score >= self.accept_score:
+            print(f"✓ Auto-detected quadrant ({engine}, score {score:.2f})")
             return corners
         else:
-            print("⚠ Auto-detection failed, switching to manual")
+            print("⚠ Auto-detection unsure, switching to manual")
             return ui.manual_corner_selection(image)
     
+    @register_engine('frame_colour', cost=2)
+    def detect_frame_colour(self, image, pyramid=None):
+        """Find the frame by its colour and fit a line to the outside of each bar.
+
+        Runs on a small pyramid level: the frame colour is segmented in HSV,
+        Hough lines on the outline of the frame-coloured blobs give the bars,
+        and the outermost line on each side of the two bar directions are
+        intersected for the corners. The lines are then refit on a finer level
+        before the corners are refined at full resolution. Doesn't need a
+        clean closed contour, so reef clutter touching the frame and short
+        gaps in a bar don't stop it.
+        """
+        small, scale = self._pyramid_level(image, self.colour_size, pyramid)
+        hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+        lower, upper = self.frame_colour
+        mask = cv2.inRange(hsv, np.array(lower, np.uint8), np.array(upper, np.uint8))
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((3, 3), np.uint8))
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((5, 5), np.uint8))
+
+        # Only long blobs can be (part of) a bar
+        h, w = mask.shape[:2]
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(mask)
+        min_extent = 0.15 * min(h, w)
+        keep = np.zeros(count, dtype=bool)
+        keep[1:] = np.maximum(stats[1:, cv2.CC_STAT_WIDTH], stats[1:, cv2.CC_STAT_HEIGHT]) >= min_extent
+        if not keep.any():
+            return None, 0.0
+        mask = np.where(keep[labels], 255, 0).astype(np.uint8)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+        outline = np.zeros_like(mask)
+        cv2.drawContours(outline, contours, -1, 255, 1)
+
+        lines = cv2.HoughLines(outline, 1, np.pi / 360, int(min_extent))
+        if lines is None:
+            return None, 0.0
+        points = np.vstack([contour.reshape(-1, 2) for contour in contours]).astype(np.float32)
+        sides = self._outer_lines(lines[:, 0], points)
+        if sides is None:
+            return None, 0.0
+
+        quad = self._corners_of(sides)
+        if quad is None or not (np.all(quad >= -0.5) and np.all(quad <= (w - 0.5, h - 0.5))):
+            return None, 0.0
+        coverage = _bar_coverage(mask, quad)
+
+        # One pixel up here is 8-16 full resolution pixels on a GoPro frame, too
+        # coarse for cornerSubPix to find its way back. Fit the lines again on
+        # the level above coarse_size (1024-2048 px long side)
+        fine, fine_scale = self._pyramid_level(image, 2 * self.coarse_size, pyramid)
+        if fine_scale > scale:
+            sides = self._refit_sides(fine, sides, fine_scale / scale)
+            if sides is None:
+                return None, 0.0
+            quad = self._corners_of(sides)
+            if quad is None:
+                return None, 0.0
+            scale = fine_scale
+
+        quad = (quad + 0.5) / scale - 0.5
+        area = cv2.contourArea(quad)
+        score = float(self._score_quads(quad[None], np.array([area]))[0]) * coverage
+        if score <= 0:
+            return None, 0.0
+        # The fitted lines are good to about half a pyramid pixel, a smaller window will do
+        return self._refined_result(image, quad.astype(np.float32), 2 * scale, score)
+
+    def _corners_of(self, sides):
+        # Sorted corners of the (a0, a1, b0, b1) side lines from _outer_lines, None if two don't meet.
+        # Adjacent sides meet at the corners, opposite sides are the near parallel pairs
+        quad = []
+        for a, b in ((0, 2), (2, 1), (1, 3), (3, 0)):
+            corner = _intersect(sides[a], sides[b])
+            if corner is None:
+                return None
+            quad.append(corner)
+        return self._sort_corners(np.array(quad, dtype=np.float32))
+    
+    def _refit_sides(self, fine, sides, ratio):
+        # Refit the (point, direction) side lines found on a coarser level to the
+        # frame outline on `fine`, `ratio` times the resolution
+        hsv = cv2.cvtColor(fine, cv2.COLOR_BGR2HSV)
+        lower, upper = self.frame_colour
+        mask = cv2.inRange(hsv, np.array(lower, np.uint8), np.array(upper, np.uint8))
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((3, 3), np.uint8))
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+        if not contours:
+            return None
+        points = np.vstack([contour.reshape(-1, 2) for contour in contours]).astype(np.float32)
+        refit = []
+        for point, direction in sides:
+            point = (point + 0.5) * ratio - 0.5
+            normal = np.array([-direction[1], direction[0]])
+            # The coarse line is good to about a coarse pixel, start the band there
+            line = self._fit_line(points, normal, normal @ point, band=max(3.0, 1.5 * ratio))
+            if line is None:
+                return None
+            refit.append(line)
+        return refit
+    
+    def _outer_lines(self, lines, points):
+        # Split the Hough lines into the two bar directions and take the outermost
+        # line on each side of the frame in both; each is refit to the outline
+        # points along it. Returns (a0, a1, b0, b1) as (point, direction) or None
+        centre = points.mean(axis=0)
+        rho, theta = lines[:, 0], lines[:, 1]
+        # Orientation on the doubled-angle circle, so theta and theta + pi agree
+        doubled = np.stack([np.cos(2 * theta), np.sin(2 * theta)], axis=1)
+        first = doubled[0]
+        group = doubled @ first < 0  # more than 45 degrees away from the strongest line
+        if group.all() or not group.any():
+            return None
+        sides = []
+        for members in (~group, group):
+            normal = np.stack([np.cos(theta[members]), np.sin(theta[members])], axis=1)
+            # Near-vertical lines come as theta ~0 or ~pi with opposite rho; flip to one normal
+            flip = np.where(normal @ normal[0] < 0, -1.0, 1.0)
+            normal = normal * flip[:, None]
+            line_rho = rho[members] * flip
+            # Signed distance of each line from the frame centre, along the line normal
+            offset = line_rho - normal @ centre
+            for side in (offset < 0, offset > 0):
+                if not side.any():
+                    return None
+                i = int(np.argmax(np.abs(offset) * side))
+                line = self._fit_line(points, normal[i], line_rho[i])
+                if line is None:
+                    return None
+                sides.append(line)
+        return sides
+    
+    def _fit_line(self, points, normal, rho, band=3.0):
+        # Robust (Huber) line through the outline points near a Hough line. The
+        # Hough line is only good to a pixel and a fraction of a degree, so the
+        # points are picked again around the first fit with a tighter band
+        for band in (band, band / 2):
+            near = points[np.abs(points @ normal - rho) <= band]
+            if len(near) < 10:
+                return None
+            vx, vy, x, y = cv2.fitLine(near, cv2.DIST_HUBER, 0, 0.01, 0.01).ravel()
+            normal = np.array([-vy, vx])
+            rho = normal @ (x, y)
+        return np.array([x, y]), np.array([vx, vy])
+    
+    def _pyramid_level(self, image, size=None, pyramid=None):
+        # Halve until the long side fits size (default coarse_size). Levels are
+        # added to pyramid (a list starting with image), so the engines share them
+        size = size or self.coarse_size
+        levels = pyramid if pyramid and pyramid[0] is image else [image]
+        scale = 1.0
+        for level in levels:
+            if max(level.shape[:2]) <= size:
+                return level, scale
+            scale *= 0.5
+        small = levels[-1]
+        while max(small.shape[:2]) > size:
+            small = cv2.pyrDown(small)
+            levels.append(small)
+        return small, 0.5 ** (len(levels) - 1)
+    
+    def _score_quads(self, quads, areas):
+        # Vectorised _calculate_score for an (N, 4, 2) stack of quads
+        sides = np.linalg.norm(quads - np.roll(quads, -1, axis=1), axis=2)
+        mean = sides.mean(axis=1)
+        regularity = 1.0 / (1.0 + sides.std(axis=1) / np.where(mean > 0, mean, 1))
+        return np.where(mean > 0, regularity * np.minimum(areas / 50000, 1.0), 0)
+    
+    def refine_corners(self, image, corners, accuracy=1.0):
+        # Refine corners known to within about `accuracy` pixels (e.g. tracked on a preview)
+        refined, rejected = self._refine_corners(image, np.asarray(corners, dtype=np.float32),
+                                                 min(0.5, 1.0 / max(accuracy, 1e-6)))
+        return refined
+    
+    def _refine_corners(self, image, corners, scale):
+        # Sub-pixel refinement in a small full resolution window around each corner.
+        # The coarse corner is only accurate to about one pyramid pixel, so the
+        # window covers a few of those. Returns (corners, number of corners whose
+        # refinement ran off and kept the coarse estimate)
+        if scale >= 1.0:
+            return corners, 0
+        half = max(self.refine_window, int(np.ceil(2 / scale)))
+        h, w = image.shape[:2]
+        refined = corners.copy()
+        rejected = 0
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01)
+        for i, (x, y) in enumerate(corners):
+            x0, y0 = int(max(x - 2 * half, 0)), int(max(y - 2 * half, 0))
+            x1, y1 = int(min(x + 2 * half + 1, w)), int(min(y + 2 * half + 1, h))
+            if x1 - x0 < 2 * half + 3 or y1 - y0 < 2 * half + 3:
+                continue
+            window = cv2.cvtColor(image[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+            start = np.array([[[x - x0, y - y0]]], dtype=np.float32)
+            point = cv2.cornerSubPix(window, start.copy(), (half, half), (-1, -1), criteria)
+            px, py = point[0, 0] + (x0, y0)
+            # Keep the coarse estimate if the refinement ran off to another feature.
+            # OpenCV itself hands the start point back when it runs out of the
+            # window, or when there's no corner to converge on
+            if np.array_equal(point, start) or abs(px - x) > half or abs(py - y) > half:
+                rejected += 1
+            else:
+                refined[i] = (px, py)
+        return refined, rejected
+    
+    def _refined_result(self, image, corners, scale, score):
+        # (corners, score) of an engine after refinement. A corner whose refinement
+        # ran off is likely off itself: one costs a quarter of the score, which
+        # drops a result below accept_score, more than one drops the result
+        corners, rejected = self._refine_corners(image, corners, scale)
+        if rejected > 1:
+            return None, 0.0
+        return corners, score * (1.0 - 0.25 * rejected)
+    
     def _calculate_score(self, corners, area):
         # Simplified scoring
         sides = [np.linalg.norm(corners[i] - corners[(i+1)%4]) for i in range(4)]
@@ -54,4 +388,49 @@ class QuadrantDetector:
         sorted_corners = [corners[i] for i in np.argsort(angles)]
         sums = [p[0] + p[1] for p in sorted_corners]
         tl_idx = np.argmin(sums)
-        return np.roll(sorted_corners, -tl_idx, axis=0)
\ No newline at end of file
+        return np.roll(sorted_corners, -tl_idx, axis=0)
+
+def _intersect(a, b):
+    # Intersection of two (point, direction) lines, None when they're near parallel
+    (p, d), (q, e) = a, b
+    cross = d[0] * e[1] - d[1] * e[0]
+    if abs(cross) < 0.5:  # less than 30 degrees apart
+        return None
+    t = ((q[0] - p[0]) * e[1] - (q[1] - p[1]) * e[0]) / cross
+    return p + t * d
+
+
+def _edge_support(edges, quad, samples=64):
+    # Fraction of points along each side that lie on an edge pixel, worst side.
+    # The eighths at either end count on their own too: a gap there means the
+    # corner itself isn't seen (covered, or the outline ran off along clutter)
+    h, w = edges.shape[:2]
+    end = samples // 8
+    worst = 1.0
+    for i in range(4):
+        a, b = quad[i], quad[(i + 1) % 4]
+        t = (np.arange(samples) + 0.5) / samples
+        along = a + t[:, None] * (b - a)
+        x = np.clip(np.round(along[:, 0]).astype(int), 0, w - 1)
+        y = np.clip(np.round(along[:, 1]).astype(int), 0, h - 1)
+        hits = edges[y, x] > 0
+        worst = min(worst, float(hits.mean()), float(hits[:end].mean()), float(hits[-end:].mean()))
+    return worst
+
+
+def _bar_coverage(mask, quad, samples=64, inset=2.0):
+    # Fraction of points just inside each side that are frame coloured, worst side.
+    # Catches quads fitted to clutter and frames with a bar missing
+    centre = quad.mean(axis=0)
+    h, w = mask.shape[:2]
+    worst = 1.0
+    for i in range(4):
+        a, b = quad[i], quad[(i + 1) % 4]
+        t = (np.arange(samples) + 0.5) / samples
+        along = a + t[:, None] * (b - a)
+        inward = centre - along
+        along = along + inset * inward / np.linalg.norm(inward, axis=1, keepdims=True)
+        x = np.clip(np.round(along[:, 0]).astype(int), 0, w - 1)
+        y = np.clip(np.round(along[:, 1]).astype(int), 0, h - 1)
+        worst = min(worst, float(np.mean(mask[y, x] > 0)))
+    return worst
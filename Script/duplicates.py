@@ -0,0 +1,171 @@
+import csv
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from calibration_store import read_capture_time, read_image_info
+from quality import ANALYSIS_SIZE, QualityScreen, reduction_factor
+
+SHOT_INDEX_NAME = "shot_index.json"
+DUPLICATES_LIST_NAME = "duplicates.csv"
+
+REDUCED_GRAY_FLAGS = {1: cv2.IMREAD_GRAYSCALE, 2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+                      4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+
+# Bits (of 64) two shots may differ by and still be the same quadrat. Re-shots
+# of one quadrat (a few % shift, a few degrees of tilt, blur) land around 2-10,
+# different quadrats on similar seabed 18 and up
+MAX_DISTANCE = 12
+# Longest pause between two shots of one group, when the files have EXIF times
+MAX_GAP = 120.0
+
+
+def perceptual_hash(gray):
+    # 64 bit DCT hash: the 8x8 lowest frequencies of a 32x32 thumbnail against their median (DC left out)
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA)
+    low = cv2.dct(np.float32(small))[:8, :8].ravel()
+    bits = low > np.median(low[1:])
+    return int(''.join('1' if bit else '0' for bit in bits), 2)
+
+
+def hash_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def _measure_shot(image_path):
+    # Hash, sharpness and capture time from a reduced greyscale decode (~1024 px)
+    _, image_size = read_image_info(image_path)
+    factor = reduction_factor(image_size, ANALYSIS_SIZE)
+    gray = cv2.imread(image_path, REDUCED_GRAY_FLAGS[factor])
+    if gray is None:
+        return None
+    stat = os.stat(image_path)
+    return {
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'image_size': list(image_size) if image_size else [gray.shape[1] * factor, gray.shape[0] * factor],
+        'hash': f"{perceptual_hash(gray):016x}",
+        'sharpness': round(QualityScreen().measure(gray)['sharpness'], 2),
+        'time': read_capture_time(image_path),
+    }
+
+
+class ShotIndex:
+    """Perceptual hash, sharpness and capture time of every image in a folder.
+
+    Built from 1/4-1/8 scale greyscale JPEG decodes on a thread pool (~10 ms
+    an image) and cached in a JSON file, so a re-run only measures new or
+    changed files. groups() puts consecutive shots (by EXIF time, else file
+    name) of the same size whose hashes are close into one group, sharpest
+    first.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path=None):
+        self.path = path
+        self.shots = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') == self.VERSION:
+                    self.shots = data.get('shots', {})
+            except (OSError, ValueError):
+                pass  # a broken cache is rebuilt
+
+    def _stale(self, image_path):
+        shot = self.shots.get(os.path.basename(image_path))
+        if shot is None:
+            return True
+        stat = os.stat(image_path)
+        return (shot['size'], shot['mtime']) != (stat.st_size, stat.st_mtime)
+
+    def update(self, image_files, jobs=None):
+        todo = [path for path in image_files if self._stale(path)]
+        if todo:
+            print(f"🔍 Hashing {len(todo)} image(s) for near-duplicate shots...")
+            with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+                for image_path, shot in zip(todo, pool.map(_measure_shot, todo)):
+                    if shot is not None:
+                        self.shots[os.path.basename(image_path)] = shot
+            self.save()
+        return self
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.VERSION, 'shots': self.shots}, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def groups(self, image_files, max_distance=MAX_DISTANCE, max_gap=MAX_GAP):
+        """Lists of image paths, one per quadrat shot, the sharpest first.
+
+        Images that couldn't be measured are groups of their own.
+        """
+        measured = [(path, self.shots[os.path.basename(path)]) for path in image_files
+                    if os.path.basename(path) in self.shots]
+        groups = [[path] for path in image_files if os.path.basename(path) not in self.shots]
+        # Time order only if every image has one, otherwise the camera's file numbering
+        timed = bool(measured) and all(shot['time'] is not None for _, shot in measured)
+        if timed:
+            measured.sort(key=lambda item: (item[1]['time'], item[0]))
+        else:
+            measured.sort(key=lambda item: item[0])
+
+        current = []
+        for path, shot in measured:
+            if current and self._same_quadrat(current, shot, max_distance, max_gap if timed else None):
+                current.append((path, shot))
+                continue
+            if current:
+                groups.append(current)
+            current = [(path, shot)]
+        if current:
+            groups.append(current)
+
+        result = []
+        for group in groups:
+            if isinstance(group[0], str):
+                result.append(group)
+            else:
+                result.append([path for path, _ in sorted(group, key=lambda item: -item[1]['sharpness'])])
+        return sorted(result, key=lambda group: min(group))
+
+    def _same_quadrat(self, group, shot, max_distance, max_gap):
+        last = group[-1][1]
+        if last['image_size'] != shot['image_size']:
+            return False
+        if max_gap is not None and shot['time'] - last['time'] > max_gap:
+            return False
+        # Close to any shot of the group: re-shots drift, compare with all of them
+        shot_hash = int(shot['hash'], 16)
+        return any(hash_distance(int(other['hash'], 16), shot_hash) <= max_distance for _, other in group)
+
+    def distance(self, path_a, path_b):
+        a, b = self.shots[os.path.basename(path_a)], self.shots[os.path.basename(path_b)]
+        return hash_distance(int(a['hash'], 16), int(b['hash'], 16))
+
+
+def duplicate_groups(image_files, output_folder, jobs=None):
+    """{representative: [siblings]} for image_files, with the index cached in
+    output_folder and the groups listed in duplicates.csv there."""
+    index = ShotIndex(os.path.join(output_folder, SHOT_INDEX_NAME)).update(image_files, jobs)
+    groups = {group[0]: group[1:] for group in index.groups(image_files)}
+    siblings = sum(len(group) for group in groups.values())
+    print(f"🔁 {len(groups)} quadrat shot(s), {siblings} near-duplicate(s) of them")
+    with open(os.path.join(output_folder, DUPLICATES_LIST_NAME), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["image", "representative", "distance", "sharpness"])
+        for representative, others in sorted(groups.items()):
+            for path in [representative] + others:
+                shot = index.shots.get(os.path.basename(path))
+                writer.writerow([os.path.basename(path), os.path.basename(representative),
+                                 index.distance(path, representative) if shot else "",
+                                 f"{shot['sharpness']:.1f}" if shot else ""])
+    return groups
@@ -0,0 +1,116 @@
+import cv2
+import numpy as np
+
+# Per-channel (x, y) shifts applied in output space, in BGR order. Green is the
+# reference channel; these values work well for most GoPro images (found on the internet)
+CHANNEL_SHIFTS = ((-1.0, -0.5), (0.0, 0.0), (1.5, 1.0))
+
+# Rough working set per output pixel of one strip: fixed-point maps and
+# initUndistortRectifyMap temporaries per channel group, the warped strip and
+# the colour LUT gather. Used to size strips for a memory ceiling
+STRIP_BYTES_PER_PIXEL = 64
+
+# Extra source pixels around a strip's footprint, enough for any remap kernel
+SOURCE_MARGIN = 4
+
+
+class GeometryEngine:
+    """Fused undistort + perspective + chromatic aberration in a single remap pass.
+
+    For every output pixel the engine walks straight back to the raw sensor:
+    channel shift -> inverse homography -> lens model -> raw pixel. The corners
+    are given in undistorted image coordinates (what the user clicks on), so the
+    output matches the old undistort/warpPerspective/warpAffine chain while only
+    resampling the pixels that are actually kept.
+    """
+
+    def __init__(self, channel_shifts=CHANNEL_SHIFTS, interpolation=cv2.INTER_LINEAR):
+        self.channel_shifts = tuple(tuple(float(v) for v in s) for s in channel_shifts)
+        self.interpolation = interpolation
+
+    def homography(self, corners, output_size=2000):
+        # Undistorted image -> output square, same as correct_perspective
+        dst_corners = np.array([[0, 0], [output_size-1, 0],
+                               [output_size-1, output_size-1], [0, output_size-1]], dtype=np.float32)
+        return cv2.getPerspectiveTransform(np.asarray(corners, dtype=np.float32), dst_corners)
+
+    def build_maps(self, corners, image_size, calibrator=None, output_size=2000, rows=None):
+        """Build one fixed-point remap table per distinct channel shift.
+
+        Returns a list of (channel indices, map1, map2) so channels that share a
+        shift (normally just green) are sampled together. rows=(y0, y1) builds
+        only those output rows, with the same values as the full maps.
+        """
+        camera_matrix, dist_coeffs, new_camera_matrix = self._lens(image_size, calibrator)
+        H = self.homography(corners, output_size).astype(np.float64)
+        y0, y1 = rows if rows is not None else (0, output_size)
+        # Output row y0 of the full square is row 0 of the strip: R_strip = S^-1 R
+        S_inv = np.array([[1, 0, 0], [0, 1, -y0], [0, 0, 1]], dtype=np.float64)
+
+        groups = {}
+        for channel, shift in enumerate(self.channel_shifts):
+            groups.setdefault(shift, []).append(channel)
+
+        maps = []
+        for (dx, dy), channels in groups.items():
+            # initUndistortRectifyMap with an identity "new" camera matrix treats
+            # R^-1 as a plain homography on output pixels, so R^-1 = K_new^-1 H^-1 T^-1
+            # lands in normalised camera coordinates before the lens model is applied
+            T = np.array([[1, 0, dx], [0, 1, dy], [0, 0, 1]], dtype=np.float64)
+            R = S_inv @ T @ H @ new_camera_matrix
+            map1, map2 = cv2.initUndistortRectifyMap(
+                camera_matrix, dist_coeffs, R, np.eye(3), (output_size, y1 - y0), cv2.CV_16SC2)
+            maps.append((channels, map1, map2))
+        return maps
+
+    def render(self, image, corners, calibrator=None, output_size=2000):
+        return self.render_rows(image, corners, calibrator, output_size, 0, output_size)
+
+    def render_rows(self, image, corners, calibrator, output_size, y0, y1, out=None):
+        """Output rows y0..y1 of the rendered square, reading only the source region they need.
+
+        Writes into `out` (a (y1 - y0, output_size, 3) view) when given.
+        """
+        h, w = image.shape[:2]
+        maps = self.build_maps(corners, (w, h), calibrator, output_size, rows=(y0, y1))
+
+        output = out
+        if output is None:
+            output = np.empty((y1 - y0, output_size) + image.shape[2:], dtype=image.dtype)
+        for channels, map1, map2 in maps:
+            # Crop the source to this strip's footprint (a view, nothing is copied)
+            # and shift the integer map coordinates to match. Samples outside the
+            # crop are outside the image too, so the border handling is unchanged
+            x_min = min(max(int(map1[:, :, 0].min()) - SOURCE_MARGIN, 0), w - 1)
+            x_max = min(max(int(map1[:, :, 0].max()) + SOURCE_MARGIN + 1, x_min + 1), w)
+            y_min = min(max(int(map1[:, :, 1].min()) - SOURCE_MARGIN, 0), h - 1)
+            y_max = min(max(int(map1[:, :, 1].max()) + SOURCE_MARGIN + 1, y_min + 1), h)
+            if x_min > 0 or y_min > 0:
+                shifted = map1.astype(np.int32) - np.array([x_min, y_min], dtype=np.int32)
+                map1 = np.clip(shifted, -32768, 32767).astype(np.int16)
+            source = image[y_min:y_max, x_min:x_max]
+
+            # Only the channels this shift is for are sampled; with the default
+            # shifts that's one channel per remap instead of all three
+            if source.ndim == 2 or len(channels) == source.shape[2]:
+                output[:] = cv2.remap(source, map1, map2, self.interpolation, borderMode=cv2.BORDER_CONSTANT)
+                continue
+            for channel in channels:
+                plane = np.ascontiguousarray(source[:, :, channel])
+                output[:, :, channel] = cv2.remap(plane, map1, map2, self.interpolation,
+                                                  borderMode=cv2.BORDER_CONSTANT)
+        return output
+
+    def strip_rows(self, output_size, max_memory):
+        # Rows per strip so one strip's working set stays under max_memory bytes
+        if not max_memory:
+            return output_size
+        return int(min(output_size, max(16, max_memory // (output_size * STRIP_BYTES_PER_PIXEL))))
+
+    def _lens(self, image_size, calibrator):
+        # Without a calibration the lens model is the identity and only the
+        # homography and channel shifts remain
+        if calibrator is None or calibrator.camera_matrix is None or calibrator.dist_coeffs is None:
+            return np.eye(3), None, np.eye(3)
+        return (calibrator.camera_matrix, calibrator.dist_coeffs,
+                calibrator.get_new_camera_matrix(image_size).astype(np.float64))
@@ -0,0 +1,157 @@
+import contextlib
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+RUN_LOG_NAME = "run_log.jsonl"
+
+_NO_OP = contextlib.nullcontext()
+
+
+class RunLog:
+    """Per-stage timers for each image, written as one JSON line per image.
+
+    Stages are timed with `with log.stage(image_path, 'decode'):` from any
+    thread, and the image's record is written when `finish()` is called.
+    With trace_memory=True each stage also records the peak Python/numpy
+    allocation while it ran (tracemalloc, process wide, so overlapping stages
+    on other threads are included). A disabled log (NULL_LOG) hands out a
+    shared no-op context, so leaving the calls in costs next to nothing.
+    """
+
+    def __init__(self, path=None, trace_memory=False, enabled=True):
+        self.path = path
+        self.enabled = enabled
+        self.trace_memory = trace_memory and enabled
+        self.started = time.perf_counter()
+        self.records = []
+        self._open = {}
+        self._lock = threading.Lock()
+        self._file = None
+        if enabled and path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            # Appended to, so one file can collect a whole field season
+            self._file = open(path, 'a', encoding='utf-8')
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stage(self, image_path, name):
+        if not self.enabled:
+            return _NO_OP
+        return self._timed(image_path, name)
+
+    @contextlib.contextmanager
+    def _timed(self, image_path, name):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] if self.trace_memory else None
+            self.add(image_path, name, seconds, peak)
+
+    def add(self, image_path, name, seconds, peak_bytes=None):
+        # Record a stage timed elsewhere (e.g. in a worker process); repeats add up
+        if not self.enabled:
+            return
+        with self._lock:
+            record = self._open.setdefault(image_path, {'image': os.path.basename(image_path), 'stages': {}})
+            stage = record['stages'].setdefault(name, {'s': 0.0})
+            stage['s'] += seconds
+            if peak_bytes is not None:
+                stage['peak_mb'] = max(stage.get('peak_mb', 0.0), peak_bytes / 2**20)
+
+    def add_stages(self, image_path, stages):
+        # Stages as returned by stage_timings() in a worker process
+        for name, (seconds, peak_bytes) in stages.items():
+            self.add(image_path, name, seconds, peak_bytes)
+
+    def finish(self, image_path, status, **extra):
+        if not self.enabled:
+            return
+        with self._lock:
+            record = self._open.pop(image_path, None) or {'image': os.path.basename(image_path), 'stages': {}}
+            record['status'] = status
+            record['time'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+            record.update(extra)
+            self.records.append(record)
+            if self._file is not None:
+                self._file.write(json.dumps(_rounded(record)) + "\n")
+                self._file.flush()
+
+    def summary(self):
+        """p50/p95/total seconds per stage and images per minute over the run so far."""
+        with self._lock:
+            records = list(self.records)
+        elapsed = time.perf_counter() - self.started
+        stages = {}
+        for record in records:
+            for name, stage in record['stages'].items():
+                stages.setdefault(name, []).append(stage['s'])
+        done = sum(1 for record in records if record['status'] == 'ok')
+        return {
+            'images': len(records),
+            'ok': done,
+            'elapsed_s': elapsed,
+            'images_per_minute': done / elapsed * 60 if elapsed > 0 else 0.0,
+            'stages': {name: {'p50_s': float(np.percentile(values, 50)), 'p95_s': float(np.percentile(values, 95)),
+                              'total_s': float(np.sum(values)), 'count': len(values)}
+                       for name, values in stages.items()},
+        }
+
+    def print_summary(self):
+        if not self.enabled or not self.records:
+            return
+        summary = self.summary()
+        print(f"\n⏱ Stage times over {summary['images']} images (p50 / p95 / total):")
+        for name, stage in sorted(summary['stages'].items(), key=lambda item: -item[1]['total_s']):
+            print(f"   {name:<10} {stage['p50_s']:7.2f}s {stage['p95_s']:7.2f}s {stage['total_s']:9.1f}s")
+        print(f" Throughput: {summary['images_per_minute']:.1f} images/minute")
+        if self.path:
+            print(f" Run log: {self.path}")
+
+    def close(self):
+        if self._file is not None:
+            summary = self.summary()
+            if summary['images']:
+                self._file.write(json.dumps({'summary': summary}) + "\n")
+            self._file.close()
+            self._file = None
+
+
+NULL_LOG = RunLog(enabled=False)
+
+
+def _rounded(record):
+    # Milliseconds and tenths of a MB are plenty in the file
+    stages = {name: {key: round(value, 4 if key == 's' else 1) for key, value in stage.items()}
+              for name, stage in record['stages'].items()}
+    return dict(record, stages=stages)
+
+
+def stage_timings(enabled, trace_memory=False):
+    """Stand-alone timer for worker processes: (timer, stages) where stages is a
+    plain dict {name: (seconds, peak_bytes)} that pickles back to the parent."""
+    if not enabled:
+        return (lambda name: _NO_OP), None
+    stages = {}
+
+    @contextlib.contextmanager
+    def timer(name):
+        if trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+            stages[name] = (time.perf_counter() - start, peak)
+    return timer, stages
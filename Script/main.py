@@ -1,5 +1,6 @@
 from quadrant_processor import GoProQuadrantProcessor
 import os
+import sys
 
 def main():
     processor = GoProQuadrantProcessor()
@@ -19,15 +20,28 @@ def main():
     print("="*50)
     print("1. Process only a single image")
     print("2. Batch process folder of pictures")
+    print("3. Render a saved corners manifest")
+    print("4. Extract quadrats from transect video")
+    print("5. Watch ingest folders (process images as they are copied in)")
     
-    choice = input("\nChoose processing mode (1 or 2): ").strip()
+    choice = input("\nChoose processing mode (1-5): ").strip()
     
     if choice == "1":
         processor.single_image_mode()
     elif choice == "2":
         processor.batch_mode()
+    elif choice == "3":
+        processor.render_manifest_mode()
+    elif choice == "4":
+        processor.video_mode()
+    elif choice == "5":
+        processor.watch_mode()
     else:
         print("Invalid choice")
 
 if __name__ == "__main__":
+    # Any arguments switch to the non-interactive command line (see cli.py)
+    if len(sys.argv) > 1:
+        from cli import main as cli_main
+        sys.exit(cli_main())
     main()
\ No newline at end of file
@@ -0,0 +1,235 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+MANIFEST_NAME = "corners_manifest.json"
+RUN_MANIFEST_NAME = "run_manifest.json"
+
+# The run manifest is rewritten whole, so records are saved in batches: every
+# SAVE_EVERY records or SAVE_SECONDS, and by save() at the end of a run
+SAVE_EVERY = 50
+SAVE_SECONDS = 5.0
+
+
+class CornersManifest:
+    """Corners collected in the annotation pass, keyed by file name and image size.
+
+    The corners are stored in undistorted image coordinates, exactly as they
+    come out of the corner selection window, so the render pass can run later
+    (and elsewhere) without the operator.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path, input_folder=None):
+        self.path = path
+        self.input_folder = input_folder
+        self.images = {}
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != cls.VERSION:
+            raise ValueError(f"Unsupported corners manifest version: {data.get('version')}")
+        manifest = cls(path, data.get('input_folder'))
+        manifest.images = data.get('images', {})
+        return manifest
+
+    @classmethod
+    def open(cls, path, input_folder=None):
+        # Continue an existing manifest so an interrupted annotation pass can resume
+        if os.path.exists(path):
+            manifest = cls.load(path)
+            if input_folder is not None:
+                manifest.input_folder = input_folder
+            return manifest
+        return cls(path, input_folder)
+
+    def save(self):
+        data = {'version': self.VERSION, 'input_folder': self.input_folder, 'images': self.images}
+        # Write next to the target and swap in, so a crash never leaves half a manifest
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def set_corners(self, filename, image_size, corners):
+        self.images[filename] = {
+            'width': int(image_size[0]),
+            'height': int(image_size[1]),
+            'status': 'ok',
+            'corners': np.asarray(corners, dtype=float).reshape(4, 2).tolist(),
+        }
+
+    def set_skipped(self, filename, image_size):
+        self.images[filename] = {'width': int(image_size[0]), 'height': int(image_size[1]), 'status': 'skip'}
+
+    def get(self, filename, image_size=None):
+        entry = self.images.get(filename)
+        if entry is None:
+            return None
+        if image_size is not None and (entry['width'], entry['height']) != tuple(image_size):
+            return None
+        return entry
+
+    def corners(self, filename, image_size=None):
+        entry = self.get(filename, image_size)
+        if entry is None or entry.get('status') != 'ok':
+            return None
+        return np.array(entry['corners'], dtype=np.float32)
+
+    def image_path(self, filename):
+        return os.path.join(self.input_folder or os.path.dirname(self.path), filename)
+
+    def ready(self):
+        # (filename, entry) pairs that have corners and can be rendered
+        return [(name, entry) for name, entry in sorted(self.images.items()) if entry.get('status') == 'ok']
+
+
+def file_sha1(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class RunManifest:
+    """What was rendered into an output folder, and from what.
+
+    One entry per input file: its size/mtime/SHA-1, the calibration
+    fingerprint, the corners (both as clicked and in raw sensor coordinates,
+    so they survive a new calibration) and the settings of the last render.
+    Re-running on the same folder only redoes images whose inputs, corners or
+    settings changed, and corners clicked before an interruption are reused.
+    Records are written in batches; call save() when the run ends or stops.
+    """
+
+    VERSION = 1
+
+    def __init__(self, output_folder):
+        self.output_folder = output_folder
+        self.path = os.path.join(output_folder, RUN_MANIFEST_NAME)
+        self.images = {}
+        self._lock = threading.Lock()
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == self.VERSION:
+                self.images = data.get('images', {})
+
+    def save(self):
+        # Write what was recorded since the last save
+        with self._lock:
+            if self._unsaved:
+                self._save()
+
+    def signature(self, image_path):
+        # Size and mtime are cheap; the hash is only recomputed when they changed
+        stat = os.stat(image_path)
+        signature = {'size': stat.st_size, 'mtime': stat.st_mtime}
+        entry = self.images.get(os.path.basename(image_path))
+        known = entry.get('input') if entry else None
+        if known and known['size'] == stat.st_size and known['mtime'] == stat.st_mtime:
+            signature['sha1'] = known['sha1']
+        else:
+            signature['sha1'] = file_sha1(image_path)
+        return signature
+
+    def lookup(self, filename, signature):
+        # Entry for this file, but only if the file content is unchanged
+        entry = self.images.get(filename)
+        if entry is None or entry['input']['sha1'] != signature['sha1']:
+            return None
+        return entry
+
+    def corners_for(self, filename, signature, calibrator):
+        """Previously selected corners in the current undistorted view, or None."""
+        entry = self.lookup(filename, signature)
+        if entry is None or entry.get('corners') is None:
+            return None
+        if entry['calibration'] == calibrator.fingerprint():
+            return np.array(entry['corners'], dtype=np.float32)
+        # New calibration: take the sensor position through the new lens model
+        return calibrator.undistort_points(entry['raw_corners'], entry['image_size']).astype(np.float32)
+
+    def is_current(self, filename, signature, calibrator, red_level, output_size=2000, derivatives=""):
+        # Rendered from this exact input, calibration, corners, red level, size and
+        # derivative set (Derivatives.key()), and still on disk
+        entry = self.lookup(filename, signature)
+        if entry is None or entry.get('render') is None:
+            return False
+        render = entry['render']
+        return (render['calibration'] == calibrator.fingerprint() and render['red_level'] == red_level
+                and render.get('output_size', 2000) == output_size
+                and render.get('derivatives', "") == derivatives
+                and entry['calibration'] == calibrator.fingerprint()
+                and os.path.exists(os.path.join(self.output_folder, render['output'])))
+
+    def record_corners(self, filename, signature, image_size, corners, calibrator):
+        corners = np.asarray(corners, dtype=np.float64).reshape(4, 2)
+        with self._lock:
+            entry = self.lookup(filename, signature)
+            fingerprint = calibrator.fingerprint()
+            unchanged = (entry is not None and entry.get('corners') is not None
+                         and entry['calibration'] == fingerprint
+                         and np.allclose(entry['corners'], corners, atol=1e-3))
+            if unchanged:
+                if entry['input'] != signature:  # touched but same content, remember the new mtime
+                    entry['input'] = signature
+                    self._changed()
+            else:
+                previous = self.images.get(filename) or {}
+                self.images[filename] = {
+                    'input': signature,
+                    'image_size': [int(image_size[0]), int(image_size[1])],
+                    'calibration': fingerprint,
+                    'corners': corners.tolist(),
+                    'raw_corners': calibrator.distort_points(corners, image_size).tolist(),
+                    'render': None,
+                    # Last file written for this image, kept across changes so it isn't mistaken for a stranger's
+                    'output': previous.get('output'),
+                }
+                self._changed()
+
+    def record_render(self, filename, red_level, calibrator, output_path, output_size=2000, derivatives=""):
+        with self._lock:
+            entry = self.images.get(filename)
+            if entry is None:
+                return
+            entry['render'] = {
+                'red_level': red_level,
+                'output_size': output_size,
+                'derivatives': derivatives,
+                'calibration': calibrator.fingerprint(),
+                'output': os.path.relpath(output_path, self.output_folder),
+                'rendered_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            }
+            entry['output'] = entry['render']['output']
+            self._changed()
+
+    def owns_output(self, output_path):
+        name = os.path.relpath(output_path, self.output_folder)
+        return any(entry.get('output') == name for entry in self.images.values())
+
+    def _changed(self):
+        # Each save is O(images), saving on every record made a run O(n^2)
+        self._unsaved += 1
+        if self._unsaved >= SAVE_EVERY or time.monotonic() - self._saved_at >= SAVE_SECONDS:
+            self._save()
+
+    def _save(self):
+        data = {'version': self.VERSION, 'images': self.images}
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, self.path)
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
@@ -0,0 +1,156 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from instrumentation import NULL_LOG
+from quality import read_reduced
+
+
+class ImagePrefetcher:
+    """Decode and undistort the next images on background threads.
+
+    At most `depth` images are loaded ahead of the one the operator is looking
+    at, so memory stays bounded (each 27 MP frame is ~80 MB raw plus the same
+    again undistorted). Images come out in folder order as
+    (image_path, image, undistorted, calibrator, problems), where calibrator
+    is the profile picked for that image and problems the quality screen's
+    findings (see quality.py); image is None when decoding failed, or when
+    the screen's action is "skip" and there were problems, in which case the
+    full frame was never decoded.
+    """
+
+    def __init__(self, image_files, calibrator, depth=2, workers=1, log=NULL_LOG, quality=None):
+        self.image_files = list(image_files)
+        self.calibrator = calibrator
+        self.quality = quality
+        self.log = log
+        self.depth = max(1, depth)
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="prefetch")
+        self._pending = deque()
+        self._next_index = 0
+
+    def __iter__(self):
+        self._fill()
+        while self._pending:
+            future = self._pending.popleft()
+            start = time.perf_counter()
+            result = future.result()
+            # Time the operator spent waiting because the prefetch fell behind
+            self.log.add(result[0], 'wait', time.perf_counter() - start)
+            # Start the next decode before handing this one to the operator
+            self._fill()
+            yield result
+            # Images added while the operator looked at this one
+            self._fill()
+
+    def add(self, image_path):
+        # One more image after the others, e.g. in place of one the operator skipped
+        self.image_files.append(image_path)
+
+    def close(self):
+        # Drop everything that hasn't started; running decodes finish and are discarded
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._pool.shutdown(wait=True)
+
+    def _fill(self):
+        while len(self._pending) < self.depth and self._next_index < len(self.image_files):
+            image_path = self.image_files[self._next_index]
+            self._next_index += 1
+            self._pending.append(self._pool.submit(self._load, image_path))
+
+    def _load(self, image_path):
+        calibrator = self.calibrator.for_file(image_path)
+        problems = []
+        if self.quality is not None and self.quality.enabled:
+            with self.log.stage(image_path, 'screen'):
+                reduced, _ = read_reduced(image_path)
+                if reduced is not None:
+                    metrics, problems = self.quality.check(reduced)
+                reduced = None
+            if problems and self.quality.action == 'skip':
+                return image_path, None, None, calibrator, problems
+        with self.log.stage(image_path, 'decode'):
+            image = cv2.imread(image_path)
+        if image is None:
+            return image_path, None, None, calibrator, problems
+        with self.log.stage(image_path, 'undistort'):
+            undistorted = calibrator.undistort_image(image)
+        return image_path, image, undistorted, calibrator, problems
+
+
+class AsyncWriter:
+    """Render (perspective + enhance) and encode images on a writer pool.
+
+    submit() blocks while `max_pending` renders are queued, which keeps the
+    number of raw frames held for writing bounded.
+    """
+
+    def __init__(self, processor, calibrator, red_level, workers=2, max_pending=2, quality=98, log=NULL_LOG):
+        self.processor = processor
+        self.calibrator = calibrator
+        self.log = log
+        self.red_level = red_level
+        self.quality = quality
+        self.successful = 0
+        self.failed = 0
+        self.pending = 0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="writer")
+
+    def submit(self, image, corners, output_path, image_path=None, on_success=None, calibrator=None):
+        # image may be None to have the writer decode image_path itself;
+        # on_success runs on the writer thread once the file is on disk.
+        # calibrator overrides the writer's one for this image
+        self._slots.acquire()
+        with self._lock:
+            self.pending += 1
+        try:
+            future = self._pool.submit(self._write, image, corners, output_path, image_path, on_success,
+                                       calibrator or self.calibrator)
+        except Exception:
+            self._done(None)
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    def close(self):
+        # Wait for everything already accepted, the operator confirmed those corners
+        self._pool.shutdown(wait=True)
+
+    def _done(self, future):
+        with self._lock:
+            self.pending -= 1
+        self._slots.release()
+
+    def _write(self, image, corners, output_path, image_path, on_success, calibrator):
+        key = image_path or output_path
+        try:
+            if image is None:
+                with self.log.stage(key, 'decode'):
+                    image = cv2.imread(image_path)
+                if image is None:
+                    raise IOError(f"failed to load {image_path}")
+            with self.log.stage(key, 'render'):
+                enhanced = self.processor.render_quadrant(image, corners, self.red_level, calibrator, output_size=2000)
+            with self.log.stage(key, 'encode'):
+                ok = self.processor.derivatives.write(enhanced, output_path, self.quality)
+            if not ok:
+                print(f"\n ❌ Failed to write {output_path}")
+            elif on_success is not None:
+                on_success()
+        except Exception as e:
+            print(f"\n ❌ Failed to write {output_path}: {e}")
+            ok = False
+        with self._lock:
+            if ok:
+                self.successful += 1
+            else:
+                self.failed += 1
+        self.log.finish(key, "ok" if ok else "failed")
+        return ok
@@ -2,8 +2,183 @@ import cv2
 import numpy as np
 import glob
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from geometry import GeometryEngine, CHANNEL_SHIFTS
+from color_lut import underwater_lut, underwater_transform
+from manifest import CornersManifest, RunManifest
+from pipeline import ImagePrefetcher, AsyncWriter
+from instrumentation import NULL_LOG, stage_timings
+from quality import QualityScreen, read_reduced
+from derivatives import Derivatives
+from duplicates import DUPLICATES_LIST_NAME, duplicate_groups
+
+IMAGE_PATTERNS = ['*.jpg', '*.jpeg', '*.JPG', '*.JPEG', '*.png', '*.PNG']
+
+# Memory ceiling for one render's working set (maps, strips, colour lookup), not
+# counting the raw frame and the finished output. 2000 px renders fit in one strip.
+# On top of this each process holds the 64 MB colour table of its red level
+# (color_lut.LUT_CACHE_SIZE levels at most)
+RENDER_MEMORY_LIMIT = 256 * 1024 * 1024
+
+def find_images(folder):
+    image_files = []
+    for ext in IMAGE_PATTERNS:
+        image_files.extend(glob.glob(os.path.join(folder, ext)))
+    # Sorted and de-duplicated (case-insensitive file systems match both *.jpg and *.JPG)
+    return sorted(set(image_files))
+
+def output_path_for(image_path, output_folder):
+    base_name = os.path.splitext(os.path.basename(image_path))[0]
+    return os.path.join(output_folder, f"{base_name}_Corrected.jpg")
+
+def detect_reduced(reduced, factor, calibrator, detector):
+    """Detect on a reduced decode (quality.read_reduced) instead of the full frame.
+
+    Returns (raw_corners, score) with the corners in full resolution raw
+    (distorted) pixels, ready for full_resolution_corners once the frame is
+    decoded for rendering; raw_corners is None when nothing was found.
+    """
+    small_calibrator = calibrator.reduced(factor)
+    h, w = reduced.shape[:2]
+    corners, score = detector.detect_with_score(small_calibrator.undistort_image(reduced))
+    if corners is None:
+        return None, score
+    raw = small_calibrator.distort_points(corners, (w, h))
+    return (raw + 0.5) * factor - 0.5, score
+
+def full_resolution_corners(image, raw_corners, factor, calibrator, detector):
+    # Refine on the raw full resolution frame (over a few pixels a corner is a corner,
+    # distorted or not), then into the undistorted view coordinates render_quadrant takes
+    h, w = image.shape[:2]
+    refined = detector.refine_corners(image, raw_corners, accuracy=factor)
+    return calibrator.undistort_points(refined, (w, h)).astype(np.float32)
+
+# Render workers: each process builds its own processor and calibrator once
+_worker_processor = None
+_worker_calibrator = None
+_worker_detector = None
+_worker_screen = None
+_worker_timing = (False, False)
+
+def _init_render_worker(calibration_spec, max_memory=RENDER_MEMORY_LIMIT, timing=(False, False),
+                        detector_settings=None, quality_thresholds=None, derivative_settings=None):
+    global _worker_processor, _worker_calibrator, _worker_detector, _worker_screen, _worker_timing
+    from calibration import CameraCalibrator
+    from detection import QuadrantDetector
+    cv2.setNumThreads(1)  # one image per core, don't oversubscribe
+    _worker_processor = ImageProcessor(max_memory=max_memory,
+                                       derivatives=Derivatives(**(derivative_settings or {})))
+    _worker_detector = QuadrantDetector(**(detector_settings or {}))
+    _worker_screen = QualityScreen(quality_thresholds)
+    # Store profiles share their memory-mapped undistortion maps across workers
+    _worker_calibrator = CameraCalibrator.from_spec(calibration_spec)
+    # (enabled, trace_memory) of the parent's run log, stage times go back with each result
+    _worker_timing = timing
+
+def _render_job(image_path, image_size, corners, red_level, output_path, output_size=2000):
+    timer, stages = stage_timings(*_worker_timing)
+    calibrator = _worker_calibrator.for_file(image_path)
+    with timer('decode'):
+        image = cv2.imread(image_path)
+    if image is None:
+        return False, "failed to load image", stages
+    if (image.shape[1], image.shape[0]) != tuple(image_size):
+        return False, f"image is {image.shape[1]}x{image.shape[0]}, manifest says {image_size[0]}x{image_size[1]}", stages
+    with timer('render'):
+        enhanced = _worker_processor.render_quadrant(image, corners, red_level, calibrator, output_size)
+    with timer('encode'):
+        ok = _worker_processor.derivatives.write(enhanced, output_path, 98)
+    if not ok:
+        return False, "failed to write output", stages
+    return True, output_path, stages
+
+def _screen_and_detect(image_path, min_confidence, timer):
+    # Preview decode, quality screen and detection on the reduced decode.
+    # Returns (status, message, score, raw_corners, factor, quality problems),
+    # status "ok" when the quadrant was found with enough confidence
+    calibrator = _worker_calibrator.for_file(image_path)
+    problems = []
+    with timer('preview'):
+        reduced, factor = read_reduced(image_path, _worker_detector.coarse_size)
+    if reduced is None:
+        return "failed", "failed to load image", 0.0, None, factor, problems
+    if _worker_screen.enabled:
+        with timer('screen'):
+            metrics, problems = _worker_screen.check(reduced)
+        if problems and _worker_screen.action == 'skip':
+            return "review", "poor quality: " + ", ".join(problems), 0.0, None, factor, problems
+    with timer('detect'):
+        raw_corners, score = detect_reduced(reduced, factor, calibrator, _worker_detector)
+    if raw_corners is None:
+        return "review", "no quadrant found", 0.0, None, factor, problems
+    if score < min_confidence:
+        return "review", f"low confidence ({score:.2f})", score, None, factor, problems
+    return "ok", "", score, raw_corners, factor, problems
+
+def _decode_and_render(image_path, red_level, output_path, output_size, timer, corners=None,
+                       raw_corners=None, factor=1):
+    # Full decode, corner refinement (when only raw_corners from _screen_and_detect
+    # are known), render and encode. Returns (status, message, corners, image_size)
+    calibrator = _worker_calibrator.for_file(image_path)
+    with timer('decode'):
+        image = cv2.imread(image_path)
+    if image is None:
+        return "failed", "failed to load image", None, None
+    if corners is None:
+        with timer('refine'):
+            corners = full_resolution_corners(image, raw_corners, factor, calibrator, _worker_detector)
+    with timer('render'):
+        enhanced = _worker_processor.render_quadrant(image, corners, red_level, calibrator, output_size)
+    with timer('encode'):
+        ok = _worker_processor.derivatives.write(enhanced, output_path, 98)
+    if not ok:
+        return "failed", "failed to write output", None, None
+    return "ok", output_path, corners, (image.shape[1], image.shape[0])
+
+def _auto_job(image_path, red_level, min_confidence, output_path, corners=None, output_size=2000):
+    # Unattended: auto-detect only (unless corners are already known),
+    # anything unsure goes to review instead of a window.
+    # Screening and detection run on a reduced decode; the full frame is only
+    # decoded for images that get rendered. Returns
+    # (status, message, score, corners, image_size, stages, quality problems)
+    timer, stages = stage_timings(*_worker_timing)
+    score = 1.0
+    problems = []
+    raw_corners, factor = None, 1
+    if corners is None:
+        status, message, score, raw_corners, factor, problems = _screen_and_detect(image_path, min_confidence, timer)
+        if status != "ok":
+            return status, message, score, None, None, stages, problems
+    status, message, corners, image_size = _decode_and_render(image_path, red_level, output_path, output_size,
+                                                              timer, corners, raw_corners, factor)
+    if status != "ok":
+        return status, message, score, None, None, stages, problems
+    return "ok", output_path, score, corners, image_size, stages, problems
+
+def _detect_job(image_path, min_confidence):
+    # First half of _auto_job, for pipelines that detect and render in separate steps:
+    # (status, message, score, raw_corners, factor, stages, quality problems)
+    timer, stages = stage_timings(*_worker_timing)
+    status, message, score, raw_corners, factor, problems = _screen_and_detect(image_path, min_confidence, timer)
+    return status, message, score, raw_corners, factor, stages, problems
+
+def _refine_render_job(image_path, raw_corners, factor, red_level, output_path, output_size=2000):
+    # Second half: (status, message, corners, image_size, stages)
+    timer, stages = stage_timings(*_worker_timing)
+    status, message, corners, image_size = _decode_and_render(image_path, red_level, output_path, output_size,
+                                                              timer, raw_corners=raw_corners, factor=factor)
+    return status, message, corners, image_size, stages
 
 class ImageProcessor:
+    def __init__(self, color_profile=None, max_memory=RENDER_MEMORY_LIMIT, derivatives=None):
+        self.geometry = GeometryEngine()
+        # Optional custom ColorLUT used instead of the red level tables
+        self.color_profile = color_profile
+        # Bigger renders are done in horizontal strips to stay under this many bytes
+        self.max_memory = max_memory
+        # Thumbnails, previews, zoom tiles and lossless copies written with each output
+        self.derivatives = derivatives or Derivatives()
+    
     def correct_perspective(self, image, corners, output_size=2000):
         dst_corners = np.array([[0, 0], [output_size-1, 0], 
                                [output_size-1, output_size-1], [0, output_size-1]], dtype=np.float32)
@@ -18,10 +193,9 @@ class ImageProcessor:
         # Use green channel as reference since blue and red change underwater
         h, w = g.shape
         
-        # Calculate shifts for red and blue channels
-        # These values work well for most GoPro images (found on the internet)
-        red_shift_x, red_shift_y = 1.5, 1.0      # Red channel shift
-        blue_shift_x, blue_shift_y = -1.0, -0.5  # Blue channel shift
+        # Calculate shifts for red and blue channels (shared with the fused geometry engine)
+        blue_shift_x, blue_shift_y = CHANNEL_SHIFTS[0]  # Blue channel shift
+        red_shift_x, red_shift_y = CHANNEL_SHIFTS[2]    # Red channel shift
         
         # Create transformation matrices
         M_red = np.array([[1, 0, red_shift_x], [0, 1, red_shift_y]], dtype=np.float32)
@@ -36,67 +210,310 @@ class ImageProcessor:
         
         return corrected
     
-    def enhance_colors(self, image, red_level=5):
-        # First correct chromatic aberration
-        image = self.correct_chromatic_aberration(image)
+    def enhance_colors(self, image, red_level=5, correct_aberration=True):
+        # First correct chromatic aberration (already done when rendered through the geometry engine)
+        if correct_aberration:
+            image = self.correct_chromatic_aberration(image)
         
-        red_boost = 1.0 + (red_level - 1) * 0.125
-        saturation_boost = 1.0 + (red_level - 1) * 0.05
+        # Red boost + saturation is precomputed per red level into a 3D LUT,
+        # so this is a single table lookup per pixel
+        lut = self.color_profile or underwater_lut(red_level)
+        return lut.apply(image)
+    
+    def enhance_colors_float(self, image, red_level=5, correct_aberration=True):
+        """Reference float path that the colour LUTs are checked against"""
+        if correct_aberration:
+            image = self.correct_chromatic_aberration(image)
         
         img_float = image.astype(np.float32) / 255.0
-        img_float[:, :, 2] = np.clip(img_float[:, :, 2] * red_boost, 0, 1)
-        
-        hsv = cv2.cvtColor(img_float, cv2.COLOR_BGR2HSV)
-        hsv[:, :, 1] = np.clip(hsv[:, :, 1] * saturation_boost, 0, 1)
-        
-        enhanced = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+        enhanced = underwater_transform(red_level)(img_float)
         return (enhanced * 255).astype(np.uint8)
     
-    def batch_process_manual(self, input_folder, output_folder, red_level, calibrator, detector, ui):
+    def render_quadrant(self, image, corners, red_level, calibrator=None, output_size=2000):
+        """Raw image + corners (in undistorted coordinates) -> final enhanced quadrant.
+
+        Undistortion, perspective and chromatic aberration happen in one remap
+        pass, so no full-resolution intermediates are made. Large outputs
+        (6000-8000 px) are warped and colour corrected in horizontal strips that
+        each read only the source rows they need; every pixel is computed the
+        same way, so the result is identical to a single pass.
+        """
+        rows = self.geometry.strip_rows(output_size, self.max_memory)
+        if rows >= output_size:
+            corrected = self.geometry.render(image, corners, calibrator, output_size)
+            return self.enhance_colors(corrected, red_level, correct_aberration=False)
+        
+        lut = self.color_profile or underwater_lut(red_level)
+        output = np.empty((output_size, output_size, 3), dtype=np.uint8)
+        for y0 in range(0, output_size, rows):
+            y1 = min(y0 + rows, output_size)
+            strip = self.geometry.render_rows(image, corners, calibrator, output_size, y0, y1)
+            output[y0:y1] = lut.apply(strip)
+        return output
+
+    def derivative_settings(self, jobs):
+        # Share the cores between the processes, each encodes its derivatives on its slice
+        settings = self.derivatives.settings()
+        settings['workers'] = max(1, min(settings['workers'], (os.cpu_count() or 1) // jobs))
+        return settings
+
+    def batch_process_manual(self, input_folder, output_folder, red_level, calibrator, detector, ui,
+                             prefetch=2, writers=2, log=NULL_LOG, quality=None, duplicates='all'):
+        """Interactive batch: select corners image by image.
+
+        The next `prefetch` images are decoded and undistorted in the background
+        while the operator clicks, and rendering/encoding runs on `writers`
+        threads, so the next window opens without waiting on the previous save.
+        Stage times (including the operator's) go to `log`, see instrumentation.py.
+        quality (a QualityScreen) warns about poor frames before the window
+        opens, or with action "skip" leaves them out without a full decode.
+        duplicates "best" only shows the sharpest of each group of repeated
+        shots (duplicates.py), "copy" also renders the others with its corners.
+        """
         # Find images
-        image_files = []
-        for ext in ['*.jpg', '*.jpeg', '*.JPG', '*.JPEG', '*.png', '*.PNG']:
-            image_files.extend(glob.glob(os.path.join(input_folder, ext)))
+        image_files = find_images(input_folder)
+        os.makedirs(output_folder, exist_ok=True)
+        siblings = {}
+        repeats = set()
+        if duplicates != 'all':
+            siblings = duplicate_groups(image_files, output_folder)
+            repeats = {path for others in siblings.values() for path in others}
         
         print(f"\n🚀 Starting batch processing...")
         print(f"📐 Output resolution: 2000x2000 pixels (4MP)")
         print(f"🌈 Chromatic aberration correction: ENABLED")
         
-        successful = 0
+        # Work out what an earlier run already did
+        print(f"🔎 Checking {len(image_files)} images against the run manifest...")
+        run = RunManifest(output_folder)
+        signatures = {}
+        profiles = {}
+        to_annotate = []
+        to_render = []
+        held_back = set()  # repeated shots waiting on the sharpest shot of their quadrat
+        up_to_date = 0
+        for image_path in image_files:
+            name = os.path.basename(image_path)
+            signatures[image_path] = signature = run.signature(image_path)
+            # Calibration profile for this image's camera and size
+            profiles[image_path] = image_calibrator = calibrator.for_file(image_path)
+            if run.is_current(name, signature, image_calibrator, red_level,
+                            derivatives=self.derivatives.key()):
+                up_to_date += 1
+                continue
+            corners = run.corners_for(name, signature, image_calibrator)
+            # Repeated shot: left out (best), or gets the sharpest shot's corners (copy),
+            # unless that one is skipped or fails and it is next in line
+            if image_path in repeats and (duplicates == 'best' or corners is None):
+                held_back.add(image_path)
+                continue
+            if corners is None:
+                to_annotate.append(image_path)
+            else:
+                to_render.append((image_path, corners))
+        if held_back:
+            print(f" Repeated shots held back: {len(held_back)}")
+        print(f" Up to date: {up_to_date}, re-render with saved corners: {len(to_render)}, "
+              f"need corners: {len(to_annotate)}")
+        
         skipped = 0
         failed = 0
         
+        prefetcher = ImagePrefetcher(to_annotate, calibrator, depth=prefetch, log=log, quality=quality)
+        writer = AsyncWriter(self, calibrator, red_level, workers=writers, max_pending=writers, log=log)
+        
+        def submit(image, image_path, corners):
+            # Render and save in the background, straight from the raw frame
+            # Save with high quality, i chose 98%, because of species identification
+            name = os.path.basename(image_path)
+            image_calibrator = profiles[image_path]
+            output_path = output_path_for(image_path, output_folder)
+            if os.path.exists(output_path) and not run.owns_output(output_path):
+                print(f"⚠ Replacing {os.path.basename(output_path)}, it was not made by this output folder's runs")
+            writer.submit(image, corners, output_path, image_path,
+                          on_success=lambda: run.record_render(name, red_level, image_calibrator, output_path,
+                                                             derivatives=self.derivatives.key()),
+                          calibrator=image_calibrator)
+            return output_path
+        
+        def copy_corners(image_path, image_size, corners):
+            # Same quadrat, same framing give or take a few pixels: its repeated shots get these corners
+            if duplicates != 'copy':
+                return
+            copied = [path for path in siblings.get(image_path, []) if path in held_back]
+            for sibling in copied:
+                held_back.discard(sibling)
+                run.record_corners(os.path.basename(sibling), signatures[sibling], image_size, corners,
+                                   profiles[sibling])
+                submit(None, sibling, corners)
+            if copied:
+                print(f" Same corners for {len(copied)} repeated shot(s)")
+        
+        def promote(image_path):
+            # The sharpest shot was skipped or failed: show the next sharpest of its quadrat instead
+            waiting = [path for path in siblings.get(image_path, []) if path in held_back]
+            if not waiting:
+                return
+            held_back.discard(waiting[0])
+            siblings[waiting[0]] = waiting[1:]
+            prefetcher.add(waiting[0])
+            print(f" Next sharpest shot of this quadrat queued: {os.path.basename(waiting[0])}")
+        
+        try:
+            # Settings or calibration changed: no clicking needed, straight to the writers
+            for image_path, corners in to_render:
+                name = os.path.basename(image_path)
+                entry = run.images[name]
+                run.record_corners(name, signatures[image_path], entry['image_size'], corners, profiles[image_path])
+                submit(None, image_path, corners)
+                copy_corners(image_path, entry['image_size'], corners)
+            # Repeated shots of images that are already done
+            for representative, others in siblings.items():
+                if duplicates != 'copy' or not held_back.intersection(others):
+                    continue
+                name = os.path.basename(representative)
+                corners = run.corners_for(name, signatures[representative], profiles[representative])
+                if corners is not None:
+                    copy_corners(representative, run.images[name]['image_size'], corners)
+            
+            for i, (image_path, image, undistorted, _, problems) in enumerate(prefetcher, 1):
+                print(f"\n{'='*60}")
+                print(f"IMAGE {i} of {len(prefetcher.image_files)}: {os.path.basename(image_path)}")
+                print(f"{'='*60}")
+                
+                if problems and image is None and quality.action == 'skip':
+                    print(f"⏭ Skipped, poor quality: {', '.join(problems)}")
+                    skipped += 1
+                    log.finish(image_path, "skipped", quality=problems)
+                    promote(image_path)
+                    continue
+                if problems:
+                    print(f"⚠ {', '.join(problems)} (N to skip)")
+                
+                # Load image
+                if image is None:
+                    print(" Failed to load image")
+                    failed += 1
+                    log.finish(image_path, "failed")
+                    promote(image_path)
+                    continue
+                
+                print(f"✅ Image loaded: {image.shape[1]}x{image.shape[0]} pixels")
+                print("✅ Lens distortion corrected")
+                
+                # Manual corner selection
+                print("🖱 Please select corners in the image window...")
+                with log.stage(image_path, 'select'):
+                    corners = ui.manual_corner_selection(undistorted)
+                undistorted = None  # only needed for display
+                
+                # Check if corners is a string (cancel/skip)
+                if isinstance(corners, str):
+                    if corners == "cancel":
+                        print("\n Batch processing cancelled by user")
+                        log.finish(image_path, "cancelled")
+                        break
+                    elif corners == "skip":
+                        print("⏭ Image skipped")
+                        skipped += 1
+                        log.finish(image_path, "skipped")
+                        promote(image_path)
+                        continue
+                    else:
+                        print(" Corner selection failed")
+                        failed += 1
+                        log.finish(image_path, "failed")
+                        promote(image_path)
+                        continue
+                elif corners is None:
+                    print(" Corner selection failed")
+                    failed += 1
+                    log.finish(image_path, "failed")
+                    promote(image_path)
+                    continue
+                
+                print(" Corners selected")
+                # Remember the corners right away so a crash before the write doesn't lose them
+                run.record_corners(os.path.basename(image_path), signatures[image_path],
+                                   (image.shape[1], image.shape[0]), corners, profiles[image_path])
+                
+                output_path = submit(image, image_path, corners)
+                print(f" Queued: {os.path.basename(output_path)} (2000x2000, 98% quality)")
+                copy_corners(image_path, (image.shape[1], image.shape[0]), corners)
+        finally:
+            prefetcher.close()
+            if writer.pending:
+                print("\n⏳ Finishing queued images...")
+            writer.close()
+            run.save()
+        
+        successful = writer.successful
+        failed += writer.failed
+        
+        # Final summary for the user
+        print(f"\n" + "="*60)
+        print("BATCH PROCESSING COMPLETE")
+        print("="*60)
+        print(f" Successfully processed: {successful}")
+        print(f" Already up to date: {up_to_date}")
+        print(f" Skipped: {skipped}")
+        print(f" Failed: {failed}")
+        if siblings:
+            print(f" Repeated shots (see {DUPLICATES_LIST_NAME}): {len(repeats)}")
+        if duplicates == 'best' and held_back:
+            print(f" Left out, a sharper shot of the same quadrat was used: {len(held_back)}")
+        elif held_back:
+            # Their quadrat's shot was cancelled or failed to save, so no corners to copy
+            print(f" Repeated shots not processed: {len(held_back)}")
+            for image_path in sorted(held_back):
+                print(f"   {os.path.basename(image_path)}")
+        print(f" Results saved in: {output_folder}")
+        print(f" Output: 2000x2000 pixels (4MP) per image")
+        print(f" Chromatic aberration corrected")
+        log.print_summary()
+    
+    def batch_annotate(self, input_folder, manifest_path, calibrator, ui):
+        """Phase 1: click corners for the whole folder and save them to a corners manifest.
+
+        Nothing is rendered here, so the next image comes up as soon as the
+        previous one is done. Images already in the manifest are not shown again.
+        """
+        image_files = find_images(input_folder)
+        manifest = CornersManifest.open(manifest_path, os.path.abspath(input_folder))
+        
+        print(f"\n🖱 Starting corner annotation ({len(image_files)} images)...")
+        print(f"📝 Corners manifest: {manifest_path}")
+        
+        annotated = 0
+        skipped = 0
+        failed = 0
+        cancelled = False
+        
         for i, image_path in enumerate(image_files, 1):
-            print(f"\n{'='*60}")
-            print(f"IMAGE {i} of {len(image_files)}: {os.path.basename(image_path)}")
-            print(f"{'='*60}")
+            filename = os.path.basename(image_path)
+            if filename in manifest.images:
+                continue
             
-            # Load image
+            print(f"\nIMAGE {i} of {len(image_files)}: {filename}")
             image = cv2.imread(image_path)
             if image is None:
                 print(" Failed to load image")
                 failed += 1
                 continue
             
-            print(f"✅ Image loaded: {image.shape[1]}x{image.shape[0]} pixels")
-            
-            # Undistort
-            undistorted = calibrator.undistort_image(image)
-            print("✅ Lens distortion corrected")
-            
-            # Manual corner selection
-            print("🖱 Please select corners in the image window...")
+            image_size = (image.shape[1], image.shape[0])
+            undistorted = calibrator.for_file(image_path).undistort_image(image)
             corners = ui.manual_corner_selection(undistorted)
             
-            # Check if corners is a string (cancel/skip)
             if isinstance(corners, str):
                 if corners == "cancel":
-                    print("\n Batch processing cancelled by user")
+                    print("\n Annotation cancelled by user, progress is saved")
+                    cancelled = True
                     break
                 elif corners == "skip":
                     print("⏭ Image skipped")
+                    manifest.set_skipped(filename, image_size)
                     skipped += 1
-                    continue
                 else:
                     print(" Corner selection failed")
                     failed += 1
@@ -105,35 +522,189 @@ class ImageProcessor:
                 print(" Corner selection failed")
                 failed += 1
                 continue
+            else:
+                manifest.set_corners(filename, image_size, corners)
+                annotated += 1
+                print(" Corners saved")
             
-            print(" Corners selected")
-            
-            # Process image
-            print("🔧 Correcting perspective...")
-            corrected = self.correct_perspective(undistorted, corners, output_size=2000)
-            print(f" Perspective corrected to 2000x2000 pixels")
-            
-            print(" Enhancing colors and correcting chromatic aberration...")
-            enhanced = self.enhance_colors(corrected, red_level)
-            print(" Color enhancement complete")
-            
-            # Save with higher quality
-            base_name = os.path.splitext(os.path.basename(image_path))[0]
-            output_path = os.path.join(output_folder, f"{base_name}_Corrected.jpg")
-            
-            # Save with high quality, i chose 98%, because of species identification
-            cv2.imwrite(output_path, enhanced, [cv2.IMWRITE_JPEG_QUALITY, 98])
+            # Save after every image so an interrupted session loses nothing
+            manifest.save()
+        
+        manifest.save()
+        print(f"\n" + "="*60)
+        print("ANNOTATION COMPLETE" if not cancelled else "ANNOTATION STOPPED")
+        print("="*60)
+        print(f" Annotated: {annotated}")
+        print(f" Skipped: {skipped}")
+        print(f" Failed: {failed}")
+        print(f" Ready to render: {len(manifest.ready())}")
+        print(f" Manifest saved in: {manifest_path}")
+        return not cancelled
+    
+    def batch_render_manifest(self, manifest_path, output_folder, red_level, calibrator, jobs=None,
+                              output_size=2000, log=NULL_LOG):
+        """Phase 2: render every annotated image of a corners manifest on a process pool."""
+        manifest = CornersManifest.load(manifest_path)
+        entries = manifest.ready()
+        jobs = jobs or os.cpu_count() or 1
+        os.makedirs(output_folder, exist_ok=True)
+        
+        # Only render what changed since the last run into this folder
+        run = RunManifest(output_folder)
+        jobs_to_run = []
+        up_to_date = 0
+        for filename, entry in entries:
+            image_path = manifest.image_path(filename)
+            if not os.path.exists(image_path):
+                jobs_to_run.append((filename, image_path, entry))
+                continue
+            signature = run.signature(image_path)
+            image_calibrator = calibrator.for_file(image_path)
+            run.record_corners(filename, signature, (entry['width'], entry['height']), entry['corners'],
+                               image_calibrator)
+            if run.is_current(filename, signature, image_calibrator, red_level, output_size,
+                           self.derivatives.key()):
+                up_to_date += 1
+            else:
+                jobs_to_run.append((filename, image_path, entry))
+        
+        print(f"\n🚀 Rendering {len(jobs_to_run)} images on {jobs} processes ({up_to_date} already up to date)...")
+        print(f"📐 Output resolution: {output_size}x{output_size} pixels")
+        
+        successful = 0
+        failed = 0
+        
+        try:
+            with ProcessPoolExecutor(max_workers=jobs, initializer=_init_render_worker,
+                                     initargs=(calibrator.spec(), self.max_memory, (log.enabled, log.trace_memory),
+                                               None, None, self.derivative_settings(jobs))) as pool:
+                futures = {}
+                for filename, image_path, entry in jobs_to_run:
+                    future = pool.submit(_render_job, image_path, (entry['width'], entry['height']),
+                                         np.array(entry['corners'], dtype=np.float32), red_level,
+                                         output_path_for(image_path, output_folder), output_size)
+                    futures[future] = filename
             
-            successful += 1
-            print(f" Saved: {base_name}_Corrected.jpg (2000x2000, 95% quality)")
+                for done, future in enumerate(as_completed(futures), 1):
+                    filename = futures[future]
+                    try:
+                        ok, message, stages = future.result()
+                    except Exception as e:
+                        ok, message, stages = False, str(e), None
+                    image_path = manifest.image_path(filename)
+                    log.add_stages(image_path, stages or {})
+                    log.finish(image_path, "ok" if ok else "failed")
+                    if ok:
+                        successful += 1
+                        run.record_render(filename, red_level, calibrator.for_file(image_path), message, output_size,
+                                          self.derivatives.key())
+                        print(f" [{done}/{len(jobs_to_run)}] Saved: {os.path.basename(message)}")
+                    else:
+                        failed += 1
+                        print(f" [{done}/{len(jobs_to_run)}] {filename}: {message}")
+        finally:
+            run.save()
         
-        # Final summary for the user
         print(f"\n" + "="*60)
-        print("BATCH PROCESSING COMPLETE")
+        print("RENDERING COMPLETE")
         print("="*60)
         print(f" Successfully processed: {successful}")
-        print(f" Skipped: {skipped}")
+        print(f" Already up to date: {up_to_date}")
         print(f" Failed: {failed}")
         print(f" Results saved in: {output_folder}")
-        print(f" Output: 2000x2000 pixels (4MP) per image")
-        print(f" Chromatic aberration corrected")
\ No newline at end of file
+        log.print_summary()
+        return failed == 0
+    
+    def batch_process_auto(self, input_folder, output_folder, red_level, calibrator,
+                           min_confidence=0.8, jobs=None, output_size=2000, log=NULL_LOG, detector=None,
+                           quality=None, duplicates='all'):
+        """Unattended batch with auto-detection only, on a process pool.
+
+        Returns (successful, review, failed) where review and failed are lists
+        of (image_path, reason, score). Nothing here ever opens a window.
+        quality is a QualityScreen; with action "skip" poor frames go to review.
+        duplicates "best" only processes the sharpest of each group of
+        repeated shots (duplicates.py).
+        """
+        image_files = find_images(input_folder)
+        jobs = jobs or os.cpu_count() or 1
+        os.makedirs(output_folder, exist_ok=True)
+        if duplicates == 'best':
+            image_files = sorted(duplicate_groups(image_files, output_folder, jobs))
+        
+        # Skip what an earlier run already rendered, reuse corners it found or was given
+        run = RunManifest(output_folder)
+        signatures = {}
+        todo = []
+        up_to_date = 0
+        for image_path in image_files:
+            name = os.path.basename(image_path)
+            signatures[image_path] = signature = run.signature(image_path)
+            image_calibrator = calibrator.for_file(image_path)
+            if run.is_current(name, signature, image_calibrator, red_level, output_size, self.derivatives.key()):
+                up_to_date += 1
+            else:
+                todo.append((image_path, run.corners_for(name, signature, image_calibrator)))
+        
+        print(f"\n🚀 Auto-processing {len(todo)} images on {jobs} processes ({up_to_date} already up to date)...")
+        print(f"🎯 Minimum detection confidence: {min_confidence:.2f}")
+        quality = quality or QualityScreen()
+        if quality.enabled:
+            print(f"🔍 Quality pre-screen: {'skip' if quality.action == 'skip' else 'flag'} poor frames")
+        
+        successful = []
+        review = []
+        failed = []
+        
+        # Workers detect with the same engines and frame colour as the caller's detector
+        detector_settings = detector.settings() if detector is not None else None
+        try:
+            with ProcessPoolExecutor(max_workers=jobs, initializer=_init_render_worker,
+                                     initargs=(calibrator.spec(), self.max_memory, (log.enabled, log.trace_memory),
+                                               detector_settings, quality.thresholds,
+                                               self.derivative_settings(jobs))) as pool:
+                futures = {pool.submit(_auto_job, image_path, red_level, min_confidence,
+                                       output_path_for(image_path, output_folder), corners, output_size): image_path
+                           for image_path, corners in todo}
+            
+                for done, future in enumerate(as_completed(futures), 1):
+                    image_path = futures[future]
+                    try:
+                        status, message, score, corners, image_size, stages, problems = future.result()
+                    except Exception as e:
+                        status, message, score, corners, image_size, stages, problems = \
+                            "failed", str(e), 0.0, None, None, None, []
+                    name = os.path.basename(image_path)
+                    log.add_stages(image_path, stages or {})
+                    if problems:
+                        log.finish(image_path, status, score=round(score, 3), quality=problems)
+                    else:
+                        log.finish(image_path, status, score=round(score, 3))
+                    if status == "ok":
+                        successful.append(image_path)
+                        image_calibrator = calibrator.for_file(image_path)
+                        run.record_corners(name, signatures[image_path], image_size, corners, image_calibrator)
+                        run.record_render(name, red_level, image_calibrator, message, output_size,
+                                          self.derivatives.key())
+                        print(f" [{done}/{len(todo)}] Saved: {os.path.basename(message)} (confidence {score:.2f})")
+                        if problems:
+                            print(f"   ⚠ {', '.join(problems)}")
+                    elif status == "review":
+                        review.append((image_path, message, score))
+                        print(f" [{done}/{len(todo)}] {name}: needs review, {message}")
+                    else:
+                        failed.append((image_path, message, score))
+                        print(f" [{done}/{len(todo)}] {name}: {message}")
+        finally:
+            run.save()
+        
+        print(f"\n" + "="*60)
+        print("AUTO PROCESSING COMPLETE")
+        print("="*60)
+        print(f" Successfully processed: {len(successful)}")
+        print(f" Already up to date: {up_to_date}")
+        print(f" Needs review: {len(review)}")
+        print(f" Failed: {len(failed)}")
+        print(f" Results saved in: {output_folder}")
+        log.print_summary()
+        return successful, review, failed
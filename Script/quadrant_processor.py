@@ -3,24 +3,39 @@ import numpy as np # type: ignore
 import os
 from calibration import CameraCalibrator
 from detection import QuadrantDetector
-from processing import ImageProcessor
+from processing import ImageProcessor, find_images, detect_reduced, full_resolution_corners
+from manifest import MANIFEST_NAME
+from instrumentation import NULL_LOG, RunLog, RUN_LOG_NAME
+from quality import QualityScreen, read_reduced
 from ui import UserInterface
+from video import find_videos, process_video
+from watch import WatchDaemon, SETTLE_SECONDS
 
 class GoProQuadrantProcessor:
-    def __init__(self, quadrant_size_cm=50):
+    def __init__(self, quadrant_size_cm=50, calibration_file='gopro_calibration.pkl',
+                 calibration_store='calibrations', profile=None, run_log=None, frame_colour='white',
+                 quality=None):
         self.quadrant_size_cm = quadrant_size_cm
-        self.calibrator = CameraCalibrator()
-        self.detector = QuadrantDetector()
+        # Stage timing log (instrumentation.RunLog); the interactive modes make their own when None
+        self.run_log = run_log
+        self.calibrator = CameraCalibrator(calibration_file, calibration_store, profile)
+        self.detector = QuadrantDetector(frame_colour=frame_colour)
+        # Image quality pre-screen (quality.QualityScreen); None picks up the survey folder's quality.json
+        self.quality = quality
         self.processor = ImageProcessor()
         self.ui = UserInterface()
         
+    def quality_for(self, survey_folder):
+        return self.quality or QualityScreen.for_survey(survey_folder)
+    
     def load_calibration(self):
         return self.calibrator.load_calibration()
     
-    def calibrate_camera(self, path):
-        return self.calibrator.calibrate_camera(path)
+    def calibrate_camera(self, path, chessboard_size=None, square_size=None, **kwargs):
+        return self.calibrator.calibrate_camera(path, chessboard_size, square_size, **kwargs)
     
     def single_image_mode(self):
+        log = self.run_log or RunLog()
         while True:
             image_path = input("\nEnter image path (or 'q' to quit): ").strip().strip('"')
             if image_path.lower() == 'q':
@@ -31,12 +46,13 @@ class GoProQuadrantProcessor:
                 continue
             
             red_level = self.ui.get_red_level()
-            result = self.process_single_image(image_path, red_level)
+            result = self.process_single_image(image_path, red_level, log)
             
             if result:
                 another = input("\nProcess another? (y/n): ").lower()
                 if another != 'y':
                     break
+        log.print_summary()
     
     def batch_mode(self):
         print("\n" + "="*50)
@@ -48,10 +64,7 @@ class GoProQuadrantProcessor:
             input_folder = input("\nEnter path to folder containing images: ").strip().strip('"')
             if os.path.exists(input_folder):
                 # Count images in folder
-                image_files = []
-                for ext in ['*.jpg', '*.jpeg', '*.JPG', '*.JPEG', '*.png', '*.PNG']:
-                    import glob
-                    image_files.extend(glob.glob(os.path.join(input_folder, ext)))
+                image_files = find_images(input_folder)
                 
                 if image_files:
                     print(f"✅ Found {len(image_files)} images in input folder")
@@ -81,6 +94,21 @@ class GoProQuadrantProcessor:
         print("\nColor Enhancement Settings:")
         red_level = self.ui.get_red_level()
         
+        # Interactive or two-phase
+        print("\nProcessing mode:")
+        print("1. Interactive (select corners and render each image in turn)")
+        print("2. Two-phase (select corners for all images first, then render on all cores)")
+        two_phase = input("Choose mode (1 or 2, default 1): ").strip() == "2"
+        
+        # Divers often take a few shots of each quadrat, by default only the sharpest is shown
+        duplicates = 'all'
+        if not two_phase:
+            print("\nRepeated shots of the same quadrat:")
+            print("1. Process every shot")
+            print("2. Only the sharpest shot of each quadrat")
+            print("3. The sharpest shot, then its corners for the other shots too")
+            duplicates = {'1': 'all', '3': 'copy'}.get(input("Choose (1-3, default 2): ").strip(), 'best')
+        
         # Confirm
         print(f"\n" + "="*50)
         print("BATCH PROCESSING SUMMARY")
@@ -88,6 +116,9 @@ class GoProQuadrantProcessor:
         print(f" Input folder:  {input_folder}")
         print(f" Output folder: {output_folder}")
         print(f" Red level:     {red_level}/5")
+        print(f" Mode:          {'Two-phase' if two_phase else 'Interactive'}")
+        if duplicates != 'all':
+            print(f" Repeated shots: {'sharpest only' if duplicates == 'best' else 'copy corners'}")
         print(f"📸 Images found:  {len(image_files)}")
         print("\n During processing:")
         print("   • SPACE = Process current image")
@@ -99,38 +130,189 @@ class GoProQuadrantProcessor:
             print("Batch processing cancelled.")
             return
         
-        # Start 
-        self.processor.batch_process_manual(input_folder, output_folder, red_level, 
-                                          self.calibrator, self.detector, self.ui)
+        # Start, with stage times logged next to the results
+        log = self.run_log or RunLog(os.path.join(output_folder, RUN_LOG_NAME))
+        try:
+            if not two_phase:
+                self.processor.batch_process_manual(input_folder, output_folder, red_level, 
+                                                  self.calibrator, self.detector, self.ui, log=log,
+                                                  quality=self.quality_for(input_folder), duplicates=duplicates)
+                return
+            
+            manifest_path = os.path.join(output_folder, MANIFEST_NAME)
+            self.processor.batch_annotate(input_folder, manifest_path, self.calibrator, self.ui)
+            render = input("\nRender the annotated images now? (y/n): ").lower()
+            if render == 'y':
+                self.processor.batch_render_manifest(manifest_path, output_folder, red_level, self.calibrator, log=log)
+            else:
+                print(f"Corners saved. Render later with option 3 using: {manifest_path}")
+        finally:
+            if log is not self.run_log:
+                log.close()
+    
+    def render_manifest_mode(self):
+        # Headless second phase, e.g. on a bigger machine with the same calibration
+        manifest_path = input("\nEnter path to corners manifest: ").strip().strip('"')
+        if not os.path.exists(manifest_path):
+            print("❌ Manifest not found")
+            return
+        output_folder = input("Enter path for output folder: ").strip().strip('"') or os.path.dirname(manifest_path)
+        red_level = self.ui.get_red_level()
+        jobs = self.ui.get_count(f"Worker processes (default {os.cpu_count()}): ")
+        log = self.run_log or RunLog(os.path.join(output_folder, RUN_LOG_NAME))
+        try:
+            self.processor.batch_render_manifest(manifest_path, output_folder, red_level, self.calibrator,
+                                                 jobs=jobs, log=log)
+        finally:
+            if log is not self.run_log:
+                log.close()
+    
+    def video_mode(self):
+        # Transect videos: the best frame of each quadrat, found and tracked automatically
+        input_path = input("\nEnter path to video or folder of videos: ").strip().strip('"')
+        output_folder = input("Enter path for output folder: ").strip().strip('"')
+        red_level = self.ui.get_red_level()
+        per_quadrat = self.ui.get_count("Frames to keep per quadrat (default 1): ", default=1)
+        log = self.run_log or RunLog(os.path.join(output_folder, RUN_LOG_NAME))
+        try:
+            self.process_videos(input_path, output_folder, red_level,
+                                per_quadrat=per_quadrat, log=log)
+            log.print_summary()
+        finally:
+            if log is not self.run_log:
+                log.close()
+    
+    def process_videos(self, input_path, output_folder, red_level, output_size=2000, per_quadrat=1, stride=3,
+                       min_confidence=0.8, log=NULL_LOG):
+        videos = find_videos(input_path) if os.path.isdir(input_path) else [input_path]
+        videos = [video for video in videos if os.path.exists(video)]
+        if not videos:
+            print(f"❌ No videos found in {input_path}")
+            return []
+        outputs = []
+        for video_path in videos:
+            try:
+                outputs.extend(process_video(video_path, output_folder, self.processor, self.calibrator,
+                                             self.detector, red_level, output_size=output_size,
+                                             per_quadrat=per_quadrat, stride=stride,
+                                             min_confidence=min_confidence, log=log))
+            except Exception as e:
+                print(f"❌ {os.path.basename(video_path)}: {e}")
+        print(f"\n✓ {len(outputs)} quadrat image(s) from {len(videos)} video(s) in {output_folder}")
+        return outputs
     
-    def process_single_image(self, image_path, red_level):
+    def watch_mode(self):
+        # Field laptop: leave it running while SD cards are offloaded into the ingest folder(s)
+        folders = input("\nEnter ingest folder(s), separated by ';': ").strip()
+        folders = [folder.strip().strip('"') for folder in folders.split(';') if folder.strip()]
+        missing = [folder for folder in folders if not os.path.isdir(folder)]
+        if not folders or missing:
+            print(f"❌ Ingest folder not found: {', '.join(missing) or '(none given)'}")
+            return
+        output_folder = input("Enter path for output folder: ").strip().strip('"')
+        red_level = self.ui.get_red_level()
+        log = self.run_log or RunLog(os.path.join(output_folder, RUN_LOG_NAME))
+        try:
+            self.watch_folders(folders, output_folder, red_level, log=log)
+        finally:
+            if log is not self.run_log:
+                log.close()
+    
+    def watch_folders(self, folders, output_folder, red_level, jobs=None, min_confidence=0.8, output_size=2000,
+                      settle_seconds=SETTLE_SECONDS, once=False, log=NULL_LOG):
+        daemon = WatchDaemon(folders, output_folder, red_level, self.calibrator, self.processor, self.detector,
+                             quality=self.quality_for(folders[0]), jobs=jobs, min_confidence=min_confidence,
+                             output_size=output_size, settle_seconds=settle_seconds, log=log)
+        return daemon.run(once=once)
+    
+    def process_single_image(self, image_path, red_level, log=NULL_LOG):
         # Load and undistort
-        image = cv2.imread(image_path)
+        with log.stage(image_path, 'decode'):
+            image = cv2.imread(image_path)
         if image is None:
+            log.finish(image_path, "failed")
             return False
             
         print(f" Image loaded: {image.shape[1]}x{image.shape[0]} pixels")
-        undistorted = self.calibrator.undistort_image(image)
+        calibrator = self.calibrator.for_file(image_path)
+        with log.stage(image_path, 'undistort'):
+            undistorted = calibrator.undistort_image(image)
         print(" Lens distortion corrected")
         
         # Detect or manually select corners (i mostly manually select)
-        corners = self.detector.detect_with_fallback(undistorted, self.ui)
+        with log.stage(image_path, 'select'):
+            corners = self.detector.detect_with_fallback(undistorted, self.ui)
         if corners is None or isinstance(corners, str):
+            log.finish(image_path, corners if isinstance(corners, str) else "failed")
             return False
         
         print(" Corners selected")
         
-        # Process and save
-        print(" Correcting perspective to 2000x2000...")
-        corrected = self.processor.correct_perspective(undistorted, corners, output_size=2000)
-        print(" Enhancing colors and correcting chromatic aberration...")
-        enhanced = self.processor.enhance_colors(corrected, red_level)
+        # Process and save (lens, perspective and chromatic aberration in one pass from the raw image)
+        print(" Correcting perspective to 2000x2000, chromatic aberration and colors...")
+        with log.stage(image_path, 'render'):
+            enhanced = self.processor.render_quadrant(image, corners, red_level, calibrator, output_size=2000)
         
         base_name = os.path.splitext(os.path.basename(image_path))[0]
         output_path = f"{base_name}_Corrected.jpg"
         
         # Save
-        cv2.imwrite(output_path, enhanced, [cv2.IMWRITE_JPEG_QUALITY, 95])
+        with log.stage(image_path, 'encode'):
+            self.processor.derivatives.write(enhanced, output_path, 95)
+        log.finish(image_path, "ok")
         
         print(f" Saved: {output_path} (2000x2000, 95% quality)")
-        return True
\ No newline at end of file
+        return True
+    
+    def process_image_auto(self, image_path, red_level, output_path=None, min_confidence=0.8, output_size=2000):
+        """Non-interactive single image, returns "ok", "review" or "failed"."""
+        log = self.run_log or NULL_LOG
+        status = self._process_image_auto(image_path, red_level, output_path, min_confidence, output_size, log)
+        log.finish(image_path, status)
+        return status
+    
+    def _process_image_auto(self, image_path, red_level, output_path, min_confidence, output_size, log):
+        # Screen and detect on a reduced decode, the full frame is only decoded to render
+        with log.stage(image_path, 'preview'):
+            reduced, factor = read_reduced(image_path, self.detector.coarse_size)
+        if reduced is None:
+            print(f"❌ Failed to load {image_path}")
+            return "failed"
+        
+        quality = self.quality_for(os.path.dirname(image_path))
+        if quality.enabled:
+            with log.stage(image_path, 'screen'):
+                metrics, problems = quality.check(reduced)
+            if problems:
+                print(f"⚠ {', '.join(problems)}")
+                if quality.action == 'skip':
+                    return "review"
+        
+        calibrator = self.calibrator.for_file(image_path)
+        with log.stage(image_path, 'detect'):
+            raw_corners, score = detect_reduced(reduced, factor, calibrator, self.detector)
+        reduced = None
+        if raw_corners is None or score < min_confidence:
+            print(f"⚠ Quadrant not detected with enough confidence ({score:.2f}), needs review")
+            return "review"
+        
+        print(f" Quadrant detected (confidence {score:.2f})")
+        with log.stage(image_path, 'decode'):
+            image = cv2.imread(image_path)
+        if image is None:
+            print(f"❌ Failed to load {image_path}")
+            return "failed"
+        with log.stage(image_path, 'refine'):
+            corners = full_resolution_corners(image, raw_corners, factor, calibrator, self.detector)
+        with log.stage(image_path, 'render'):
+            enhanced = self.processor.render_quadrant(image, corners, red_level, calibrator, output_size)
+        if output_path is None:
+            output_path = f"{os.path.splitext(os.path.basename(image_path))[0]}_Corrected.jpg"
+        with log.stage(image_path, 'encode'):
+            ok = self.processor.derivatives.write(enhanced, output_path, 98)
+        if not ok:
+            print(f"❌ Failed to write {output_path}")
+            return "failed"
+        
+        print(f" Saved: {output_path} ({output_size}x{output_size}, 98% quality)")
+        return "ok"
@@ -0,0 +1,151 @@
+import cv2
+import numpy as np
+
+from calibration import CameraCalibrator
+
+# Synthetic GoPro-like frames with known geometry, for the benchmarks (see benchmark.py).
+# Everything is drawn in the undistorted view of a known lens and then pushed
+# through that lens model, so the true corners are known to sub-pixel precision.
+
+GOPRO_SIZE = (5568, 4872)
+
+# Wide-angle barrel distortion in the range our GoPro calibrations come out at
+SYNTHETIC_DISTORTION = (-0.25, 0.07, 0.0, 0.0, 0.0)
+
+
+def synthetic_calibrator(image_size=GOPRO_SIZE, dist_coeffs=SYNTHETIC_DISTORTION):
+    # Calibrator with a known lens, not backed by a file or the profile store
+    w, h = image_size
+    focal = 0.6 * w
+    camera_matrix = np.array([[focal, 0, (w - 1) / 2.0], [0, focal, (h - 1) / 2.0], [0, 0, 1]], dtype=np.float64)
+    calibrator = CameraCalibrator(calibration_file=None, store=None)
+    calibrator._set_calibration(camera_matrix, np.array(dist_coeffs, dtype=np.float64).reshape(1, -1))
+    return calibrator
+
+
+def seabed_texture(image_size, rng):
+    """Sand/rubble-like texture: a few octaves of noise tinted the way water tints it."""
+    w, h = image_size
+    base = np.zeros((h, w), dtype=np.float32)
+    for cell, weight in ((256, 0.45), (48, 0.3), (8, 0.25)):
+        noise = rng.random((max(2, h // cell), max(2, w // cell))).astype(np.float32)
+        base += weight * cv2.resize(noise, (w, h), interpolation=cv2.INTER_CUBIC)
+    # Rocks and coral heads, the clutter the detector has to ignore
+    rocks = np.zeros((h, w), dtype=np.float32)
+    for _ in range(30):
+        center = (int(rng.integers(0, w)), int(rng.integers(0, h)))
+        axes = (int(rng.integers(w // 80, w // 20)), int(rng.integers(h // 80, h // 20)))
+        cv2.ellipse(rocks, center, axes, float(rng.uniform(0, 180)), 0, 360, float(rng.uniform(-0.3, 0.3)), -1)
+    base += cv2.GaussianBlur(rocks, (0, 0), 3)
+    # Blue-green water, weak red
+    tint = np.array([0.55, 0.6, 0.35], dtype=np.float32) * 255
+    return np.clip(base[:, :, None] * tint + 20, 0, 255).astype(np.uint8)
+
+
+def random_corners(image_size, rng, coverage=0.55, jitter=0.05):
+    """Quadrat corners (TL, TR, BR, BL) in undistorted view coordinates, roughly centred."""
+    w, h = image_size
+    side = coverage * min(w, h)
+    cx, cy = w / 2.0 + rng.uniform(-0.08, 0.08) * w, h / 2.0 + rng.uniform(-0.08, 0.08) * h
+    square = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]], dtype=np.float64) * side / 2
+    angle = rng.uniform(-0.2, 0.2)
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    corners = square @ rotation.T + (cx, cy)
+    # Per-corner jitter stands in for the camera not being straight above the frame
+    corners += rng.uniform(-jitter, jitter, (4, 2)) * side
+    return corners.astype(np.float32)
+
+
+def quadrat_frame(image_size, calibrator, corners, rng, frame_width=0.04, step=8):
+    """Raw (distorted) frame with a white quadrat whose outer corners are `corners`.
+
+    `corners` are in the calibrator's undistorted view, the same coordinates
+    QuadrantDetector returns on calibrator.undistort_image(frame).
+    """
+    w, h = image_size
+    # The frame as a mask on its own plane, outer edge at [0, size]
+    size = 2048
+    band = max(2, int(round(frame_width * size)))
+    mask = np.zeros((size, size), dtype=np.float32)
+    mask[:band] = mask[-band:] = 1.0
+    mask[:, :band] = mask[:, -band:] = 1.0
+    plane_corners = np.array([[0, 0], [size, 0], [size, size], [0, size]], dtype=np.float32)
+    # Pixel centres sit at +0.5 on the mask, so its outer edge is at 0 and size
+    to_view = cv2.getPerspectiveTransform(plane_corners, np.asarray(corners, dtype=np.float32))
+    shift = np.array([[1, 0, 0.5], [0, 1, 0.5], [0, 0, 1]], dtype=np.float64)
+    alpha = render_plane(mask, to_view @ shift, calibrator, image_size, step)
+
+    seabed = seabed_texture(image_size, rng).astype(np.float32)
+    pvc = np.array([215, 225, 228], dtype=np.float32)
+    frame = seabed * (1 - alpha[:, :, None]) + pvc * alpha[:, :, None]
+    frame += rng.normal(0, 3, (h, w, 1)).astype(np.float32)
+    # A touch of optical blur, real edges are never one pixel sharp
+    frame = cv2.GaussianBlur(frame, (0, 0), 0.8)
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+
+def chessboard_image(chessboard_size, square_px=64):
+    # Board with (w + 1) x (h + 1) squares and a one square white border;
+    # the first inner corner is at (2 * square_px, 2 * square_px)
+    cols, rows = chessboard_size[0] + 1, chessboard_size[1] + 1
+    board = np.full(((rows + 2) * square_px, (cols + 2) * square_px), 255, dtype=np.uint8)
+    for j in range(rows):
+        for i in range(cols):
+            if (i + j) % 2 == 0:
+                y, x = (j + 1) * square_px, (i + 1) * square_px
+                board[y:y + square_px, x:x + square_px] = 0
+    return board
+
+
+def chessboard_set(image_size, calibrator, chessboard_size=(8, 6), count=12, rng=None, square_px=64):
+    """Raw views of a chessboard at random poses, for calibration benchmarks."""
+    rng = rng or np.random.default_rng(0)
+    w, h = image_size
+    board = chessboard_image(chessboard_size, square_px)
+    new_camera_matrix = calibrator.get_new_camera_matrix(image_size)
+    # Board pixel centres -> board plane in square units, first inner corner at the origin
+    to_plane = np.array([[1.0 / square_px, 0, 0.5 / square_px - 2], [0, 1.0 / square_px, 0.5 / square_px - 2],
+                         [0, 0, 1]])
+    board_w, board_h = chessboard_size[0] + 3, chessboard_size[1] + 3
+
+    images = []
+    for _ in range(count):
+        # Random tilt, board filling roughly a third to a half of the frame
+        rvec = np.array([rng.uniform(-0.5, 0.5), rng.uniform(-0.5, 0.5), rng.uniform(-0.25, 0.25)])
+        rotation, _ = cv2.Rodrigues(rvec)
+        distance = board_w / rng.uniform(0.35, 0.6) * calibrator.camera_matrix[0, 0] / w
+        offset = rng.uniform(-0.2, 0.2, 2) * distance
+        center = np.array([board_w / 2 - 2, board_h / 2 - 2, 0.0])
+        tvec = np.array([offset[0], offset[1], distance]) - rotation @ center
+        # Plane -> normalised camera coordinates is [r1 r2 t]
+        plane_to_camera = np.column_stack([rotation[:, 0], rotation[:, 1], tvec])
+        to_view = new_camera_matrix @ plane_to_camera @ to_plane
+        view = render_plane(board.astype(np.float32) / 255, to_view, calibrator, image_size, background=1.0)
+        gray = view * 200 + 30 + rng.normal(0, 2, view.shape).astype(np.float32)
+        images.append(cv2.cvtColor(np.clip(gray, 0, 255).astype(np.uint8), cv2.COLOR_GRAY2BGR))
+    return images
+
+
+def render_plane(texture, to_view, calibrator, image_size, step=8, background=0.0):
+    """Draw a planar texture into a raw frame through the calibrator's lens.
+
+    `to_view` maps texture pixel coordinates to the undistorted view. The raw
+    -> view mapping is solved on a coarse grid every `step` pixels and
+    interpolated, which is far below a hundredth of a pixel for smooth lenses.
+    """
+    w, h = image_size
+    xs = np.arange(0, w + step, step, dtype=np.float64)
+    ys = np.arange(0, h + step, step, dtype=np.float64)
+    grid = np.stack(np.meshgrid(xs, ys), axis=-1).reshape(-1, 2)
+    view = calibrator.undistort_points(grid, image_size)
+    plane = cv2.perspectiveTransform(view.reshape(-1, 1, 2), np.linalg.inv(to_view))
+    coarse = plane.reshape(len(ys), len(xs), 2).astype(np.float32)
+
+    # Bilinear upsampling of the coarse map, exact on the grid nodes
+    fx = np.arange(w, dtype=np.float32) / step
+    fy = np.arange(h, dtype=np.float32) / step
+    map_x, map_y = np.meshgrid(fx, fy)
+    dense = cv2.remap(coarse, map_x, map_y, cv2.INTER_LINEAR)
+    map_x = map_y = None
+    return cv2.remap(texture, dense[:, :, 0], dense[:, :, 1], cv2.INTER_LINEAR,
+                     borderMode=cv2.BORDER_CONSTANT, borderValue=background)
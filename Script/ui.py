@@ -1,12 +1,25 @@
 import cv2
 import numpy as np
 
+WINDOW = 'Manual Corner Selection'
+LOUPE_WINDOW = 'Loupe'
+
 #the ui
 class UserInterface:
-    def __init__(self):
-        self.corners = []
+    def __init__(self, max_display=(1600, 900), loupe_radius=24, loupe_zoom=8):
+        # The full frame is shown as a screen-sized preview; the loupe shows the
+        # full-resolution pixels around the cursor, magnified, and can be clicked
+        # for sub-pixel placement
+        self.max_display = max_display
+        self.loupe_radius = loupe_radius
+        self.loupe_zoom = loupe_zoom
+        self.corners = []  # full-resolution (x, y) floats
         self.image = None
         self.original_image = None
+        self.scale = 1.0
+        self._base = None
+        self._loupe_center = None
+        self._loupe_origin = (0, 0)
     
     def get_red_level(self):
         while True:
@@ -18,77 +31,167 @@ class UserInterface:
             except ValueError:
                 print("Please enter a number")
     
+    def get_count(self, prompt, default=None):
+        # Whole number of at least 1, Enter for the default
+        while True:
+            answer = input(prompt).strip()
+            if not answer:
+                return default
+            try:
+                count = int(answer)
+                if count >= 1:
+                    return count
+                print("Please enter 1 or more")
+            except ValueError:
+                print("Please enter a number")
+    
     def manual_corner_selection(self, image):
-        self.original_image = image.copy()
-        self.image = image.copy()
+        # No copy: the frame is only read (preview and loupe crops)
+        self.original_image = image
         self.corners = []
-        
+
+        h, w = image.shape[:2]
+        self.scale = min(1.0, self.max_display[0] / w, self.max_display[1] / h)
+        if self.scale < 1.0:
+            preview = cv2.resize(image, (max(1, round(w * self.scale)), max(1, round(h * self.scale))),
+                                 interpolation=cv2.INTER_AREA)
+        else:
+            preview = image.copy()
+
+        # Grid and instructions never change, render them once
+        self.image = preview
         self._add_grid()
         self._add_instructions()
-        
-        cv2.imshow('Manual Corner Selection', self.image)
-        cv2.setMouseCallback('Manual Corner Selection', self._mouse_callback)
-        
-        while True:
-            key = cv2.waitKey(1) & 0xFF
-            if key == 27:  # ESC
-                cv2.destroyAllWindows()
-                return "cancel"
-            elif key == ord('n') or key == ord('N'):  # N - skip
-                cv2.destroyAllWindows()
-                return "skip"
-            elif key == 32 and len(self.corners) == 4:  # SPACE
-                cv2.destroyAllWindows()
-                return np.array(self.corners, dtype=np.float32)
+        self._base = self.image
+        self._loupe_center = ((w - 1) / 2.0, (h - 1) / 2.0)
+
+        cv2.namedWindow(WINDOW, cv2.WINDOW_AUTOSIZE)
+        cv2.namedWindow(LOUPE_WINDOW, cv2.WINDOW_AUTOSIZE)
+        cv2.setMouseCallback(WINDOW, self._mouse_callback)
+        cv2.setMouseCallback(LOUPE_WINDOW, self._loupe_callback)
+        self._redraw()
+
+        try:
+            while True:
+                key = cv2.waitKey(1) & 0xFF
+                if key == 27:  # ESC
+                    return "cancel"
+                elif key == ord('n') or key == ord('N'):  # N - skip
+                    return "skip"
+                elif key == 32 and len(self.corners) == 4:  # SPACE
+                    return np.array(self.corners, dtype=np.float32)
+        finally:
+            cv2.destroyAllWindows()
+            self.original_image = None
+            self.image = None
+            self._base = None
     
     def _mouse_callback(self, event, x, y, flags, param):
         if event == cv2.EVENT_LBUTTONDOWN and len(self.corners) < 4:
-            self.corners.append([x, y])
+            self._add_corner(self._to_full(x, y))
+        elif event == cv2.EVENT_RBUTTONDOWN:
+            self.corners = []
             self._redraw()
+        elif event == cv2.EVENT_MOUSEMOVE:
+            # Only the loupe follows the cursor, the preview is left alone
+            self._loupe_center = self._to_full(x, y)
+            self._draw_loupe()
+    
+    def _loupe_callback(self, event, x, y, flags, param):
+        # Clicking in the loupe places the corner at 1/zoom pixel precision
+        if event == cv2.EVENT_LBUTTONDOWN and len(self.corners) < 4:
+            x0, y0 = self._loupe_origin
+            self._add_corner((x0 + (x + 0.5) / self.loupe_zoom - 0.5,
+                              y0 + (y + 0.5) / self.loupe_zoom - 0.5))
         elif event == cv2.EVENT_RBUTTONDOWN:
             self.corners = []
             self._redraw()
     
+    def _add_corner(self, point):
+        h, w = self.original_image.shape[:2]
+        self.corners.append([min(max(point[0], 0.0), w - 1.0), min(max(point[1], 0.0), h - 1.0)])
+        self._redraw()
+    
+    def _to_full(self, x, y):
+        # Preview pixel -> full-resolution coordinates (pixel centres line up)
+        return (x + 0.5) / self.scale - 0.5, (y + 0.5) / self.scale - 0.5
+    
+    def _to_preview(self, point):
+        return (int(round((point[0] + 0.5) * self.scale - 0.5)),
+                int(round((point[1] + 0.5) * self.scale - 0.5)))
+    
     def _redraw(self):
-        if self.original_image is None:
+        if self._base is None:
             return
-        self.image = self.original_image.copy()
-        self._add_grid()
-        self._add_instructions()
-        
+        # Base layer (preview + grid + instructions) is cached, only the corners are drawn on top
+        self.image = self._base.copy()
+
         # Draw corners
         labels = ["TL", "TR", "BR", "BL"]
-        for i, corner in enumerate(self.corners):
-            cv2.circle(self.image, tuple(corner), 10, (0, 255, 0), -1)
-            cv2.putText(self.image, labels[i], (corner[0]+15, corner[1]-15),
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+        points = [self._to_preview(corner) for corner in self.corners]
+        for i, point in enumerate(points):
+            cv2.circle(self.image, point, 6, (0, 255, 0), -1)
+            cv2.putText(self.image, labels[i], (point[0]+10, point[1]-10),
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
             if i > 0:
-                cv2.line(self.image, tuple(self.corners[i-1]), tuple(corner), (0, 255, 0), 2)
-        
+                cv2.line(self.image, points[i-1], point, (0, 255, 0), 2)
+
+        cv2.putText(self.image, f"{len(self.corners)}/4", (10, 80),
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
         if len(self.corners) == 4:
-            cv2.line(self.image, tuple(self.corners[-1]), tuple(self.corners[0]), (0, 255, 0), 2)
-            cv2.putText(self.image, "SPACE to continue, N to skip", 
+            cv2.line(self.image, points[-1], points[0], (0, 255, 0), 2)
+            cv2.putText(self.image, "SPACE to continue, N to skip",
                        (10, self.image.shape[0] - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-        
-        cv2.imshow('Manual Corner Selection', self.image)
+
+        cv2.imshow(WINDOW, self.image)
+        self._draw_loupe()
+    
+    def _draw_loupe(self):
+        if self.original_image is None or self._loupe_center is None:
+            return
+        r = self.loupe_radius
+        zoom = self.loupe_zoom
+        size = 2 * r + 1
+        cx, cy = (int(round(v)) for v in self._loupe_center)
+        x0, y0 = cx - r, cy - r
+        self._loupe_origin = (x0, y0)
+
+        # Full-resolution crop, black outside the frame
+        h, w = self.original_image.shape[:2]
+        patch = np.zeros((size, size, 3), dtype=np.uint8)
+        sx0, sy0 = max(x0, 0), max(y0, 0)
+        sx1, sy1 = min(x0 + size, w), min(y0 + size, h)
+        if sx0 < sx1 and sy0 < sy1:
+            patch[sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0] = self.original_image[sy0:sy1, sx0:sx1]
+        loupe = cv2.resize(patch, (size * zoom, size * zoom), interpolation=cv2.INTER_NEAREST)
+
+        # Crosshair on the centre pixel, and any corners that fall inside
+        c = r * zoom + zoom // 2
+        cv2.line(loupe, (c, 0), (c, loupe.shape[0]), (0, 0, 255), 1)
+        cv2.line(loupe, (0, c), (loupe.shape[1], c), (0, 0, 255), 1)
+        for corner in self.corners:
+            u = (corner[0] - x0 + 0.5) * zoom - 0.5
+            v = (corner[1] - y0 + 0.5) * zoom - 0.5
+            if 0 <= u < loupe.shape[1] and 0 <= v < loupe.shape[0]:
+                cv2.circle(loupe, (int(round(u)), int(round(v))), 4, (0, 255, 0), -1)
+        cv2.imshow(LOUPE_WINDOW, loupe)
     
     def _add_grid(self):
         if self.image is None:
             return
         h, w = self.image.shape[:2]
         spacing = max(min(w, h) // 20, 1)
-        for i in range(0, w, spacing):
-            cv2.line(self.image, (i, 0), (i, h), (200, 200, 200), 1)
-        for i in range(0, h, spacing):
-            cv2.line(self.image, (0, i), (w, i), (200, 200, 200), 1)
+        # Every spacing-th column and row at once instead of a line call each
+        self.image[:, ::spacing] = (200, 200, 200)
+        self.image[::spacing, :] = (200, 200, 200)
     
     def _add_instructions(self):
         if self.image is None:
             return
         instructions = [
-            "Click corners: TL -> TR -> BR -> BL",
-            f"Right-click reset, SPACE when done ({len(self.corners)}/4), N to skip"
+            "Click corners: TL -> TR -> BR -> BL (click in the Loupe for fine placement)",
+            "Right-click reset, SPACE when done, N to skip"
         ]
         for i, text in enumerate(instructions):
-            cv2.putText(self.image, text, (10, 30 + i*25), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
\ No newline at end of file
+            cv2.putText(self.image, text, (10, 30 + i*25),
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
@@ -0,0 +1,284 @@
+import glob
+import json
+import os
+
+import cv2
+import numpy as np
+
+from instrumentation import NULL_LOG
+
+VIDEO_PATTERNS = ['*.mp4', '*.MP4', '*.mov', '*.MOV']
+
+# Inside thumbnails correlating above this are taken as the same quadrat
+SAME_QUADRAT_CORRELATION = 0.5
+THUMBNAIL_SIZE = 32
+
+
+def find_videos(folder):
+    videos = []
+    for ext in VIDEO_PATTERNS:
+        videos.extend(glob.glob(os.path.join(folder, ext)))
+    return sorted(set(videos))
+
+
+def _inside_thumbnail(gray, points):
+    # Small straightened view of the seabed inside the frame, the frame itself cropped off
+    n = THUMBNAIL_SIZE
+    margin = n // 8
+    square = np.float32([[-margin, -margin], [n + margin, -margin], [n + margin, n + margin], [-margin, n + margin]])
+    matrix = cv2.getPerspectiveTransform(np.asarray(points, dtype=np.float32), square)
+    return cv2.warpPerspective(gray, matrix, (n, n), flags=cv2.INTER_AREA)
+
+
+def read_frames(video_path, frame_indices):
+    # (frame_index, frame) for the given frames in one sequential pass; grab() skips the
+    # decode of everything else. Frame accurate, which seeking in long-GOP H.264 isn't
+    wanted = sorted(set(frame_indices))
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise IOError(f"cannot open video {video_path}")
+    try:
+        frame_index = -1
+        for target in wanted:
+            while frame_index < target:
+                if not capture.grab():
+                    return
+                frame_index += 1
+            ok, frame = capture.retrieve()
+            if not ok:
+                return
+            yield frame_index, frame
+    finally:
+        capture.release()
+
+
+class CornerTracker:
+    """Follows the four frame corners between preview frames with pyramidal Lucas-Kanade.
+
+    Each point is tracked forwards and back again; if any corner doesn't come
+    back to where it started (occlusion, blur, the frame leaving the view) the
+    track is dropped and the caller re-detects.
+    """
+
+    def __init__(self, max_error=1.0, win_size=21, max_level=3):
+        self.max_error = max_error
+        self.lk_params = dict(winSize=(win_size, win_size), maxLevel=max_level,
+                              criteria=(cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT, 30, 0.01))
+        self.gray = None
+        self.points = None
+
+    def start(self, gray, points):
+        self.gray = gray
+        self.points = np.asarray(points, dtype=np.float32).reshape(4, 1, 2)
+
+    def stop(self):
+        self.gray = None
+        self.points = None
+
+    @property
+    def active(self):
+        return self.points is not None
+
+    def update(self, gray):
+        # New (4, 2) points, or None when the track is lost
+        if self.points is None:
+            return None
+        forward, status, _ = cv2.calcOpticalFlowPyrLK(self.gray, gray, self.points, None, **self.lk_params)
+        back, status_back, _ = cv2.calcOpticalFlowPyrLK(gray, self.gray, forward, None, **self.lk_params)
+        error = np.linalg.norm((back - self.points).reshape(4, 2), axis=1)
+        h, w = gray.shape[:2]
+        points = forward.reshape(4, 2)
+        inside = np.all((points >= 0) & (points < (w, h)))
+        if not (status.all() and status_back.all() and inside and error.max() <= self.max_error):
+            self.stop()
+            return None
+        self.gray = gray
+        self.points = forward
+        return points
+
+
+class VideoTransect:
+    """Pick the best frame(s) of each quadrat in a transect video, without extracting frames.
+
+    Frames are streamed with VideoCapture; only every `stride`-th frame is
+    decoded (the rest are grabbed and skipped). Each sampled frame gets a
+    cheap score on a small grey preview: sharpness (variance of the
+    Laplacian) times quadrat visibility. The quadrat is found once with
+    QuadrantDetector and then followed with optical flow on the previews, so
+    the full detector only runs when the track is lost (or every
+    `redetect_every` samples to stop drift). A quadrat is one track; a track
+    that is lost and re-detected within `merge_gap` seconds near where it was
+    lost (a diver's hand, a blurred frame) and whose inside still looks the
+    same stays the same quadrat. For each, the `per_quadrat` best frames at
+    least `min_separation` seconds apart are picked; only their frame numbers
+    and corners are kept, read_frames() decodes them again afterwards, so a
+    long 4K transect doesn't hold a frame per pick in memory.
+    """
+
+    def __init__(self, calibrator, detector, stride=3, preview_width=640, per_quadrat=1,
+                 detect_every=5, redetect_every=30, min_separation=1.0, min_confidence=0.8, merge_gap=2.0):
+        self.calibrator = calibrator
+        self.detector = detector
+        self.stride = max(1, stride)
+        self.preview_width = preview_width
+        self.per_quadrat = max(1, per_quadrat)
+        self.detect_every = max(1, detect_every)
+        self.redetect_every = redetect_every
+        self.min_separation = min_separation
+        self.min_confidence = min_confidence
+        self.merge_gap = merge_gap
+        self.tracker = CornerTracker()
+
+    def select_frames(self, video_path):
+        """List of quadrats, each a list of picks sorted by frame:
+        {'frame_index', 'time_s', 'score', 'sharpness', 'raw_corners'}
+        with raw_corners in raw (distorted) full resolution pixels."""
+        capture = cv2.VideoCapture(video_path)
+        if not capture.isOpened():
+            raise IOError(f"cannot open video {video_path}")
+        fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+        quadrats = []
+        current = None
+        last_seen = None  # (time, thumbnail of the inside) of the last tracked frame
+        last_detect = -self.detect_every
+        track_confidence = 0.0
+        samples = 0
+        frame_index = -1
+        self.tracker.stop()
+        try:
+            while True:
+                # grab() skips decoding of the frames we don't look at
+                frame_index += 1
+                if frame_index % self.stride:
+                    if not capture.grab():
+                        break
+                    continue
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                samples += 1
+
+                h, w = frame.shape[:2]
+                scale = self.preview_width / w if w > self.preview_width else 1.0
+                preview = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else frame
+                gray = cv2.cvtColor(preview, cv2.COLOR_BGR2GRAY)
+
+                points = self.tracker.update(gray) if self.tracker.active else None
+                due = (points is None and samples - last_detect >= self.detect_every) or \
+                      (points is not None and self.redetect_every and samples - last_detect >= self.redetect_every)
+                if due:
+                    last_detect = samples
+                    found, score = self._detect(frame)
+                    if found is not None and score >= self.min_confidence:
+                        points = found * scale
+                        track_confidence = score
+                        self.tracker.start(gray, points)
+
+                if points is None:
+                    current = None
+                    continue
+                time_s = frame_index / fps
+                inside = _inside_thumbnail(gray, points)
+                if current is None:
+                    if quadrats and self._same_quadrat(last_seen, time_s, inside):
+                        current = quadrats[-1]
+                    else:
+                        current = []
+                        quadrats.append(current)
+                last_seen = (time_s, inside)
+
+                sharpness = float(cv2.Laplacian(gray, cv2.CV_32F).var())
+                self._keep(current, {
+                    'frame_index': frame_index,
+                    'time_s': time_s,
+                    'score': sharpness * track_confidence,
+                    'sharpness': sharpness,
+                    'raw_corners': (np.asarray(points, dtype=np.float64) / scale).tolist(),
+                })
+        finally:
+            capture.release()
+            self.tracker.stop()
+        return [sorted(picks, key=lambda pick: pick['frame_index']) for picks in quadrats if picks]
+
+    def _detect(self, frame):
+        # Full detector on the undistorted frame; corners back in raw pixels for tracking
+        h, w = frame.shape[:2]
+        calibrator = self.calibrator.for_size((w, h))
+        corners, score = self.detector.detect_with_score(calibrator.undistort_image(frame))
+        if corners is None:
+            return None, 0.0
+        return calibrator.distort_points(corners, (w, h)).astype(np.float32), score
+
+    def _same_quadrat(self, last_seen, time_s, inside):
+        # Divers centre every quadrat, so position says little; compare what's inside
+        if last_seen is None or time_s - last_seen[0] > self.merge_gap:
+            return False
+        return float(cv2.matchTemplate(inside, last_seen[1], cv2.TM_CCOEFF_NORMED)[0, 0]) > SAME_QUADRAT_CORRELATION
+    
+    def _keep(self, picks, candidate):
+        # Top per_quadrat by score; a frame close in time to a kept one competes with it only
+        separation = self.min_separation
+        for i, pick in enumerate(picks):
+            if abs(pick['time_s'] - candidate['time_s']) < separation:
+                if candidate['score'] > pick['score']:
+                    picks[i] = candidate
+                return
+        if len(picks) < self.per_quadrat:
+            picks.append(candidate)
+            return
+        worst = min(range(len(picks)), key=lambda i: picks[i]['score'])
+        if candidate['score'] > picks[worst]['score']:
+            picks[worst] = candidate
+
+
+def process_video(video_path, output_folder, processor, calibrator, detector, red_level,
+                  output_size=2000, per_quadrat=1, stride=3, min_confidence=0.8, quality=98, log=NULL_LOG):
+    """Render the best frame(s) of every quadrat in a video through the usual chain.
+
+    Writes <video>_q<NN>_f<frame>_Corrected.jpg per pick and <video>_frames.json
+    with the frame numbers, times, scores and corners. Returns the output paths.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    name = os.path.splitext(os.path.basename(video_path))[0]
+    print(f"\n🎞 Scanning {os.path.basename(video_path)} (every {stride} frame(s))...")
+    transect = VideoTransect(calibrator, detector, stride=stride, per_quadrat=per_quadrat,
+                             min_confidence=min_confidence)
+    with log.stage(video_path, 'scan'):
+        quadrats = transect.select_frames(video_path)
+    log.finish(video_path, 'scanned' if quadrats else 'no quadrat', quadrats=len(quadrats))
+    print(f" Found {len(quadrats)} quadrat(s)")
+
+    outputs = []
+    picks_index = []
+    # Second pass over the video for just the picked frames, one in memory at a time
+    picked = {pick['frame_index']: (q, pick) for q, picks in enumerate(quadrats, 1) for pick in picks}
+    for frame_index, frame in read_frames(video_path, picked):
+        q, pick = picked.pop(frame_index)
+        h, w = frame.shape[:2]
+        output_path = os.path.join(output_folder, f"{name}_q{q:02d}_f{pick['frame_index']:06d}_Corrected.jpg")
+        frame_calibrator = calibrator.for_size((w, h))
+        # Tracked corners are preview accurate, refine them on the undistorted frame
+        with log.stage(output_path, 'refine'):
+            corners = frame_calibrator.undistort_points(pick['raw_corners'], (w, h)).astype(np.float32)
+            accuracy = w / transect.preview_width
+            corners = detector.refine_corners(frame_calibrator.undistort_image(frame), corners, accuracy)
+
+        with log.stage(output_path, 'render'):
+            enhanced = processor.render_quadrant(frame, corners, red_level, frame_calibrator, output_size)
+        with log.stage(output_path, 'encode'):
+            written = processor.derivatives.write(enhanced, output_path, quality)
+        if not written:
+            print(f" ❌ Failed to write {output_path}")
+            log.finish(output_path, 'failed')
+            continue
+        log.finish(output_path, 'ok')
+        outputs.append(output_path)
+        picks_index.append(dict(pick, quadrat=q, corners=corners.tolist(),
+                                output=os.path.basename(output_path)))
+        print(f" Saved: {os.path.basename(output_path)} (t={pick['time_s']:.1f}s, sharpness {pick['sharpness']:.0f})")
+
+    with open(os.path.join(output_folder, f"{name}_frames.json"), 'w', encoding='utf-8') as f:
+        json.dump({'video': os.path.basename(video_path), 'frames': picks_index}, f, indent=2)
+    for q, pick in picked.values():
+        print(f" ❌ Frame {pick['frame_index']} of quadrat {q} could not be read again")
+    return outputs
@@ -0,0 +1,336 @@
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from instrumentation import NULL_LOG
+from manifest import RunManifest
+from processing import IMAGE_PATTERNS, output_path_for, _init_render_worker, _detect_job, _refine_render_job
+from quality import QualityScreen
+
+WATCH_STATUS_NAME = "watch_status.json"
+WATCH_REVIEW_NAME = "review.csv"
+
+IMAGE_EXTENSIONS = tuple(sorted({pattern[1:].lower() for pattern in IMAGE_PATTERNS}))
+
+# A file counts as copied once its size and mtime haven't changed for this long
+SETTLE_SECONDS = 5.0
+# Settled but still without an end marker after this many settle times: the copy was cut off
+STALLED_SETTLES = 6
+POLL_SECONDS = 2.0
+RECENT_COUNT = 20
+
+
+def _looks_complete(path):
+    # A JPEG still being copied has no end-of-image marker yet, a PNG no IEND chunk
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - 4096))
+            tail = f.read()
+    except OSError:
+        return False
+    if path.lower().endswith('.png'):
+        return b'IEND' in tail[-12:]
+    return b'\xff\xd9' in tail  # some cameras put a few bytes after the marker
+
+
+class FolderWatcher:
+    """Polls ingest folders (and their subfolders) for new images.
+
+    scan() returns the images that appeared since the last call and have
+    finished copying: unchanged in size and mtime for settle_seconds, and
+    with an end-of-image marker (files that stop growing without one go to
+    `stalled`). Polling works the same on every OS and on SD card readers
+    and network shares, where change notifications don't.
+    """
+
+    def __init__(self, folders, settle_seconds=SETTLE_SECONDS):
+        self.folders = list(folders)
+        self.settle_seconds = settle_seconds
+        self.seen = set()
+        self.settling = {}  # path -> (size, mtime, unchanged since)
+        self.stalled = []
+
+    def _files(self):
+        for folder in self.folders:
+            for root, dirs, names in os.walk(folder):
+                dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+                for name in sorted(names):
+                    if name.lower().endswith(IMAGE_EXTENSIONS) and not name.startswith('.'):
+                        yield folder, os.path.join(root, name)
+
+    def scan(self):
+        # [(ingest folder, image path)] ready to process, in folder order
+        now = time.monotonic()
+        ready = []
+        for folder, path in self._files():
+            if path in self.seen:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            size, mtime, since = self.settling.get(path, (None, None, now))
+            if (stat.st_size, stat.st_mtime) != (size, mtime):
+                self.settling[path] = (stat.st_size, stat.st_mtime, now)
+                continue
+            if now - since < self.settle_seconds:
+                continue
+            if _looks_complete(path):
+                ready.append((folder, path))
+            elif now - since >= STALLED_SETTLES * self.settle_seconds:
+                self.stalled.append(path)
+            else:
+                continue
+            del self.settling[path]
+            self.seen.add(path)
+        return ready
+
+
+class WatchDaemon:
+    """Processes images as they arrive in the ingest folders.
+
+    An asyncio pipeline: the watcher feeds a detect stage (reduced decode,
+    quality screen, detection) that feeds a render stage (full decode, corner
+    refinement, undistort + warp + colour, encode). Both stages run the batch
+    worker functions on one process pool; only paths and corners go between
+    the processes, never full frames. The queues between the stages are
+    bounded, so when rendering falls behind detection waits, and when
+    detection waits the watcher stops picking up new files (they stay on disk
+    until there is room). Images that need manual corners go to review.csv.
+
+    Output goes to <output_folder>/<ingest folder name>/<same subfolders>,
+    each with its own run manifest, so restarting the daemon skips what is
+    done. The interactive batch works on one folder pair, so for the review
+    images run it per image folder on that folder and its output folder
+    (printed at the end, see review_folders()): only those are shown,
+    everything rendered here is already up to date. The status file is
+    rewritten every poll.
+    """
+
+    def __init__(self, folders, output_folder, red_level, calibrator, processor, detector, quality=None,
+                 jobs=None, min_confidence=0.8, output_size=2000, settle_seconds=SETTLE_SECONDS,
+                 poll_seconds=POLL_SECONDS, log=NULL_LOG):
+        self.folders = [os.path.abspath(folder) for folder in folders]
+        self.output_folder = output_folder
+        self.red_level = red_level
+        self.calibrator = calibrator
+        self.processor = processor
+        self.detector = detector
+        self.quality = quality or QualityScreen()
+        self.jobs = jobs or os.cpu_count() or 1
+        self.min_confidence = min_confidence
+        self.output_size = output_size
+        self.poll_seconds = poll_seconds
+        self.log = log
+        self.watcher = FolderWatcher(self.folders, settle_seconds)
+        self.runs = {}
+        self.counts = {'done': 0, 'review': 0, 'failed': 0, 'up_to_date': 0}
+        self.active = {}  # image path -> stage
+        self.recent = []
+        self.review = []
+        self.started = time.time()
+
+    def _output_dir(self, folder, image_path):
+        relative = os.path.relpath(os.path.dirname(image_path), folder)
+        return os.path.normpath(os.path.join(self.output_folder, os.path.basename(folder), relative))
+
+    def review_folders(self):
+        # (image folder, output folder) pairs for the interactive batch, one per folder with review images
+        pairs = set()
+        for image_path, _, _ in self.review:
+            folder = next((folder for folder in self.folders if image_path.startswith(folder + os.sep)), None)
+            if folder is not None:
+                pairs.add((os.path.dirname(image_path), self._output_dir(folder, image_path)))
+        return sorted(pairs)
+
+    def _run(self, output_dir):
+        if output_dir not in self.runs:
+            os.makedirs(output_dir, exist_ok=True)
+            self.runs[output_dir] = RunManifest(output_dir)
+        return self.runs[output_dir]
+
+    def _save_runs(self):
+        # The manifests save in batches, write out the rest while the folders are quiet
+        for run in self.runs.values():
+            run.save()
+
+    def run(self, once=False):
+        """Watch until interrupted (Ctrl+C), or with once=True until everything
+        already in the folders is processed. Returns the counts."""
+        os.makedirs(self.output_folder, exist_ok=True)
+        print(f"\n👀 Watching {', '.join(self.folders)} on {self.jobs} processes, output in {self.output_folder}")
+        print(" Press Ctrl+C to stop")
+        try:
+            asyncio.run(self._main(once))
+        except KeyboardInterrupt:
+            print("\n⏹ Stopped, images not finished yet are picked up again on the next start")
+        self._save_runs()
+        self._write_status()
+        print(f"\n Saved: {self.counts['done']}, needs review: {self.counts['review']}, "
+              f"failed: {self.counts['failed']}, already up to date: {self.counts['up_to_date']}")
+        folders = self.review_folders()
+        if folders:
+            print(" For manual corners, run the interactive batch (menu option 2) on:")
+            for input_folder, output_dir in folders:
+                print(f"   {input_folder} -> {output_dir}")
+        self.log.print_summary()
+        return self.counts
+
+    async def _main(self, once):
+        detect_queue = asyncio.Queue(maxsize=2 * self.jobs)
+        render_queue = asyncio.Queue(maxsize=self.jobs)
+        pool = ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_render_worker,
+                                   initargs=(self.calibrator.spec(), self.processor.max_memory,
+                                             (self.log.enabled, self.log.trace_memory), self.detector.settings(),
+                                             self.quality.thresholds,
+                                             self.processor.derivative_settings(self.jobs)))
+        stages = [asyncio.create_task(self._detect_stage(pool, detect_queue, render_queue))
+                  for _ in range(self.jobs)]
+        stages += [asyncio.create_task(self._render_stage(pool, render_queue)) for _ in range(self.jobs)]
+        try:
+            await self._watch(detect_queue, once)
+            await detect_queue.join()
+            await render_queue.join()
+        finally:
+            for task in stages:
+                task.cancel()
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    async def _watch(self, detect_queue, once):
+        loop = asyncio.get_running_loop()
+        while True:
+            ready = await loop.run_in_executor(None, self.watcher.scan)
+            while self.watcher.stalled:
+                self._finish(self.watcher.stalled.pop(0), "failed", "incomplete file, copy cut off?", 0.0, [])
+            for folder, image_path in ready:
+                output_dir = self._output_dir(folder, image_path)
+                run = self._run(output_dir)
+                # Hashing a 10-20 MB frame takes a moment, keep it off the event loop
+                signature = await loop.run_in_executor(None, run.signature, image_path)
+                if run.is_current(os.path.basename(image_path), signature, self.calibrator.for_file(image_path),
+                                  self.red_level, self.output_size, self.processor.derivatives.key()):
+                    self.counts['up_to_date'] += 1
+                    continue
+                self.active[image_path] = 'queued'
+                # Blocks while the pipeline is full: that's the backpressure
+                await detect_queue.put((image_path, output_dir, signature))
+            self._write_status()
+            self._save_runs()
+            if once and not ready and not self.watcher.settling:
+                return
+            await asyncio.sleep(self.poll_seconds)
+
+    async def _detect_stage(self, pool, detect_queue, render_queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            image_path, output_dir, signature = await detect_queue.get()
+            # task_done() whatever happens, or join() waits forever and the stage is gone
+            try:
+                self.active[image_path] = 'detect'
+                try:
+                    status, message, score, raw_corners, factor, stages, problems = await loop.run_in_executor(
+                        pool, _detect_job, image_path, self.min_confidence)
+                except Exception as e:
+                    status, message, score, raw_corners, factor, stages, problems = \
+                        "failed", str(e), 0.0, None, 1, None, []
+                self.log.add_stages(image_path, stages or {})
+                if status == "ok":
+                    self.active[image_path] = 'waiting to render'
+                    await render_queue.put((image_path, output_dir, signature, raw_corners, factor, score, problems))
+                else:
+                    self._finish(image_path, status, message, score, problems)
+            except Exception as e:
+                self._stage_error(image_path, e)
+            finally:
+                detect_queue.task_done()
+
+    async def _render_stage(self, pool, render_queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            image_path, output_dir, signature, raw_corners, factor, score, problems = await render_queue.get()
+            try:
+                self.active[image_path] = 'render'
+                output_path = output_path_for(image_path, output_dir)
+                try:
+                    status, message, corners, image_size, stages = await loop.run_in_executor(
+                        pool, _refine_render_job, image_path, raw_corners, factor, self.red_level, output_path,
+                        self.output_size)
+                except Exception as e:
+                    status, message, corners, image_size, stages = "failed", str(e), None, None, None
+                self.log.add_stages(image_path, stages or {})
+                if status == "ok":
+                    name = os.path.basename(image_path)
+                    run = self._run(output_dir)
+                    image_calibrator = self.calibrator.for_file(image_path)
+                    run.record_corners(name, signature, image_size, corners, image_calibrator)
+                    run.record_render(name, self.red_level, image_calibrator, output_path, self.output_size,
+                                      self.processor.derivatives.key())
+                self._finish(image_path, status, message, score, problems)
+            except Exception as e:
+                self._stage_error(image_path, e)
+            finally:
+                render_queue.task_done()
+
+    def _stage_error(self, image_path, error):
+        # Bookkeeping failed (e.g. the run manifest not writable): count it as failed and carry on
+        self.active.pop(image_path, None)
+        self.counts['failed'] += 1
+        print(f" ❌ {os.path.basename(image_path)}: {error}")
+
+    def _finish(self, image_path, status, message, score, problems):
+        self.active.pop(image_path, None)
+        state = {"ok": 'done', "review": 'review'}.get(status, 'failed')
+        self.counts[state] += 1
+        if problems:
+            self.log.finish(image_path, status, score=round(score, 3), quality=problems)
+        else:
+            self.log.finish(image_path, status, score=round(score, 3))
+        name = os.path.basename(image_path)
+        if state == 'done':
+            print(f" Saved: {os.path.basename(message)} (confidence {score:.2f})")
+        elif state == 'review':
+            self.review.append((image_path, message, score))
+            try:
+                self._write_review()
+            except OSError as e:
+                print(f"⚠ Could not write {WATCH_REVIEW_NAME}: {e}")
+            print(f" {name}: needs review, {message}")
+        else:
+            print(f" ❌ {name}: {message}")
+        self.recent.append({'image': image_path, 'status': status, 'message': message,
+                            'time': time.strftime('%Y-%m-%dT%H:%M:%S')})
+        del self.recent[:-RECENT_COUNT]
+
+    def _write_review(self):
+        # Imported here, cli imports this module
+        from cli import write_review_list
+        write_review_list(os.path.join(self.output_folder, WATCH_REVIEW_NAME), self.review)
+
+    def _write_status(self):
+        # Rewritten as a whole, anything (a script, a phone on the laptop's share) can poll it
+        elapsed = time.time() - self.started
+        stages = {}
+        for stage in self.active.values():
+            stages[stage] = stages.get(stage, 0) + 1
+        status = {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'updated': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'folders': self.folders,
+            'copying': len(self.watcher.settling),
+            'in_progress': stages,
+            'counts': self.counts,
+            'images_per_minute': round(self.counts['done'] * 60 / elapsed, 1) if elapsed > 0 else 0.0,
+            'review': [{'image': path, 'reason': reason} for path, reason, _ in self.review],
+            'review_folders': [{'input': input_folder, 'output': output_dir}
+                               for input_folder, output_dir in self.review_folders()],
+            'recent': self.recent,
+        }
+        path = os.path.join(self.output_folder, WATCH_STATUS_NAME)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(status, f, indent=2)
+        os.replace(tmp_path, path)
@@ -0,0 +1,417 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from instrumentation import NULL_LOG
+from processing import find_images, output_path_for, _init_render_worker, _render_job, _auto_job
+
+QUEUE_SETTINGS_NAME = "queue.json"
+
+# One folder per job state, a job is one small JSON file that moves between them with
+# os.rename, which is atomic on local disks, NFS and SMB: of two hosts renaming the
+# same pending file only one succeeds, the other gets FileNotFoundError
+QUEUE_STATES = ('pending', 'leases', 'done', 'review', 'failed', 'workers')
+
+HEARTBEAT_SECONDS = 10
+LEASE_TIMEOUT = 120   # no heartbeat for this long and the worker's leases go back to pending
+MAX_ATTEMPTS = 3
+
+
+def _write_json(path, data):
+    # Write next to the target and swap in, readers on other hosts never see half a file
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _portable_path(path, root):
+    # Relative to the queue when possible, so hosts can mount the share in different places
+    try:
+        return os.path.relpath(os.path.abspath(path), os.path.abspath(root))
+    except ValueError:  # another drive on Windows
+        return os.path.abspath(path)
+
+
+class WorkQueue:
+    """A render queue in a folder on a shared file system.
+
+    queue.json holds the input and output folders, the render settings and
+    the calibration fingerprint, so every host renders the same way. Each image is a job file:
+
+        pending/<image>.json            waiting
+        leases/<image>.json@<worker>    claimed by a worker
+        done/, review/, failed/         finished, with the result
+        workers/<worker>.json           the worker's heartbeat
+
+    A worker claims a job by renaming it into leases/ under its own id and
+    rewrites its heartbeat file every few seconds. Leases of a worker whose
+    heartbeat is older than the lease timeout are put back in pending/ by any
+    other worker. Times are compared between file modification times only,
+    which the file server sets, so the hosts' clocks don't need to agree.
+    """
+
+    VERSION = 1
+
+    def __init__(self, root, settings=None):
+        self.root = root
+        self.settings = settings or {}
+
+    @classmethod
+    def create(cls, root, input_folder, output_folder, settings):
+        for state in QUEUE_STATES:
+            os.makedirs(os.path.join(root, state), exist_ok=True)
+        path = os.path.join(root, QUEUE_SETTINGS_NAME)
+        queue = cls(root, dict(settings, version=cls.VERSION, input_folder=_portable_path(input_folder, root),
+                               output_folder=_portable_path(output_folder, root)))
+        if os.path.exists(path):
+            existing = cls.open(root)
+            if (os.path.abspath(existing.input_folder), os.path.abspath(existing.output_folder)) != \
+               (os.path.abspath(input_folder), os.path.abspath(output_folder)):
+                raise ValueError(f"{root} is already a queue for {existing.input_folder} -> {existing.output_folder}")
+            # Adding images is fine, changing how the queue renders halfway through is not
+            if json.loads(json.dumps(queue.settings)) != existing.settings:
+                raise ValueError(f"{root} was queued with other render settings, use a new queue folder")
+            return existing
+        _write_json(path, queue.settings)
+        return queue
+
+    @classmethod
+    def open(cls, root):
+        path = os.path.join(root, QUEUE_SETTINGS_NAME)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"no work queue in {root} ({QUEUE_SETTINGS_NAME} missing)")
+        settings = _read_json(path)
+        if settings.get('version') != cls.VERSION:
+            raise ValueError(f"Unsupported work queue version: {settings.get('version')}")
+        return cls(root, settings)
+
+    def check_calibration(self, calibrator):
+        # The render settings don't cover the lens model, each host loads its own store
+        expected = self.settings.get('calibration')
+        if expected is not None and expected != calibrator.selection_fingerprint():
+            raise ValueError(f"this host's calibration ({calibrator.selection_fingerprint()}) differs from the "
+                             f"one the queue was made with ({expected}), copy that calibration store here "
+                             f"or point --calibration-store at it")
+
+    def _folder(self, path):
+        return path if os.path.isabs(path) else os.path.normpath(os.path.join(self.root, path))
+
+    @property
+    def input_folder(self):
+        return self._folder(self.settings['input_folder'])
+
+    @property
+    def output_folder(self):
+        return self._folder(self.settings['output_folder'])
+
+    def _path(self, state, name):
+        return os.path.join(self.root, state, name)
+
+    def _jobs(self, state):
+        try:
+            return sorted(name for name in os.listdir(os.path.join(self.root, state)) if not name.endswith('.tmp'))
+        except FileNotFoundError:
+            return []
+
+    def known(self):
+        # Job names in any state
+        names = set()
+        for state in QUEUE_STATES[:-1]:
+            names.update(name.rpartition('@')[0] if state == 'leases' else name for name in self._jobs(state))
+        return names
+
+    def enqueue(self, images):
+        """Add jobs for (filename, corners, image_size) not already in the queue.
+
+        corners None means auto-detect. Returns the number of jobs added.
+        """
+        known = self.known()
+        added = 0
+        for filename, corners, image_size in images:
+            name = filename + ".json"
+            if name in known:
+                continue
+            job = {'image': filename, 'attempts': 0}
+            if corners is not None:
+                job['corners'] = np.asarray(corners, dtype=float).reshape(4, 2).tolist()
+                job['image_size'] = [int(image_size[0]), int(image_size[1])]
+            _write_json(self._path('pending', name), job)
+            added += 1
+        return added
+
+    def claim(self, worker_id):
+        # (name, job) of the first pending job this worker won, or None when there are none
+        for name in self._jobs('pending'):
+            lease = self._path('leases', f"{name}@{worker_id}")
+            try:
+                os.rename(self._path('pending', name), lease)
+            except FileNotFoundError:
+                continue  # another worker got it
+            try:
+                return name, _read_json(lease)
+            except (OSError, ValueError) as e:
+                self.finish(name, worker_id, 'failed', {'image': name[:-len(".json")], 'last_error': str(e)})
+        return None
+
+    def finish(self, name, worker_id, state, job):
+        """Move a leased job to done, review or failed with its result.
+
+        Returns False when the lease was lost (requeued after a missed
+        heartbeat); the job then belongs to whoever claims it next.
+        """
+        target = self._path(state, name)
+        try:
+            os.rename(self._path('leases', f"{name}@{worker_id}"), target)
+        except FileNotFoundError:
+            return False
+        _write_json(target, job)
+        return True
+
+    def release(self, name, worker_id, job=None):
+        # Back to pending, with an updated job (attempts, last error) if given
+        lease = self._path('leases', f"{name}@{worker_id}")
+        if not os.path.exists(lease):
+            return False  # lost, don't write a new lease back
+        try:
+            if job is not None:
+                _write_json(lease, job)
+            os.rename(lease, self._path('pending', name))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def heartbeat(self, worker_id, info):
+        # Returns the file server's idea of now, the clock leases are timed against
+        path = self._path('workers', worker_id + ".json")
+        _write_json(path, info)
+        return os.stat(path).st_mtime
+
+    def leave(self, worker_id):
+        try:
+            os.remove(self._path('workers', worker_id + ".json"))
+        except FileNotFoundError:
+            pass
+
+    def live_workers(self, now, timeout=LEASE_TIMEOUT):
+        workers = {}
+        for name in self._jobs('workers'):
+            path = self._path('workers', name)
+            try:
+                if now - os.stat(path).st_mtime <= timeout:
+                    workers[name[:-len(".json")]] = _read_json(path)
+            except (OSError, ValueError):
+                continue
+        return workers
+
+    def requeue_abandoned(self, worker_id, now, timeout=LEASE_TIMEOUT, max_attempts=MAX_ATTEMPTS):
+        """Put the leases of workers without a recent heartbeat back in pending.
+
+        The lease is first taken over by this worker (a rename, so only one
+        worker requeues it) and counts as an attempt; a job that keeps killing
+        its workers ends up in failed. Returns the number of jobs requeued.
+        """
+        alive = self.live_workers(now, timeout)
+        for name in self._jobs('workers'):
+            if name[:-len(".json")] not in alive and name[:-len(".json")] != worker_id:
+                self.leave(name[:-len(".json")])
+        requeued = 0
+        for lease in self._jobs('leases'):
+            name, _, owner = lease.rpartition('@')
+            if owner in alive or owner == worker_id:
+                continue
+            try:
+                os.rename(self._path('leases', lease), self._path('leases', f"{name}@{worker_id}"))
+                job = _read_json(self._path('leases', f"{name}@{worker_id}"))
+            except (OSError, ValueError):
+                continue
+            job['attempts'] = job.get('attempts', 0) + 1
+            job['last_error'] = f"worker {owner} stopped responding"
+            if job['attempts'] >= max_attempts:
+                self.finish(name, worker_id, 'failed', job)
+            else:
+                self.release(name, worker_id, job)
+                requeued += 1
+        return requeued
+
+    def counts(self):
+        return {state: len(self._jobs(state)) for state in QUEUE_STATES[:-1]}
+
+    def results(self, state):
+        results = []
+        for name in self._jobs(state):
+            try:
+                results.append(_read_json(self._path(state, name)))
+            except (OSError, ValueError):
+                continue
+        return results
+
+
+def queue_images(input_folder, corners_manifest=None):
+    # Jobs for a survey folder: every image auto-detected, or only the annotated
+    # ones with their corners when there is a corners manifest
+    if corners_manifest is not None:
+        return [(name, entry['corners'], (entry['width'], entry['height']))
+                for name, entry in corners_manifest.ready()]
+    return [(os.path.basename(path), None, None) for path in find_images(input_folder)]
+
+
+class QueueWorker:
+    """Pulls jobs from a WorkQueue and renders them on `jobs` local processes.
+
+    The render workers are the batch ones (processing._init_render_worker),
+    built from the queue's settings and this host's calibration (checked
+    against the queue's with WorkQueue.check_calibration), so a job
+    renders exactly as it would in batch_process_auto or
+    batch_render_manifest. The main process only claims, heartbeats and
+    reports. Runs until the queue is empty and no other worker holds a
+    lease, or forever with wait=True (polling for new jobs).
+    """
+
+    def __init__(self, queue, calibrator, max_memory, jobs=None, lease_timeout=LEASE_TIMEOUT,
+                 heartbeat_seconds=HEARTBEAT_SECONDS, poll_seconds=2.0, log=NULL_LOG):
+        self.queue = queue
+        self.calibrator = calibrator
+        self.max_memory = max_memory
+        self.jobs = jobs or os.cpu_count() or 1
+        self.lease_timeout = lease_timeout
+        self.heartbeat_seconds = heartbeat_seconds
+        self.poll_seconds = poll_seconds
+        self.log = log
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}".replace('@', '_')
+        self.counts = {'done': 0, 'review': 0, 'failed': 0}
+        self.now = 0.0
+        self._stop = threading.Event()
+
+    def _info(self):
+        return {'host': socket.gethostname(), 'pid': os.getpid(), 'jobs': self.jobs, 'counts': self.counts}
+
+    def _heartbeats(self):
+        # A thread, so a long render never makes the worker look dead
+        while not self._stop.wait(self.heartbeat_seconds):
+            try:
+                self.now = self.queue.heartbeat(self.worker_id, self._info())
+            except OSError as e:
+                print(f"⚠ Heartbeat failed: {e}")
+
+    def _submit(self, pool, job):
+        settings = self.queue.settings
+        image_path = os.path.join(self.queue.input_folder, job['image'])
+        output_path = output_path_for(image_path, self.queue.output_folder)
+        if 'corners' in job:
+            return pool.submit(_render_job, image_path, job['image_size'],
+                               np.array(job['corners'], dtype=np.float32), settings['red_level'],
+                               output_path, settings['output_size'])
+        return pool.submit(_auto_job, image_path, settings['red_level'], settings['min_confidence'],
+                           output_path, None, settings['output_size'])
+
+    def _report(self, name, job, future):
+        image_path = os.path.join(self.queue.input_folder, job['image'])
+        try:
+            result = future.result()
+        except Exception as e:
+            result = (False, str(e), None)
+        if len(result) == 3:  # _render_job
+            ok, message, stages = result
+            status, score, problems = ("ok" if ok else "failed"), None, []
+        else:
+            status, message, score, _, _, stages, problems = result
+        self.log.add_stages(image_path, stages or {})
+        self.log.finish(image_path, status)
+
+        job = dict(job, status=status, message=message, worker=self.worker_id)
+        if stages:
+            job['stages'] = {stage: round(seconds, 3) for stage, (seconds, _) in stages.items()}
+        if score is not None:
+            job['score'] = round(score, 3)
+        if problems:
+            job['quality'] = problems
+        if status == "failed":
+            job['attempts'] = job.get('attempts', 0) + 1
+            job['last_error'] = message
+            if job['attempts'] < MAX_ATTEMPTS:
+                self.queue.release(name, self.worker_id, job)
+                print(f" {job['image']}: {message}, requeued (attempt {job['attempts']})")
+                return
+        state = {"ok": 'done', "review": 'review'}.get(status, 'failed')
+        if not self.queue.finish(name, self.worker_id, state, job):
+            print(f"⚠ Lease on {job['image']} was lost, another worker will redo it")
+            return
+        self.counts[state] += 1
+        if state == 'done':
+            print(f" Saved: {os.path.basename(message)}")
+        else:
+            print(f" {job['image']}: {'needs review, ' if state == 'review' else ''}{message}")
+
+    def run(self, wait_for_jobs=False):
+        os.makedirs(self.queue.output_folder, exist_ok=True)
+        self.now = self.queue.heartbeat(self.worker_id, self._info())
+        heartbeats = threading.Thread(target=self._heartbeats, daemon=True)
+        heartbeats.start()
+        print(f"\n👷 Worker {self.worker_id} on {self.jobs} processes, queue {self.queue.root}")
+
+        settings = self.queue.settings
+        in_flight = {}
+        pool = ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_render_worker,
+                                   initargs=(self.calibrator.spec(), self.max_memory,
+                                             (self.log.enabled, self.log.trace_memory),
+                                             settings.get('detector'), settings.get('quality'),
+                                             settings.get('derivatives')))
+        try:
+            while True:
+                requeued = self.queue.requeue_abandoned(self.worker_id, self.now, self.lease_timeout)
+                if requeued:
+                    print(f"♻ Requeued {requeued} job(s) of workers that stopped responding")
+                while len(in_flight) < self.jobs:
+                    claimed = self.queue.claim(self.worker_id)
+                    if claimed is None:
+                        break
+                    name, job = claimed
+                    in_flight[self._submit(pool, job)] = (name, job)
+
+                if not in_flight:
+                    counts = self.queue.counts()
+                    if not wait_for_jobs and counts['pending'] == 0 and counts['leases'] == 0:
+                        break
+                    # Other workers' leases: wait in case one of them dies and its jobs come back
+                    time.sleep(self.poll_seconds)
+                    continue
+                finished, _ = wait(in_flight, timeout=self.poll_seconds, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name, job = in_flight.pop(future)
+                    self._report(name, job, future)
+        except KeyboardInterrupt:
+            print("\n⏹ Stopping, handing unfinished jobs back to the queue")
+        finally:
+            # Jobs that haven't started go straight back. Running renders are waited for (the
+            # heartbeat goes on meanwhile): released any earlier, another host could claim the
+            # job and write the same output while this one is still writing it
+            for future in in_flight:
+                future.cancel()
+            running = sum(not future.cancelled() for future in in_flight)
+            if running:
+                print(f"⏳ Waiting for {running} running render(s) to stop...")
+            pool.shutdown(wait=True)
+            for future, (name, job) in in_flight.items():
+                if not future.cancelled() and future.exception() is None:
+                    self._report(name, job, future)
+                else:
+                    self.queue.release(name, self.worker_id)
+            self._stop.set()
+            self.queue.leave(self.worker_id)
+
+        print(f"\n Worker finished: {self.counts['done']} saved, {self.counts['review']} need review, "
+              f"{self.counts['failed']} failed")
+        self.log.print_summary()
+        return self.counts
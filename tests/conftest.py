@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The scripts import each other by module name, as when run from Script/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Script'))
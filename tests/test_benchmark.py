@@ -0,0 +1,78 @@
+import copy
+import json
+
+import pytest
+
+from benchmark import BENCHMARK_VERSION, compare, load_results, save_results
+
+
+def make_results(**changes):
+    results = {
+        'version': BENCHMARK_VERSION,
+        'stages': {
+            'detect': {'median_s': 0.100, 'p95_s': 0.120, 'megapixels_per_s': 270.0, 'peak_mb': 40.0},
+            'warp': {'median_s': 0.200, 'p95_s': 0.220, 'megapixels_per_s': 135.0, 'peak_mb': 100.0},
+        },
+        'accuracy': {'detection_rate': 1.0, 'corner_error_mean_px': 0.30, 'corner_error_max_px': 0.60},
+        'calibration': {'ok': True, 'time_s': 10.0, 'images_used': 12, 'reprojection_mean_px': 0.10,
+                        'focal_error_pct': 0.2, 'principal_point_error_px': 1.0},
+    }
+    for path, value in changes.items():
+        section, key = path.split('__') if '__' in path else (path, None)
+        if key is None:
+            results[section] = value
+        elif section in results['stages']:
+            results['stages'][section][key] = value
+        else:
+            results[section][key] = value
+    return results
+
+
+def test_same_results_are_no_regression():
+    baseline = make_results()
+    assert compare(copy.deepcopy(baseline), baseline) == []
+
+
+def test_within_thresholds_is_no_regression():
+    # 20% slower, 20% more memory, 0.2 px more corner error: all under the default limits
+    results = make_results(detect__median_s=0.120, warp__peak_mb=120.0, accuracy__corner_error_mean_px=0.50)
+    assert compare(results, make_results()) == []
+
+
+@pytest.mark.parametrize('change, expected', [
+    ({'detect__median_s': 0.130}, "detect: 0.130s"),
+    ({'warp__peak_mb': 130.0}, "warp: peak 130 MB"),
+    ({'accuracy__detection_rate': 0.8}, "detection rate 80%"),
+    ({'accuracy__corner_error_mean_px': 0.60}, "corner error 0.60px"),
+    ({'calibration': {'ok': False, 'time_s': 3.0}}, "calibration failed"),
+    ({'calibration__time_s': 13.0}, "calibration: 13.0s"),
+    ({'calibration__reprojection_mean_px': 0.20}, "reprojection error 0.200px"),
+    ({'calibration__focal_error_pct': 0.8}, "focal length error 0.80%"),
+])
+def test_regressions_are_reported(change, expected):
+    regressions = compare(make_results(**change), make_results())
+    assert len(regressions) == 1
+    assert regressions[0].startswith(expected)
+
+
+def test_thresholds_can_be_overridden():
+    results = make_results(detect__median_s=0.120)
+    assert compare(results, make_results(), {'time_ratio': 1.1}) == ["detect: 0.120s vs 0.100s baseline"]
+
+
+def test_missing_stages_and_failed_baseline_calibration_are_skipped():
+    baseline = make_results(calibration={'ok': False, 'time_s': 3.0})
+    del baseline['stages']['warp']
+    results = make_results(warp__median_s=10.0, calibration={'ok': False, 'time_s': 30.0})
+    del results['stages']['detect']
+    assert compare(results, baseline) == []
+
+
+def test_results_round_trip_and_version_check(tmp_path):
+    path = str(tmp_path / 'baseline.json')
+    save_results(path, make_results())
+    assert load_results(path) == make_results()
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(make_results(version=BENCHMARK_VERSION + 1), f)
+    with pytest.raises(ValueError):
+        load_results(path)
@@ -0,0 +1,65 @@
+import cv2
+import numpy as np
+import pytest
+
+from detection import QuadrantDetector
+from synthetic import GOPRO_SIZE, quadrat_frame, random_corners, synthetic_calibrator
+
+
+def synthetic_view(image_size, seed):
+    # Undistorted synthetic frame and its true corners, what the detector sees in the pipeline
+    rng = np.random.default_rng(seed)
+    calibrator = synthetic_calibrator(image_size)
+    corners = random_corners(image_size, rng)
+    return calibrator.undistort_image(quadrat_frame(image_size, calibrator, corners, rng)), corners
+
+
+@pytest.fixture(scope='module')
+def gopro_view():
+    # Seed 1 put a corner 18 px off when the lines were fitted on the 348 px level
+    return synthetic_view(GOPRO_SIZE, 1)
+
+
+def test_frame_colour_full_resolution_corners(gopro_view):
+    image, truth = gopro_view
+    corners, score = QuadrantDetector(engines=['frame_colour']).detect_with_score(image)
+    assert corners is not None and score >= 0.8
+    assert np.linalg.norm(corners - truth, axis=1).max() < 1.0
+
+
+def test_clutter_over_a_corner_is_not_trusted_by_the_edges_engine():
+    image, truth = synthetic_view((1392, 1218), 1)
+    # A dark rock lying across the outer edge of the bar, next to the top left corner
+    near = truth[0] + 0.04 * (truth[1] - truth[0])
+    outward = (near - truth.mean(axis=0)) / np.linalg.norm(near - truth.mean(axis=0))
+    centre = near + 0.6 * 36 * outward
+    cv2.ellipse(image, (int(centre[0]), int(centre[1])), (36, 25), 30, 0, 360, (40, 60, 50), -1)
+
+    corners, score = QuadrantDetector(engines=['edges']).detect_with_score(image)
+    assert corners is None or score < 0.8
+    # The frame colour engine extrapolates the bars under the rock
+    corners, score = QuadrantDetector().detect_with_score(image)
+    assert score >= 0.8
+    assert np.linalg.norm(corners - truth, axis=1).max() < 1.5
+
+
+def test_refinement_that_finds_no_corner_lowers_the_score():
+    image = np.zeros((400, 400, 3), np.uint8)
+    cv2.rectangle(image, (100, 100), (299, 299), (255, 255, 255), -1)
+    image = cv2.GaussianBlur(image, (0, 0), 2)
+    truth = np.array([[99.5, 99.5], [299.5, 99.5], [299.5, 299.5], [99.5, 299.5]], np.float32)
+    detector = QuadrantDetector()
+
+    corners, score = detector._refined_result(image, truth + 1, 0.5, 0.96)
+    assert score == pytest.approx(0.96)
+    assert np.linalg.norm(corners - truth, axis=1).max() < 1.0
+
+    # Off in the flat black, nothing for cornerSubPix to converge on
+    one_off = truth + 1
+    one_off[0] = (91.5, 87.5)
+    corners, score = detector._refined_result(image, one_off, 0.5, 0.96)
+    assert score < detector.accept_score
+
+    two_off = one_off.copy()
+    two_off[1] = (307.5, 87.5)
+    assert detector._refined_result(image, two_off, 0.5, 0.96) == (None, 0.0)
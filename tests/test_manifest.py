@@ -0,0 +1,33 @@
+import json
+import os
+
+import numpy as np
+
+import manifest
+from manifest import RUN_MANIFEST_NAME, RunManifest
+from synthetic import synthetic_calibrator
+
+
+def test_run_manifest_saves_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(manifest, 'SAVE_EVERY', 4)
+    monkeypatch.setattr(manifest, 'SAVE_SECONDS', 3600.0)
+    calibrator = synthetic_calibrator((640, 480))
+    run = RunManifest(str(tmp_path))
+    path = os.path.join(str(tmp_path), RUN_MANIFEST_NAME)
+    corners = np.array([[100, 100], [500, 100], [500, 400], [100, 400]], dtype=np.float32)
+
+    def saved():
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)['images']
+
+    for i in range(3):
+        run.record_corners(f"{i}.jpg", {'size': 1, 'mtime': 0.0, 'sha1': str(i)}, (640, 480), corners, calibrator)
+    assert not os.path.exists(path)
+    run.record_corners("3.jpg", {'size': 1, 'mtime': 0.0, 'sha1': '3'}, (640, 480), corners, calibrator)
+    assert len(saved()) == 4
+
+    run.record_corners("4.jpg", {'size': 1, 'mtime': 0.0, 'sha1': '4'}, (640, 480), corners, calibrator)
+    assert len(saved()) == 4
+    run.save()
+    assert len(saved()) == 5
+    assert len(RunManifest(str(tmp_path)).images) == 5
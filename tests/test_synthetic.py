@@ -0,0 +1,43 @@
+import cv2
+import numpy as np
+
+from synthetic import quadrat_frame, random_corners, synthetic_calibrator
+
+SIZE = (960, 840)
+
+
+def edge_offset(red, point, outward, reach=6.0, step=0.25):
+    # Where the red channel crosses halfway between the bar and the seabed,
+    # along `outward` from `point`, in pixels (sub-pixel, linear between samples)
+    offsets = np.arange(-reach, reach + step, step)
+    values = np.array([cv2.getRectSubPix(red, (1, 1), tuple(map(float, point + d * outward)))[0, 0]
+                       for d in offsets])
+    middle = (values[:4].mean() + values[-4:].mean()) / 2
+    i = int(np.argmax(values < middle))
+    return offsets[i - 1] + step * (values[i - 1] - middle) / (values[i - 1] - values[i])
+
+
+def test_random_corners_are_a_quadrat_in_the_frame():
+    corners = random_corners(SIZE, np.random.default_rng(0))
+    assert corners.shape == (4, 2)
+    assert np.all(corners > 0) and np.all(corners < SIZE)
+    # TL, TR, BR, BL: clockwise on screen, so a positive area with y down
+    x, y = corners[:, 0], corners[:, 1]
+    assert 0.5 * np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y) > 0
+
+
+def test_quadrat_frame_outer_edges_run_through_the_true_corners():
+    rng = np.random.default_rng(3)
+    calibrator = synthetic_calibrator(SIZE)
+    corners = random_corners(SIZE, rng)
+    view = calibrator.undistort_image(quadrat_frame(SIZE, calibrator, corners, rng))
+    # White PVC against weak-red water, the clearest step is in the red channel
+    red = np.ascontiguousarray(view[:, :, 2]).astype(np.float32)
+    centre = corners.mean(axis=0)
+    for i in range(4):
+        a, b = corners[i], corners[(i + 1) % 4]
+        normal = np.array([b[1] - a[1], a[0] - b[0]]) / np.linalg.norm(b - a)
+        if normal @ ((a + b) / 2 - centre) < 0:
+            normal = -normal
+        for t in (0.25, 0.5, 0.75):
+            assert abs(edge_offset(red, a + t * (b - a), normal)) < 0.5